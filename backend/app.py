@@ -1,66 +1,304 @@
 import datetime
+import math
 import os
 import pickle
-import shutil
+import threading
+import time
 from pathlib import Path
 
+# process start, for the time-to-ready metric
+process_started = time.perf_counter()
+
 from dotenv import load_dotenv
-import pandas as pd
-from azure.storage.blob import BlobServiceClient
-from flask import Flask, jsonify, request, send_file
+import numpy as np
+from flask import Blueprint, Flask, current_app, g, jsonify, request, send_file
 from flask_cors import CORS
 
+from batching import BatchQueueFull, MicroBatcher
+from cache import PredictionCache
+from gpx_metrics import read_metrics
+from inference import SklearnPredictor, compile_model
+from metrics import Metrics, SamplingProfiler, read_worker_snapshots, write_worker_snapshot
+from model_store import file_md5, latest_model_container, sync_model
+from similar_hikes import INDEX_NAME as SIMILAR_HIKES_NAME, SimilarHikes
+from user_corrections import CORRECTIONS_NAME, UserCorrections, user_key
+
 ENV_STORAGE_KEY = "AZURE_STORAGE_CONNECTION_STRING"
+ENV_INFERENCE_KEY = "HIKEPLANNER_INFERENCE"  # "compiled" (default) or "sklearn"
+ENV_CACHE_SIZE_KEY = "HIKEPLANNER_CACHE_SIZE"  # max cached predictions, 0 disables the cache
+ENV_CACHE_TTL_KEY = "HIKEPLANNER_CACHE_TTL"  # seconds, 0 keeps entries until evicted
+ENV_DOWNLOAD_WORKERS_KEY = "HIKEPLANNER_DOWNLOAD_WORKERS"
+ENV_RELOAD_INTERVAL_KEY = "HIKEPLANNER_RELOAD_INTERVAL"  # seconds between checks for a new model, 0 disables
+ENV_PROFILE_KEY = "HIKEPLANNER_PROFILE_INTERVAL"  # seconds between profiler samples, starts the profiler at boot
+ENV_BATCH_WINDOW_KEY = "HIKEPLANNER_BATCH_WINDOW_MS"  # micro-batching window for /api/predict, 0 disables
+ENV_BATCH_MAX_KEY = "HIKEPLANNER_BATCH_MAX_ROWS"  # rows per micro-batch
+ENV_BATCH_QUEUE_KEY = "HIKEPLANNER_BATCH_QUEUE"  # waiting rows before requests are refused with 503
+ENV_USER_CACHE_BYTES_KEY = "HIKEPLANNER_USER_CACHE_BYTES"  # memory budget of the decoded per-user corrections
+MAX_UPLOAD_BYTES = 64 * 1024 * 1024
 MODEL_CONTAINER_PREFIX = "hikeplanner-model"
+FEATURE_COLUMNS = ['downhill', 'uphill', 'length_3d', 'max_elevation']
+BATCH_MAX_ROWS = 10000
+SIMILAR_MAX_K = 50
 
-# init app, load model from storage
+# models are loaded by load_initial_models(), the Flask app is built by create_app()
 env_path = Path(__file__).resolve().parent.parent / ".env"
 load_dotenv(env_path, override=True)
-print("*** Load Model from Blob Storage ***")
-if ENV_STORAGE_KEY in os.environ:
-    azureStorageConnectionString = os.environ[ENV_STORAGE_KEY]
-    blob_service_client = BlobServiceClient.from_connection_string(azureStorageConnectionString)
-
-    containers = blob_service_client.list_containers(include_metadata=True)
-    suffix = max(
-        int(container.name.split("-")[-1])
-        for container in containers
-        if container.name.startswith(MODEL_CONTAINER_PREFIX)
-    )
-    model_folder = f"{MODEL_CONTAINER_PREFIX}-{suffix}"
+local_model_dir = Path("./model")
+
+# per-stage latency histograms and counters, exposed on /metrics
+metrics = Metrics()
+profiler = SamplingProfiler()
+
+class ModelBundle:
+    """Both models of one version; replaced as a whole, never modified."""
+
+    def __init__(self, version, gradient_model, linear_model, engine, similar=None, users=None):
+        self.version = version
+        self.gradient_model = gradient_model
+        self.linear_model = linear_model
+        self.gradient_predictor = make_predictor(gradient_model, engine)
+        self.linear_predictor = make_predictor(linear_model, engine)
+        # recorded hikes for /api/similar, see similar_hikes.py
+        self.similar = similar
+        # per-user corrections of the gradient model, see user_corrections.py
+        self.users = users
+
+    def warm_up(self):
+        # first calls pay for lazy allocations, do them before serving traffic
+        sample = [[300, 700, 10000, 0], [600, 900, 15000, 0]]
+        for predictor in (self.gradient_predictor, self.linear_predictor):
+            predictor.predict(sample)
+            predictor.predict_one(sample[0])
+
+def make_predictor(model, engine):
+    if engine == "compiled":
+        try:
+            return compile_model(model)
+        except ValueError as ex:
+            print(f"cannot compile {type(model).__name__}, falling back to sklearn: {ex}")
+    return SklearnPredictor(model, FEATURE_COLUMNS)
+
+def storage_client():
+    if ENV_STORAGE_KEY not in os.environ:
+        return None
+    # imported on first use: the Azure SDK takes a good part of a second to import
+    from azure.storage.blob import BlobServiceClient
+
+    return BlobServiceClient.from_connection_string(os.environ[ENV_STORAGE_KEY])
+
+def download_model(blob_service_client, model_folder):
     print(f"using version {model_folder}")
-    
-    container_client = blob_service_client.get_container_client(model_folder)
-    blob_list = list(container_client.list_blobs())
-
-    # Download all blobs to a clean local folder
-    local_model_dir = Path("./model")
-    if local_model_dir.exists():
-        shutil.rmtree(local_model_dir)
-    local_model_dir.mkdir(parents=True, exist_ok=True)
-    for blob in blob_list:
-        download_file_path = local_model_dir / blob.name
-        print(f"downloading blob to {download_file_path.resolve()}")
-        with open(file=download_file_path, mode="wb") as download_file:
-            download_file.write(container_client.download_blob(blob.name).readall())
-
-else:
-    print("CANNOT ACCESS AZURE BLOB STORAGE - Please set AZURE_STORAGE_CONNECTION_STRING. Current env: ")
-    print(os.environ)
-
-gbr_model_path = Path(".", "model", "GradientBoostingRegressor.pkl")
-with open(gbr_model_path, 'rb') as fid:
-    gradient_model = pickle.load(fid)
-
-linear_model_path = Path(".", "model", "LinearRegression.pkl")
-with open(linear_model_path, 'rb') as fid:
-    linear_model = pickle.load(fid)
+    # reuse unchanged blobs from ./model, download the rest in parallel; returns the version's directory
+    with metrics.startup_phase("download"):
+        return sync_model(
+            blob_service_client,
+            model_folder,
+            local_model_dir,
+            max_workers=int(os.environ.get(ENV_DOWNLOAD_WORKERS_KEY, 4)),
+        )
+
+def latest_version(blob_service_client):
+    with metrics.startup_phase("list_containers"):
+        return latest_model_container(blob_service_client, MODEL_CONTAINER_PREFIX)
+
+def load_similar_hikes(model_dir):
+    path = model_dir / SIMILAR_HIKES_NAME
+    if not path.exists():
+        return None
+    try:
+        similar = SimilarHikes.load(path)
+    except (OSError, ValueError, KeyError) as ex:
+        print(f"cannot load the similar hikes index: {ex}")
+        return None
+    print(f"similar hikes index with {len(similar)} hikes")
+    return similar
+
+def load_user_corrections(model_dir):
+    if not (model_dir / CORRECTIONS_NAME).exists():
+        return None
+    try:
+        users = UserCorrections.load(model_dir)
+        if not users.matches(model_dir):
+            print("user corrections belong to another gradient model, not using them")
+            return None
+    except (OSError, ValueError, KeyError) as ex:
+        print(f"cannot load the user corrections: {ex}")
+        return None
+    print(f"corrections for {len(users)} users")
+    return users
+
+def load_models(version=None, model_dir=local_model_dir):
+    gbr_model_path = model_dir / "GradientBoostingRegressor.pkl"
+    linear_model_path = model_dir / "LinearRegression.pkl"
+    with metrics.startup_phase("unpickle"):
+        with open(gbr_model_path, 'rb') as fid:
+            gradient_model = pickle.load(fid)
+        with open(linear_model_path, 'rb') as fid:
+            linear_model = pickle.load(fid)
+
+    if version is None:
+        # no storage account, identify the local files by content
+        version = f"local-{file_md5(gbr_model_path)[:8]}"
+    # GradientBoostingRegressor.pkl holds whichever boosting estimator train_model.py --search selected
+    print(f"gradient model: {type(gradient_model).__name__}, linear model: {type(linear_model).__name__}")
+    with metrics.startup_phase("similar_hikes"):
+        similar = load_similar_hikes(model_dir)
+    with metrics.startup_phase("user_corrections"):
+        users = load_user_corrections(model_dir)
+    with metrics.startup_phase("compile"):
+        models = ModelBundle(version, gradient_model, linear_model, inference_engine, similar, users)
+        models.warm_up()
+    return models
+
+def reload_models(force=False):
+    """Load the latest model off the request path and swap it in; return True if swapped."""
+    with reload_lock:
+        current_version = active_models.version if active_models is not None else None
+        blob_service_client = storage_client()
+        if blob_service_client is not None:
+            version = latest_version(blob_service_client)
+            if version == current_version and not force:
+                return False
+            models = load_models(version, download_model(blob_service_client, version))
+        else:
+            models = load_models()
+            if models.version == current_version and not force:
+                return False
+        # a single reference assignment, requests see either the old or the new bundle
+        set_active_models(models)
+        prediction_cache.clear()
+        user_cache.clear()
+        print(f"*** Switched to model {models.version} ***")
+        return True
+
+def watch_models(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            reload_models()
+        except Exception as ex:
+            print(f"model reload failed, keeping {active_models.version if active_models else 'no model'}: {ex}")
+
+def set_active_models(models):
+    global active_models, model_state, model_error
+    active_models = models
+    metrics.model_version = models.version
+    if model_state != "ready":
+        model_state, model_error = "ready", None
+        metrics.set_startup_phase("ready", time.perf_counter() - process_started)
+
+def load_initial_models():
+    """Model loading phase: download the latest version if storage is configured, then load it."""
+    global model_state, model_error
+    print("*** Load Model from Blob Storage ***")
+    try:
+        initial_client = storage_client()
+        if initial_client is not None:
+            model_folder = latest_version(initial_client)
+            models = load_models(model_folder, download_model(initial_client, model_folder))
+        else:
+            print("CANNOT ACCESS AZURE BLOB STORAGE - Please set AZURE_STORAGE_CONNECTION_STRING. Current env: ")
+            print(os.environ)
+            models = load_models()
+    except Exception as ex:
+        model_state, model_error = "failed", str(ex)
+        raise
+    set_active_models(models)
+    return models
+
+def load_models_in_background():
+    """Start the model loading phase in a thread; the formulas are served in the meantime."""
+    def run():
+        try:
+            load_initial_models()
+        except Exception as ex:
+            print(f"*** Loading the models failed, serving the formulas only: {ex} ***")
+
+    threading.Thread(target=run, daemon=True, name="model-loader").start()
+
+def start_background_tasks():
+    """Model watcher and boot-time profiler; threads do not survive a fork, start them per process."""
+    reload_interval = float(os.environ.get(ENV_RELOAD_INTERVAL_KEY, 0))
+    if reload_interval > 0:
+        print(f"checking for new models every {reload_interval:.0f}s")
+        threading.Thread(target=watch_models, args=(reload_interval,), daemon=True, name="model-watcher").start()
+
+    profile_interval = float(os.environ.get(ENV_PROFILE_KEY, 0))
+    if profile_interval > 0:
+        print(f"sampling stacks every {profile_interval * 1000:.0f}ms")
+        profiler.start(profile_interval)
+
+def create_app(models=None, background_tasks=True, load=True):
+    """Build the Flask app around ``models``.
+
+    Without ``models`` (``flask run``) they are loaded in a background
+    thread while the app already answers with the formula estimates, and
+    /readyz reports 503 until they are in place. The prefork server in
+    serve.py loads the models in its master process and calls this in
+    every worker with ``background_tasks=False``; its first workers, forked
+    before the models exist, pass ``load=False``.
+    """
+    if models is not None:
+        set_active_models(models)
+    elif active_models is None and load:
+        load_models_in_background()
+    if background_tasks:
+        start_background_tasks()
+
+    print("\n*** Flask Backend ***")
+    app = Flask(__name__, static_url_path='/', static_folder='../frontend/build')
+    CORS(app)
+    app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+    app.before_request(start_timer)
+    app.after_request(record_request)
+    app.register_blueprint(api)
+    return app
+
+inference_engine = os.environ.get(ENV_INFERENCE_KEY, "compiled")
+print(f"using {inference_engine} inference")
+
+active_models = None
+model_state = "loading"  # "loading", "ready" or "failed"
+model_error = None
+reload_lock = threading.Lock()
+# set by serve.py in prefork workers: asks the master for a graceful restart instead of reloading one worker
+request_restart = None
+# set by serve.py in prefork workers: directory where every worker publishes its metrics, see metrics.py
+metrics_dir = None
+# set by serve.py in prefork workers: spawn number of this worker, names its metrics file
+worker_id = None
+
+# finished /api/predict payloads, keyed on the request values and model version
+prediction_cache = PredictionCache(
+    maxsize=int(os.environ.get(ENV_CACHE_SIZE_KEY, 4096)),
+    ttl=float(os.environ.get(ENV_CACHE_TTL_KEY, 0)),
+)
+
+# decoded corrections of recently asked users, keyed on user_key and model version; sized in bytes, not entries
+user_cache = PredictionCache(
+    maxsize=1_000_000,
+    maxbytes=int(os.environ.get(ENV_USER_CACHE_BYTES_KEY, 1024 * 1024)),
+    sizeof=lambda correction: correction.nbytes,
+)
 
+# groups concurrent single-row predictions into one predict call per model
+batch_window = float(os.environ.get(ENV_BATCH_WINDOW_KEY, 0)) / 1000
+batcher = None
+if batch_window > 0:
+    batcher = MicroBatcher(
+        window=batch_window,
+        max_batch=int(os.environ.get(ENV_BATCH_MAX_KEY, 64)),
+        max_queue=int(os.environ.get(ENV_BATCH_QUEUE_KEY, 1024)),
+        metrics=metrics,
+    )
+    print(f"micro-batching predictions within {batch_window * 1000:g}ms, up to {batcher.max_batch} rows")
+
+# din33466 and sac accept scalars as well as numpy arrays (batch endpoint)
 def din33466(uphill, downhill, distance):
     km = distance / 1000.0
     vertical = downhill / 500.0 + uphill / 300.0
     horizontal = km / 4.0
-    return 3600.0 * (min(vertical, horizontal) / 2 + max(vertical, horizontal))
+    return 3600.0 * (np.minimum(vertical, horizontal) / 2 + np.maximum(vertical, horizontal))
 
 def sac(uphill, downhill, distance):
     km = distance / 1000.0
@@ -70,29 +308,302 @@ def timedelta_minutes(seconds):
     rounded_minutes = int(round(seconds / 60.0))
     return str(datetime.timedelta(minutes=rounded_minutes))
 
-print("\n*** Flask Backend ***")
-app = Flask(__name__)
-cors = CORS(app)
-app = Flask(__name__, static_url_path='/', static_folder='../frontend/build')
+api = Blueprint('api', __name__)
+
+def start_timer():
+    g.request_started = time.perf_counter()
+
+def record_request(response):
+    # also runs for the 500 response of an unhandled exception, which counts as an error
+    started = g.get('request_started')
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.record_request(endpoint, response.status_code, time.perf_counter() - started)
+    return response
 
-@app.route("/")
+def is_local_request():
+    return request.remote_addr in ("127.0.0.1", "::1")
+
+@api.route("/")
 def indexPage():
      return send_file("../frontend/build/index.html")  
 
-@app.route("/api/predict")
+@api.route("/api/predict")
 def hello_world():
-    downhill = request.args.get('downhill', default = 0, type = int)
-    uphill = request.args.get('uphill', default = 0, type = int)
-    length = request.args.get('length', default = 0, type = int)
-
-    demoinput = [[downhill,uphill,length,0]]
-    demodf = pd.DataFrame(columns=['downhill', 'uphill', 'length_3d', 'max_elevation'], data=demoinput)
-    gradient_prediction = gradient_model.predict(demodf)[0]
-    linear_prediction = linear_model.predict(demodf)[0]
-
-    return jsonify({
-        'time': timedelta_minutes(gradient_prediction),
-        'linear': timedelta_minutes(linear_prediction),
-        'din33466': timedelta_minutes(din33466(uphill=uphill, downhill=downhill, distance=length)),
-        'sac': timedelta_minutes(sac(uphill=uphill, downhill=downhill, distance=length))
-        })
+    with metrics.stage('parse_args'):
+        downhill = request.args.get('downhill', default = 0, type = int)
+        uphill = request.args.get('uphill', default = 0, type = int)
+        length = request.args.get('length', default = 0, type = int)
+        user = request.args.get('user') or None
+
+    models = active_models
+    if models is None:
+        # still starting up: the formulas only, not cached
+        return jsonify(predict_single(models, downhill, uphill, length, user=user))
+    # users without a correction share the general entries: arbitrary ?user= values cannot flush the cache
+    if user is not None and user_correction(models, user) is None:
+        user = None
+    cache_key = (downhill, uphill, length, models.version, None if user is None else user_key(user))
+    with metrics.stage('cache_lookup'):
+        payload = prediction_cache.get(cache_key)
+    if payload is None:
+        result = predict_single(models, downhill, uphill, length, user=user)
+        with metrics.stage('serialize'):
+            payload = jsonify(result).get_data()
+        prediction_cache.put(cache_key, payload)
+
+    return current_app.response_class(payload, mimetype=current_app.json.mimetype)
+
+def user_correction(models, user):
+    """The user's correction from the LRU cache or the memory-mapped artifact, None if there is none."""
+    if models.users is None:
+        return None
+    # the same key as the artifact: ids differing only in case or surrounding spaces are one user
+    key = (user_key(user), models.version)
+    correction = user_cache.get(key)
+    if correction is None:
+        correction = models.users.get(user)
+        if correction is not None:
+            user_cache.put(key, correction)
+    return correction
+
+def predict_single(models, downhill, uphill, length, max_elevation=0, user=None):
+    """Estimates of all methods; 'time' and 'linear' are None while no models are loaded.
+
+    With ``user`` 'time' is personalized if that user has a correction ('personalized' says so).
+    """
+    gradient_time = linear_time = version = None
+    personalized = False
+    if models is not None:
+        if batcher is not None:
+            gradient_prediction, linear_prediction = batcher.predict(models, [downhill, uphill, length, max_elevation])
+        else:
+            demoinput = [downhill,uphill,length,max_elevation]
+            with metrics.stage('gradient_predict'):
+                gradient_prediction = models.gradient_predictor.predict_one(demoinput)
+            with metrics.stage('linear_predict'):
+                linear_prediction = models.linear_predictor.predict_one(demoinput)
+        if user is not None:
+            with metrics.stage('user_correction'):
+                correction = user_correction(models, user)
+                if correction is not None:
+                    gradient_prediction *= correction.factor(models.users.standardize(downhill, uphill, length))
+                    personalized = True
+        gradient_time = timedelta_minutes(gradient_prediction)
+        linear_time = timedelta_minutes(linear_prediction)
+        version = models.version
+
+    with metrics.stage('formulas'):
+        return {
+            'time': gradient_time,
+            'linear': linear_time,
+            'din33466': timedelta_minutes(din33466(uphill=uphill, downhill=downhill, distance=length)),
+            'sac': timedelta_minutes(sac(uphill=uphill, downhill=downhill, distance=length)),
+            'version': version,
+            'personalized': personalized,
+            }
+
+def finite_arg(name):
+    """Query parameter ``name`` as a finite float, 0 if absent; ValueError for anything else."""
+    value = float(request.args.get(name, 0))
+    if not math.isfinite(value):
+        raise ValueError(f"{name} is not finite")
+    return value
+
+@api.route("/api/similar")
+def similar_hikes():
+    """The k recorded hikes closest to the planned one, optionally within bbox=min_lon,min_lat,max_lon,max_lat.
+
+    Without max_elevation the hikes are compared on the other three features only.
+    """
+    with metrics.stage('parse_args'):
+        try:
+            features = [finite_arg('downhill'), finite_arg('uphill'), finite_arg('length')]
+            if 'max_elevation' in request.args:
+                features.append(finite_arg('max_elevation'))
+        except ValueError:
+            return jsonify({'error': 'downhill, uphill, length and max_elevation must be finite numbers'}), 400
+        k = request.args.get('k', default=5, type=int)
+        region = None
+        if 'bbox' in request.args:
+            try:
+                region = tuple(float(value) for value in request.args['bbox'].split(','))
+            except ValueError:
+                region = ()
+            if len(region) != 4 or not all(math.isfinite(value) for value in region):
+                return jsonify({'error': 'bbox must be min_lon,min_lat,max_lon,max_lat'}), 400
+    if not 1 <= k <= SIMILAR_MAX_K:
+        return jsonify({'error': f'k must be between 1 and {SIMILAR_MAX_K}'}), 400
+    models = active_models
+    if models is None or models.similar is None:
+        return jsonify({'error': 'similar hikes index not loaded'}), 503
+    with metrics.stage('similar_query'):
+        matches = models.similar.query(features, k=k, region=region)
+    hikes = []
+    for index, distance in matches:
+        hike = models.similar.hike(index, distance)
+        hike['moving_time_text'] = timedelta_minutes(hike['moving_time'])
+        hikes.append(hike)
+    return jsonify({'hikes': hikes, 'version': models.version})
+
+@api.errorhandler(BatchQueueFull)
+def batch_queue_full(ex):
+    response = jsonify({'error': f'overloaded, {ex}'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+@api.route("/api/predict/gpx", methods=["POST"])
+def predict_gpx():
+    """Predict the hiking time of an uploaded GPX file (multipart field 'file' or raw body)."""
+    upload = request.files.get('file')
+    stream = upload.stream if upload is not None else request.stream
+    try:
+        with metrics.stage('gpx_parse'):
+            track = read_metrics(stream)
+    except ValueError as ex:
+        return jsonify({'error': str(ex)}), 400
+
+    # unlike the form, a GPX file knows its real max elevation, which the models were trained on
+    max_elevation = track.max_elevation or 0
+    result = predict_single(
+        active_models, track.downhill, track.uphill, track.length_3d, max_elevation=max_elevation
+    )
+    result.update({
+        'uphill': round(track.uphill),
+        'downhill': round(track.downhill),
+        'length': round(track.length_3d),
+        'max_elevation': max_elevation,
+        'points': track.points,
+    })
+    return jsonify(result)
+
+@api.route("/api/cache")
+def cache_stats():
+    return jsonify(dict(prediction_cache.stats(), model_version=metrics.model_version))
+
+@api.route("/healthz")
+def liveness():
+    """The process answers requests; the formula estimates work even without models."""
+    return jsonify({'status': 'alive', 'models': model_state})
+
+@api.route("/readyz")
+def readiness():
+    """200 once the models are loaded, 503 while loading or after a failed load."""
+    if active_models is None:
+        body = {'status': model_state}
+        if model_error:
+            body['error'] = model_error
+        return jsonify(body), 503
+    return jsonify({'status': 'ready', 'version': active_models.version})
+
+def process_gauges():
+    """Gauges of this process: cache sizes and hit counts, queue depth, whether models are loaded."""
+    gauges = {
+        f'cache_{key}': value for key, value in prediction_cache.stats().items() if isinstance(value, (int, float))
+    }
+    gauges.update(
+        (f'user_cache_{key}', value) for key, value in user_cache.stats().items() if isinstance(value, (int, float))
+    )
+    gauges['profiler_running'] = int(profiler.running)
+    gauges['models_ready'] = int(active_models is not None)
+    if batcher is not None:
+        gauges['batch_queue_depth'] = batcher.depth
+    return gauges
+
+def publish_metrics(alive=True):
+    """Write this worker's metrics for the /metrics of the other workers (prefork server only)."""
+    if metrics_dir is not None:
+        write_worker_snapshot(metrics_dir, worker_id, metrics.snapshot(), process_gauges(), alive)
+
+@api.route("/metrics")
+def prometheus_metrics():
+    if metrics_dir is None:
+        text = metrics.render(process_gauges())
+    else:
+        # every scrape may reach another worker: answer with the sum over all of them
+        publish_metrics()
+        workers = sorted(read_worker_snapshots(metrics_dir), key=lambda worker: worker['worker'] != worker_id)
+        text = metrics.render(
+            snapshot=Metrics.merge(worker['metrics'] for worker in workers),
+            worker_gauges={worker['worker']: worker['gauges'] for worker in workers if worker['alive']},
+        )
+    return current_app.response_class(text, mimetype='text/plain; version=0.0.4')
+
+@api.route("/api/admin/profiler", methods=["GET", "POST"])
+def admin_profiler():
+    """POST ?action=start[&interval=seconds] or ?action=stop; GET returns the collapsed stacks."""
+    if not is_local_request():
+        return jsonify({'error': 'the profiler can only be controlled locally'}), 403
+    if request.method == "GET":
+        return current_app.response_class(profiler.collapsed(request.args.get('limit', type=int)), mimetype='text/plain')
+    action = request.args.get('action')
+    if action == 'start':
+        changed = profiler.start(request.args.get('interval', type=float))
+    elif action == 'stop':
+        changed = profiler.stop()
+    else:
+        return jsonify({'error': 'action must be start or stop'}), 400
+    return jsonify({'running': profiler.running, 'changed': changed, 'samples': profiler.samples})
+
+@api.route("/api/admin/reload", methods=["POST"])
+def admin_reload():
+    if not is_local_request():
+        return jsonify({'error': 'reload can only be triggered locally'}), 403
+    if request_restart is not None:
+        # every worker shares the master's models, so the master reloads and replaces all workers
+        request_restart()
+        return jsonify({'restarting': True, 'version': metrics.model_version}), 202
+    try:
+        swapped = reload_models(force=request.args.get('force') in ('1', 'true'))
+    except Exception as ex:
+        return jsonify({'error': str(ex), 'version': metrics.model_version}), 500
+    return jsonify({'reloaded': swapped, 'version': metrics.model_version})
+
+@api.route("/api/predict/batch", methods=["POST"])
+def predict_batch():
+    """Score a list of {uphill, downhill, length} records in one pass through both models."""
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict):
+        payload = payload.get('hikes')
+    if not isinstance(payload, list):
+        return jsonify({'error': 'expected a JSON array of {uphill, downhill, length} records'}), 400
+    if len(payload) > BATCH_MAX_ROWS:
+        return jsonify({'error': f'at most {BATCH_MAX_ROWS} records per batch'}), 413
+    if not payload:
+        return jsonify([])
+
+    try:
+        data = np.array(
+            [[int(hike.get('downhill', 0)), int(hike.get('uphill', 0)), int(hike.get('length', 0)), 0] for hike in payload],
+            dtype=np.float64,
+        )
+    except (AttributeError, TypeError, ValueError, OverflowError):
+        # OverflowError: int() of Infinity or of a number too large for a float, like 1e400
+        return jsonify({'error': 'uphill, downhill and length must be integers'}), 400
+
+    models = active_models
+    downhill, uphill, length = data[:, 0], data[:, 1], data[:, 2]
+    if models is None:
+        gradient_predictions = linear_predictions = [None] * len(data)
+    else:
+        with metrics.stage('batch_gradient_predict'):
+            gradient_predictions = models.gradient_predictor.predict(data)
+        with metrics.stage('batch_linear_predict'):
+            linear_predictions = models.linear_predictor.predict(data)
+    din_predictions = din33466(uphill=uphill, downhill=downhill, distance=length)
+    sac_predictions = sac(uphill=uphill, downhill=downhill, distance=length)
+
+    response = jsonify([
+        {
+            'time': None if gradient is None else timedelta_minutes(gradient),
+            'linear': None if linear is None else timedelta_minutes(linear),
+            'din33466': timedelta_minutes(din),
+            'sac': timedelta_minutes(sac_time),
+        }
+        for gradient, linear, din, sac_time in zip(
+            gradient_predictions, linear_predictions, din_predictions, sac_predictions
+        )
+    ])
+    if models is not None:
+        response.headers['X-Model-Version'] = models.version
+    return response
@@ -0,0 +1,157 @@
+"""Dynamic micro-batching of concurrent single-row predictions.
+
+Request threads put their row on a bounded queue and wait. One scheduler
+thread takes the first waiting row, collects more until ``window`` seconds
+have passed since that row arrived or ``max_batch`` rows are together, and
+scores them with one ``predict`` call per model. Each request then gets its
+own row of the result back. A single row costs about as much as a small
+batch, so under concurrency this trades up to ``window`` of extra latency
+for far fewer model calls.
+
+It pays off when the model call dominates a request, e.g. the sklearn
+engine of models the compiled engine does not support (milliseconds per
+row). With the compiled engine (microseconds per row) the HTTP handling
+dominates and batching mostly adds the window to the latency, so it is off
+unless HIKEPLANNER_BATCH_WINDOW_MS is set.
+"""
+
+from __future__ import annotations
+
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import numpy as np
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+RESULT_TIMEOUT = 10
+
+
+class BatchQueueFull(Exception):
+    """More rows are waiting than the configured queue depth allows."""
+
+
+class BatchTimeout(BatchQueueFull):
+    """A row got no result within ``RESULT_TIMEOUT``; overloaded just like a full queue."""
+
+
+class _Pending:
+    __slots__ = ("models", "row", "enqueued", "future")
+
+    def __init__(self, models, row):
+        self.models = models
+        self.row = row
+        self.enqueued = time.perf_counter()
+        self.future = Future()
+
+
+class MicroBatcher:
+    """Groups rows submitted within ``window`` seconds into batches of at most ``max_batch``.
+
+    ``metrics`` receives the batch sizes, the time rows wait in the queue
+    and the duration of the batched predict calls.
+    """
+
+    def __init__(self, window, max_batch, max_queue, metrics=None):
+        self.window = window
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self.metrics = metrics
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_started(self):
+        # started lazily and per process: threads do not survive the fork of a prefork worker
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # the rows queued before the fork belong to the parent's requests
+                self._queue = queue.Queue(maxsize=self.max_queue)
+                self._thread = None
+                self._pid = os.getpid()
+            if self._thread is None or not self._thread.is_alive():
+                # a replacement scheduler takes over the rows already waiting
+                self._thread = threading.Thread(target=self._run, daemon=True, name="micro-batcher")
+                self._thread.start()
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def predict(self, models, row):
+        """(gradient, linear) prediction of one feature row, scored together with concurrent ones."""
+        self._ensure_started()
+        pending = _Pending(models, row)
+        try:
+            self._queue.put_nowait(pending)
+        except queue.Full:
+            raise BatchQueueFull(f"{self.max_queue} predictions already waiting") from None
+        try:
+            return pending.future.result(timeout=RESULT_TIMEOUT)
+        except FutureTimeoutError:
+            # not scored yet: the scheduler skips cancelled rows
+            pending.future.cancel()
+            raise BatchTimeout(f"no prediction within {RESULT_TIMEOUT}s") from None
+
+    def _collect(self):
+        first = self._queue.get()
+        batch = [first]
+        deadline = first.enqueued + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._process(batch)
+            except Exception as ex:
+                # keep scheduling: the rows of this batch fail, the ones behind it are still scored
+                print(f"micro-batch failed: {ex}", file=sys.stderr)
+                for pending in batch:
+                    if not pending.future.done():
+                        pending.future.set_exception(ex)
+
+    def _process(self, batch):
+        # rows whose request timed out are cancelled, the others can no longer be
+        batch = [pending for pending in batch if pending.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        started = time.perf_counter()
+        # a model reload may put rows for two versions into one window
+        groups = {}
+        for pending in batch:
+            groups.setdefault(id(pending.models), []).append(pending)
+        for group in groups.values():
+            self._score(group)
+        if self.metrics is not None:
+            self.metrics.observe_value("batch_size", len(batch), BATCH_SIZE_BUCKETS)
+            for pending in batch:
+                self.metrics.observe("batch_queue_delay", started - pending.enqueued)
+            self.metrics.observe("batch_predict", time.perf_counter() - started)
+
+    def _score(self, group):
+        models = group[0].models
+        try:
+            rows = np.array([pending.row for pending in group], dtype=np.float64)
+            gradient = models.gradient_predictor.predict(rows)
+            linear = models.linear_predictor.predict(rows)
+        except Exception as ex:
+            for pending in group:
+                pending.future.set_exception(ex)
+            return
+        for pending, gradient_value, linear_value in zip(group, gradient, linear):
+            pending.future.set_result((float(gradient_value), float(linear_value)))
@@ -0,0 +1,464 @@
+"""Latency and throughput benchmark of the prediction service.
+
+Trains a small synthetic model, copies the backend into a scratch
+directory next to it (so neither Azure nor the project's .env is used) and
+measures:
+
+* cold start: process start until the first successful /api/predict and
+  until /readyz reports the models as loaded;
+* single-request latency (p50/p95/p99) over one keep-alive connection;
+* sustained requests per second at several client concurrency levels;
+* micro-benchmarks of din33466, sac and both predictors, in-process;
+* with ``--workers``, throughput of the prefork server (serve.py) per
+  worker count, measured by several client processes, together with the
+  RSS and PSS of all server processes (PSS counts shared pages once).
+
+Results are printed and written as JSON. With ``--baseline`` every metric
+is compared against an earlier result and the run fails if one is worse
+by more than ``--margin``:
+
+    python benchmark_service.py --output baseline.json
+    python benchmark_service.py --baseline baseline.json --margin 0.2
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+import http.client
+import json
+import os
+import pickle
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import urllib.request
+from pathlib import Path
+
+import numpy as np
+
+BACKEND_DIR = Path(__file__).resolve().parent
+FEATURE_COLUMNS = ['downhill', 'uphill', 'length_3d', 'max_elevation']
+STARTUP_TIMEOUT = 60
+
+
+def build_synthetic_model(model_dir, rows=3000, seed=0):
+    """Train both models on synthetic hikes, with the same estimators as train_model.py."""
+    import pandas as pd
+    from sklearn.ensemble import GradientBoostingRegressor
+    from sklearn.linear_model import LinearRegression
+
+    rng = np.random.default_rng(seed)
+    x = pd.DataFrame({
+        'downhill': rng.uniform(0, 2000, rows),
+        'uphill': rng.uniform(0, 2000, rows),
+        'length_3d': rng.uniform(1000, 30000, rows),
+        'max_elevation': rng.uniform(500, 3000, rows),
+    })
+    y = x['uphill'] * 9 + x['downhill'] * 4 + x['length_3d'] * 0.7 + rng.normal(0, 600, rows)
+    model_dir.mkdir(parents=True, exist_ok=True)
+    models = {
+        'GradientBoostingRegressor.pkl': GradientBoostingRegressor(n_estimators=50, random_state=9000),
+        'LinearRegression.pkl': LinearRegression(),
+    }
+    for name, model in models.items():
+        model.fit(x[FEATURE_COLUMNS], y)
+        with open(model_dir / name, 'wb') as fid:
+            pickle.dump(model, fid)
+
+
+def prepare_workdir(workdir):
+    """Scratch copy of the backend with a synthetic ./model next to it."""
+    backend = Path(workdir, "backend")
+    backend.mkdir(parents=True)
+    for source in BACKEND_DIR.glob("*.py"):
+        shutil.copy(source, backend)
+    build_synthetic_model(Path(workdir, "model"))
+    return backend / "app.py"
+
+
+def request_values(count, seed=1):
+    """Reproducible (downhill, uphill, length) request values."""
+    return np.random.default_rng(seed).integers([0, 0, 1000], [2000, 2000, 30000], size=(count, 3))
+
+
+def request_paths(count, seed=1):
+    return [f"/api/predict?downhill={d}&uphill={u}&length={length}" for d, u, length in request_values(count, seed)]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def server_env(cache, batch_window_ms=0):
+    env = {key: value for key, value in os.environ.items() if not key.startswith(("AZURE_", "HIKEPLANNER_", "FLASK_"))}
+    env["PYTHONUNBUFFERED"] = "1"
+    if batch_window_ms:
+        env["HIKEPLANNER_BATCH_WINDOW_MS"] = str(batch_window_ms)
+    if not cache:
+        # measure the model path, not cache hits
+        env["HIKEPLANNER_CACHE_SIZE"] = "0"
+    return env
+
+
+def _get_ok(url):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status == 200
+    except OSError:
+        return False
+
+
+def start_server(app_path, workdir, cache, workers=None, batch_window_ms=0):
+    """Start the Flask app and wait until it is ready.
+
+    Returns (process, port, seconds until the first successful prediction,
+    seconds until /readyz succeeds).
+
+    Without ``workers`` the development server (``flask run``) is used,
+    otherwise the prefork server with that many workers. ``batch_window_ms``
+    enables the server's micro-batching of /api/predict.
+    """
+    port = free_port()
+    if workers is None:
+        command = [sys.executable, "-m", "flask", "--app", str(app_path), "run", "--port", str(port)]
+    else:
+        serve_path = Path(app_path).with_name("serve.py")
+        command = [sys.executable, str(serve_path), "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)]
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        command,
+        cwd=workdir,
+        env=server_env(cache, batch_window_ms),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    urls = [
+        f"http://127.0.0.1:{port}/api/predict?downhill=300&uphill=700&length=10000",
+        f"http://127.0.0.1:{port}/readyz",
+    ]
+    timings = []
+    while time.perf_counter() - started < STARTUP_TIMEOUT:
+        if process.poll() is not None:
+            raise SystemExit(f"server exited with code {process.returncode} during startup")
+        if _get_ok(urls[len(timings)]):
+            timings.append(time.perf_counter() - started)
+            if len(timings) == len(urls):
+                return process, port, timings[0], timings[1]
+        else:
+            time.sleep(0.01)
+    process.kill()
+    raise SystemExit(f"server did not answer within {STARTUP_TIMEOUT}s")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def _timed_get(connection, path):
+    started = time.perf_counter()
+    connection.request("GET", path)
+    response = connection.getresponse()
+    response.read()
+    if response.status != 200:
+        raise RuntimeError(f"GET {path} returned {response.status}")
+    return time.perf_counter() - started
+
+
+def percentiles_ms(samples):
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99]) * 1000
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "mean": float(np.mean(samples) * 1000)}
+
+
+def measure_latency(port, paths):
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    for path in paths[:50]:
+        _timed_get(connection, path)
+    samples = [_timed_get(connection, path) for path in paths]
+    connection.close()
+    return percentiles_ms(samples)
+
+
+def measure_throughput(port, paths, concurrency, duration):
+    """Requests per second with ``concurrency`` clients looping over ``paths`` for ``duration`` seconds."""
+    samples = [[] for _ in range(concurrency)]
+    errors = []
+    deadline = time.perf_counter() + duration
+
+    def client(index):
+        connection = http.client.HTTPConnection("127.0.0.1", port)
+        position = index * 97
+        try:
+            while time.perf_counter() < deadline:
+                samples[index].append(_timed_get(connection, paths[position % len(paths)]))
+                position += 1
+        except Exception as ex:
+            errors.append(str(ex))
+        finally:
+            connection.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies = [sample for client_samples in samples for sample in client_samples]
+    if errors:
+        raise SystemExit(f"{len(errors)} clients failed at concurrency {concurrency}: {errors[0]}")
+    return dict(
+        concurrency=concurrency,
+        requests=len(latencies),
+        rps=len(latencies) / elapsed,
+        latency_ms=percentiles_ms(latencies),
+        samples=latencies,
+    )
+
+
+def measure_throughput_processes(port, paths, concurrency, duration, processes):
+    """Like ``measure_throughput``, with the clients spread over processes so the client's GIL is no limit."""
+    per_process = [concurrency // processes + (index < concurrency % processes) for index in range(processes)]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [
+            pool.submit(measure_throughput, port, paths, clients, duration) for clients in per_process if clients
+        ]
+        results = [future.result() for future in futures]
+    latencies = [sample for result in results for sample in result["samples"]]
+    return dict(
+        concurrency=concurrency,
+        requests=len(latencies),
+        rps=sum(result["rps"] for result in results),
+        latency_ms=percentiles_ms(latencies),
+    )
+
+
+def process_tree(pid):
+    """``pid`` and all its descendants (Linux)."""
+    pids = [pid]
+    for child in Path(f"/proc/{pid}/task/{pid}/children").read_text().split():
+        pids.extend(process_tree(int(child)))
+    return pids
+
+
+def memory_mb(pids):
+    """Summed RSS and PSS of ``pids`` in MB, from /proc/<pid>/smaps_rollup (Linux only)."""
+    totals = {"rss_mb": 0.0, "pss_mb": 0.0}
+    for pid in pids:
+        for line in Path(f"/proc/{pid}/smaps_rollup").read_text().splitlines():
+            key, _, value = line.partition(":")
+            if key in ("Rss", "Pss"):
+                totals[f"{key.lower()}_mb"] += int(value.split()[0]) / 1024
+    return totals
+
+
+def measure_scaling(app_path, workdir, paths, args):
+    """Throughput of the prefork server per worker count."""
+    results = []
+    cpus = os.cpu_count() or 1
+    if max(args.workers) + args.client_processes > cpus:
+        # server workers and client processes share the CPUs, the numbers show contention, not scaling
+        print(f"warning: {max(args.workers)} workers and {args.client_processes} client processes on {cpus} CPUs, "
+              "throughput per worker count does not measure scaling")
+    for workers in args.workers:
+        process, port, _, _ = start_server(app_path, workdir, args.cache, workers=workers, batch_window_ms=args.batch_window_ms)
+        try:
+            result = measure_throughput_processes(
+                port, paths, args.scaling_concurrency, args.duration, args.client_processes
+            )
+            result.update(workers=workers, cpus=cpus)
+            try:
+                result.update(memory_mb(process_tree(process.pid)))
+            except OSError:
+                pass
+        finally:
+            stop_server(process)
+        memory = f", RSS {result['rss_mb']:.0f}MB PSS {result['pss_mb']:.0f}MB" if "rss_mb" in result else ""
+        print(f"workers {workers:>3}: {result['rps']:.0f} req/s, p99 {result['latency_ms']['p99']:.2f}ms{memory}")
+        results.append(result)
+    return results
+
+
+def micro_child():
+    """Time the pure model functions of the app imported from the current directory."""
+    sys.path.insert(0, str(Path("backend").resolve()))
+    import app
+
+    models = app.load_initial_models()
+    row = [300, 700, 10000, 0]
+    batch = np.zeros((1000, 4))
+    batch[:, :3] = request_values(1000)
+    cases = {
+        "din33466": lambda: app.din33466(uphill=700, downhill=300, distance=10000),
+        "sac": lambda: app.sac(uphill=700, downhill=300, distance=10000),
+        "gradient_predict_one": lambda: models.gradient_predictor.predict_one(row),
+        "linear_predict_one": lambda: models.linear_predictor.predict_one(row),
+        "gradient_predict_1000": lambda: models.gradient_predictor.predict(batch),
+        "linear_predict_1000": lambda: models.linear_predictor.predict(batch),
+        "predict_single": lambda: app.predict_single(models, 300, 700, 10000),
+    }
+    results = {}
+    for name, case in cases.items():
+        timer = timeit.Timer(case)
+        number, _ = timer.autorange()
+        # best of several repeats: the least disturbed estimate of the per-call cost
+        results[name] = min(timer.repeat(repeat=5, number=number)) / number * 1e6
+    print(json.dumps(results))
+
+
+def run_micro(workdir, cache):
+    output = subprocess.run(
+        [sys.executable, __file__, "--micro-child"],
+        cwd=workdir,
+        env=server_env(cache),
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(args):
+    paths = request_paths(args.requests)
+    with tempfile.TemporaryDirectory() as workdir:
+        print("Building synthetic model...")
+        app_path = prepare_workdir(workdir)
+
+        cold_starts = []
+        ready = []
+        for _ in range(args.cold_starts):
+            process, _, first_response, ready_seconds = start_server(app_path, workdir, args.cache)
+            stop_server(process)
+            cold_starts.append(first_response)
+            ready.append(ready_seconds)
+        print(f"cold start: first response {min(cold_starts):.2f}s, ready {min(ready):.2f}s (best of {len(cold_starts)})")
+
+        process, port, _, _ = start_server(app_path, workdir, args.cache, batch_window_ms=args.batch_window_ms)
+        try:
+            latency = measure_latency(port, paths)
+            print(f"latency: p50 {latency['p50']:.2f}ms p95 {latency['p95']:.2f}ms p99 {latency['p99']:.2f}ms")
+            throughput = []
+            for concurrency in args.concurrency:
+                result = measure_throughput(port, paths, concurrency, args.duration)
+                del result["samples"]
+                throughput.append(result)
+                print(f"concurrency {concurrency:>3}: {result['rps']:.0f} req/s, p99 {result['latency_ms']['p99']:.2f}ms")
+        finally:
+            stop_server(process)
+
+        scaling = measure_scaling(app_path, workdir, paths, args) if args.workers else []
+
+        micro = run_micro(workdir, args.cache)
+        for name, microseconds in micro.items():
+            print(f"{name:<24} {microseconds:>10.2f} us")
+
+    return {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "requests": args.requests,
+            "duration": args.duration,
+            "cache": args.cache,
+            "batch_window_ms": args.batch_window_ms,
+        },
+        "cold_start_s": {
+            "best": min(cold_starts),
+            "median": float(np.median(cold_starts)),
+            "ready_best": min(ready),
+            "ready_median": float(np.median(ready)),
+        },
+        "latency_ms": latency,
+        "throughput": throughput,
+        "scaling": scaling,
+        "micro_us": micro,
+    }
+
+
+def flatten(results):
+    """``{metric: (value, higher_is_better)}`` of every comparable number in a result."""
+    metrics = {f"cold_start_s.{key}": (value, False) for key, value in results["cold_start_s"].items()}
+    metrics.update({f"latency_ms.{key}": (value, False) for key, value in results["latency_ms"].items()})
+    for result in results["throughput"]:
+        prefix = f"throughput.c{result['concurrency']}"
+        metrics[f"{prefix}.rps"] = (result["rps"], True)
+        metrics[f"{prefix}.p99_ms"] = (result["latency_ms"]["p99"], False)
+    for result in results.get("scaling", []):
+        metrics[f"scaling.w{result['workers']}.rps"] = (result["rps"], True)
+    metrics.update({f"micro_us.{key}": (value, False) for key, value in results["micro_us"].items()})
+    return metrics
+
+
+def compare(results, baseline, margin):
+    """Return the metrics that are worse than the baseline by more than ``margin`` (a fraction)."""
+    current = flatten(results)
+    regressions = []
+    print(f"\n{'*** Metric ***':<36} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, (expected, higher_is_better) in flatten(baseline).items():
+        if name not in current or not expected:
+            continue
+        value = current[name][0]
+        change = (value - expected) / expected
+        worse = -change if higher_is_better else change
+        marker = "  REGRESSION" if worse > margin else ""
+        print(f"{name:<36} {expected:>12.3f} {value:>12.3f} {change:>+8.1%}{marker}")
+        if worse > margin:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000, help="sequential requests for the latency percentiles")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="client concurrency levels")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per concurrency level")
+    parser.add_argument("--workers", type=int, nargs="+", help="prefork worker counts to measure, e.g. 1 2 4 8")
+    parser.add_argument("--scaling-concurrency", type=int, default=32, help="client concurrency of the scaling runs")
+    parser.add_argument(
+        "--client-processes", type=int, default=os.cpu_count() or 1, help="client processes of the scaling runs"
+    )
+    parser.add_argument("--cold-starts", type=int, default=3, help="server starts to time")
+    parser.add_argument("--cache", action="store_true", help="keep the prediction cache enabled")
+    parser.add_argument(
+        "--batch-window-ms", type=float, default=0, help="micro-batching window of the measured server, 0 disables"
+    )
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON result of an earlier run to compare against")
+    parser.add_argument("--margin", type=float, default=0.2, help="allowed relative regression, e.g. 0.2 for 20%%")
+    parser.add_argument("--micro-child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.micro_child:
+        micro_child()
+        return
+
+    results = run(args)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=2)
+        print(f"results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as handle:
+            baseline = json.load(handle)
+        regressions = compare(results, baseline, args.margin)
+        if regressions:
+            raise SystemExit(f"{len(regressions)} metrics regressed by more than {args.margin:.0%}: {', '.join(regressions)}")
+        print(f"no metric regressed by more than {args.margin:.0%}")
+
+
+if __name__ == "__main__":
+    main()
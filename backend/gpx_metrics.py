@@ -0,0 +1,229 @@
+"""Single-pass GPX track metrics for uploaded files.
+
+The file is fed in chunks to the expat parser and only running sums are
+kept, so memory stays constant no matter how many points a track has. The
+results follow gpxpy's definitions (``get_uphill_downhill``,
+``length_2d``/``length_3d``, ``get_elevation_extremes``) including the
+smoothing of elevations and the order in which segment and track sums are
+added up.
+"""
+
+from __future__ import annotations
+
+import math
+from xml.parsers import expat
+
+# same constants as gpxpy.geo
+EARTH_RADIUS = 6378.137 * 1000
+ONE_DEGREE = (2 * math.pi * EARTH_RADIUS) / 360
+
+
+def haversine_distance(latitude_1, longitude_1, latitude_2, longitude_2):
+    d_lon = math.radians(longitude_1 - longitude_2)
+    lat1 = math.radians(latitude_1)
+    lat2 = math.radians(latitude_2)
+    d_lat = lat1 - lat2
+    a = math.pow(math.sin(d_lat / 2), 2) + math.pow(math.sin(d_lon / 2), 2) * math.cos(lat1) * math.cos(lat2)
+    return EARTH_RADIUS * 2 * math.asin(math.sqrt(a))
+
+
+def distances(latitude_1, longitude_1, elevation_1, latitude_2, longitude_2, elevation_2):
+    """2D and 3D point distance as computed by ``gpxpy.geo.distance``."""
+    if abs(latitude_1 - latitude_2) > .2 or abs(longitude_1 - longitude_2) > .2:
+        distance_2d = haversine_distance(latitude_1, longitude_1, latitude_2, longitude_2)
+        return distance_2d, distance_2d
+    coef = math.cos(math.radians(latitude_1))
+    x = latitude_1 - latitude_2
+    y = (longitude_1 - longitude_2) * coef
+    distance_2d = math.sqrt(x * x + y * y) * ONE_DEGREE
+    if elevation_1 is None or elevation_2 is None or elevation_1 == elevation_2:
+        return distance_2d, distance_2d
+    return distance_2d, math.sqrt(distance_2d ** 2 + (elevation_1 - elevation_2) ** 2)
+
+
+class _Segment:
+    """Running sums for one ``trkseg``; smoothing needs one point of lookahead."""
+
+    def __init__(self):
+        self.length_2d = 0.0
+        self.length_3d = 0.0
+        self.uphill = 0.0
+        self.downhill = 0.0
+        self.previous = None
+        self.elevations = 0
+        self.ele_before = None
+        self.ele_last = None
+        self.smoothed_last = None
+
+    def add_point(self, latitude, longitude, elevation):
+        if self.previous is not None:
+            distance_2d, distance_3d = distances(latitude, longitude, elevation, *self.previous)
+            if distance_2d:
+                self.length_2d += distance_2d
+            if distance_3d:
+                self.length_3d += distance_3d
+        self.previous = (latitude, longitude, elevation)
+        if elevation is None:
+            return
+
+        # the previous elevation now has both neighbours and can be smoothed
+        if self.elevations >= 2:
+            self._climb(self.ele_before * .3 + self.ele_last * .4 + elevation * .3)
+        elif self.elevations == 1:
+            self._climb(self.ele_last)
+        self.ele_before, self.ele_last = self.ele_last, elevation
+        self.elevations += 1
+
+    def close(self):
+        # the last elevation is never smoothed
+        if self.elevations >= 2:
+            self._climb(self.ele_last)
+
+    def _climb(self, smoothed):
+        if self.smoothed_last is not None:
+            d = smoothed - self.smoothed_last
+            if d > 0:
+                self.uphill += d
+            else:
+                self.downhill -= d
+        self.smoothed_last = smoothed
+
+
+class TrackMetrics:
+    """Accumulates gpxpy-compatible totals over all tracks of one GPX document."""
+
+    def __init__(self):
+        self.points = 0
+        self.length_2d = 0.0
+        self.length_3d = 0.0
+        self.uphill = 0.0
+        self.downhill = 0.0
+        self.min_elevation = None
+        self.max_elevation = None
+        self._track = None
+        self._segment = None
+
+    def start_track(self):
+        if self._track is not None:
+            raise ValueError("trk inside another trk")
+        self._track = {"length_2d": 0.0, "length_3d": 0.0, "uphill": 0.0, "downhill": 0.0}
+
+    def start_segment(self):
+        if self._segment is not None:
+            raise ValueError("trkseg inside another trkseg")
+        self._segment = _Segment()
+
+    def add_point(self, latitude, longitude, elevation):
+        if self._segment is None:
+            raise ValueError("trkpt outside of a trkseg")
+        self.points += 1
+        self._segment.add_point(latitude, longitude, elevation)
+        if elevation is not None:
+            if self.min_elevation is None or elevation < self.min_elevation:
+                self.min_elevation = elevation
+            if self.max_elevation is None or elevation > self.max_elevation:
+                self.max_elevation = elevation
+
+    def end_segment(self):
+        segment = self._segment
+        segment.close()
+        for key in ("length_2d", "length_3d"):
+            if getattr(segment, key):
+                self._track[key] += getattr(segment, key)
+        self._track["uphill"] += segment.uphill or .0
+        self._track["downhill"] += segment.downhill or .0
+        self._segment = None
+
+    def end_track(self):
+        for key in ("length_2d", "length_3d"):
+            if self._track[key]:
+                setattr(self, key, getattr(self, key) + self._track[key])
+        self.uphill += self._track["uphill"] or .0
+        self.downhill += self._track["downhill"] or .0
+        self._track = None
+
+    def as_dict(self):
+        return {
+            "points": self.points,
+            "uphill": self.uphill,
+            "downhill": self.downhill,
+            "length_2d": self.length_2d,
+            "length_3d": self.length_3d,
+            "min_elevation": self.min_elevation,
+            "max_elevation": self.max_elevation,
+        }
+
+
+_local_names = {}
+
+
+def _number(text):
+    value = float(text)
+    if not math.isfinite(value):
+        raise ValueError(f"{text!r} is not a finite number")
+    return value
+
+
+def _local_name(tag):
+    name = _local_names.get(tag)
+    if name is None:
+        name = _local_names.setdefault(tag, tag.rpartition(" ")[2])
+    return name
+
+
+def read_metrics(source):
+    """Compute :class:`TrackMetrics` from a binary file object with GPX content.
+
+    Raises ``ValueError`` for malformed XML, track points outside a track
+    segment, non-finite coordinates or documents without track points.
+    """
+    metrics = TrackMetrics()
+    state = {"in_track": False, "point": None, "ele": None}
+
+    def start_element(tag, attrs):
+        name = _local_name(tag)
+        if name == "trk":
+            state["in_track"] = True
+            metrics.start_track()
+        elif not state["in_track"]:
+            return
+        elif name == "trkseg":
+            metrics.start_segment()
+        elif name == "trkpt":
+            state["point"] = [_number(attrs["lat"]), _number(attrs["lon"]), None]
+        elif name == "ele" and state["point"] is not None:
+            state["ele"] = []
+
+    def end_element(tag):
+        name = _local_name(tag)
+        if state["ele"] is not None and name == "ele":
+            text = "".join(state["ele"]).strip()
+            state["point"][2] = _number(text) if text else None
+            state["ele"] = None
+        elif name == "trkpt" and state["point"] is not None:
+            metrics.add_point(*state["point"])
+            state["point"] = None
+        elif name == "trkseg" and state["in_track"]:
+            metrics.end_segment()
+        elif name == "trk":
+            metrics.end_track()
+            state["in_track"] = False
+
+    def character_data(data):
+        if state["ele"] is not None:
+            state["ele"].append(data)
+
+    # expat callbacks instead of an element tree: nothing but the sums is kept
+    parser = expat.ParserCreate(namespace_separator=" ")
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = character_data
+    parser.buffer_text = True
+    try:
+        parser.ParseFile(source)
+    except (expat.ExpatError, KeyError, ValueError) as ex:
+        raise ValueError(f"invalid GPX: {ex}") from ex
+
+    if not metrics.points:
+        raise ValueError("GPX contains no track points")
+    return metrics
@@ -0,0 +1,219 @@
+"""Flat-array inference for the trained HikePlanner models.
+
+The pickled sklearn estimators are converted once into contiguous numpy
+arrays (feature index, threshold, children, leaf values) and evaluated
+directly on those arrays. This skips sklearn's input validation and
+DataFrame feature-name checks on the request path while producing the
+same floating point results as ``model.predict``.
+
+Run ``python inference.py --check [model_dir]`` to compare against sklearn.
+"""
+
+from __future__ import annotations
+
+import argparse
+import pickle
+import sys
+from pathlib import Path
+
+import numpy as np
+
+TREE_LEAF = -1
+
+
+def _check_finite(x):
+    # sklearn rejects NaN and infinity, return the same error instead of a silent number
+    if not np.isfinite(x).all():
+        raise ValueError("Input contains NaN or infinity.")
+
+
+class SklearnPredictor:
+    """Adapter giving a plain sklearn estimator the same interface as the compiled ones."""
+
+    def __init__(self, model, columns):
+        # pandas is only imported when a model actually needs it, it is slow to import
+        import pandas as pd
+
+        self.model = model
+        self.columns = list(columns)
+        self._data_frame = pd.DataFrame
+
+    def predict(self, rows):
+        frame = self._data_frame(columns=self.columns, data=np.asarray(rows, dtype=np.float64))
+        return self.model.predict(frame)
+
+    def predict_one(self, row):
+        return float(self.predict([row])[0])
+
+
+class CompiledLinear:
+    """``LinearRegression`` reduced to its coefficient vector and intercept."""
+
+    def __init__(self, coef, intercept):
+        self.coef = np.ascontiguousarray(coef, dtype=np.float64)
+        self.intercept = float(intercept)
+
+    @classmethod
+    def from_model(cls, model):
+        coef = np.asarray(model.coef_, dtype=np.float64)
+        if coef.ndim != 1:
+            raise ValueError("only single-target LinearRegression models are supported")
+        return cls(coef, model.intercept_)
+
+    def predict(self, rows):
+        x = np.asarray(rows, dtype=np.float64)
+        _check_finite(x)
+        # same operations as LinearRegression._decision_function
+        return x @ self.coef + self.intercept
+
+    def predict_one(self, row):
+        return float(self.predict([row])[0])
+
+
+class CompiledGradientBoosting:
+    """``GradientBoostingRegressor`` flattened into one node table for all trees.
+
+    Child indices are absolute positions in the shared table and leaves point
+    to themselves, so a fixed number of steps (the maximum tree depth) walks
+    every row of a batch to its leaf without branching per tree.
+    """
+
+    def __init__(self, init, roots, feature, threshold, left, right, value, max_depth):
+        self.init = float(init)
+        self.roots = np.ascontiguousarray(roots, dtype=np.intp)
+        self.feature = np.ascontiguousarray(feature, dtype=np.intp)
+        self.threshold = np.ascontiguousarray(threshold, dtype=np.float64)
+        self.left = np.ascontiguousarray(left, dtype=np.intp)
+        self.right = np.ascontiguousarray(right, dtype=np.intp)
+        self.value = np.ascontiguousarray(value, dtype=np.float64)
+        self.max_depth = int(max_depth)
+        # python lists are faster than numpy scalars for walking a single row
+        self._roots = self.roots.tolist()
+        self._feature = self.feature.tolist()
+        self._threshold = self.threshold.tolist()
+        self._left = self.left.tolist()
+        self._right = self.right.tolist()
+        self._value = self.value.tolist()
+        self._leaf = (self.left == np.arange(len(self.left))).tolist()
+
+    @classmethod
+    def from_model(cls, model):
+        if model.init_ == "zero":
+            init = 0.0
+        elif hasattr(model.init_, "constant_"):
+            init = np.asarray(model.init_.constant_, dtype=np.float64).ravel()[0]
+        else:
+            raise ValueError(f"unsupported init estimator {model.init_!r}")
+        if model.estimators_.shape[1] != 1:
+            raise ValueError("only single-output GradientBoostingRegressor models are supported")
+
+        roots, features, thresholds, lefts, rights, values = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for estimator in model.estimators_[:, 0]:
+            tree = estimator.tree_
+            nodes = np.arange(tree.node_count)
+            is_leaf = tree.children_left == TREE_LEAF
+            roots.append(offset)
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(tree.threshold)
+            lefts.append(np.where(is_leaf, nodes, tree.children_left) + offset)
+            rights.append(np.where(is_leaf, nodes, tree.children_right) + offset)
+            # sklearn adds learning_rate * leaf value per stage, keep that product
+            values.append(model.learning_rate * tree.value[:, 0, 0])
+            max_depth = max(max_depth, tree.max_depth)
+            offset += tree.node_count
+
+        return cls(
+            init,
+            roots,
+            np.concatenate(features),
+            np.concatenate(thresholds),
+            np.concatenate(lefts),
+            np.concatenate(rights),
+            np.concatenate(values),
+            max_depth,
+        )
+
+    def predict(self, rows):
+        # trees are trained on float32 features, compare the same way sklearn does
+        x = np.asarray(rows, dtype=np.float32)
+        _check_finite(x)
+        n = x.shape[0]
+        nodes = np.broadcast_to(self.roots, (n, len(self.roots))).copy()
+        row_index = np.arange(n)[:, None]
+        for _ in range(self.max_depth):
+            go_left = x[row_index, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        leaf_values = self.value[nodes]
+        out = np.full(n, self.init)
+        # accumulate stage by stage to keep sklearn's summation order
+        for stage in range(leaf_values.shape[1]):
+            out += leaf_values[:, stage]
+        return out
+
+    def predict_one(self, row):
+        x = np.asarray(row, dtype=np.float32)
+        _check_finite(x)
+        x = x.tolist()
+        feature, threshold = self._feature, self._threshold
+        left, right, leaf = self._left, self._right, self._leaf
+        out = self.init
+        for node in self._roots:
+            while not leaf[node]:
+                node = left[node] if x[feature[node]] <= threshold[node] else right[node]
+            out += self._value[node]
+        return out
+
+
+def compile_model(model):
+    """Return the flat-array equivalent of a supported sklearn regressor."""
+    name = type(model).__name__
+    if name == "GradientBoostingRegressor":
+        return CompiledGradientBoosting.from_model(model)
+    if name == "LinearRegression":
+        return CompiledLinear.from_model(model)
+    raise ValueError(f"no compiled inference for {name}")
+
+
+def check(model_dir, rows=20000, single_rows=500, seed=42):
+    """Compare compiled and sklearn predictions, return the number of mismatches."""
+    import pandas as pd
+
+    columns = ["downhill", "uphill", "length_3d", "max_elevation"]
+    rng = np.random.default_rng(seed)
+    data = np.column_stack(
+        [
+            rng.integers(0, 10000, rows),
+            rng.integers(0, 10000, rows),
+            rng.integers(0, 30000, rows),
+            np.where(rng.random(rows) < 0.5, 0, rng.integers(0, 4500, rows)),
+        ]
+    )
+    frame = pd.DataFrame(columns=columns, data=data)
+    mismatches = 0
+    for file_name in ["GradientBoostingRegressor.pkl", "LinearRegression.pkl"]:
+        with open(Path(model_dir, file_name), "rb") as fid:
+            model = pickle.load(fid)
+        compiled = compile_model(model)
+        expected = model.predict(frame)
+        batch = compiled.predict(data)
+        batch_diff = int(np.count_nonzero(batch != expected))
+        # single rows take a different BLAS path in sklearn, compare row by row
+        single_diff = sum(
+            compiled.predict_one(row) != model.predict(frame.iloc[[index]])[0]
+            for index, row in enumerate(data[:single_rows].tolist())
+        )
+        print(f"{file_name:<32} batch mismatches: {batch_diff:>6}  single mismatches: {single_diff:>6}")
+        mismatches += batch_diff + single_diff
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--check", action="store_true", help="compare against sklearn predictions")
+    parser.add_argument("model_dir", nargs="?", default=str(Path(".", "model")))
+    args = parser.parse_args()
+    if args.check:
+        sys.exit(1 if check(args.model_dir) else 0)
+    parser.print_help()
@@ -0,0 +1,391 @@
+"""In-process request metrics in the Prometheus text format, and a sampling profiler.
+
+Recording a value is a ``perf_counter`` call, a bucket bisect and a locked
+increment, so instrumenting the hot path costs a few microseconds per
+request. Nothing runs in the background unless the profiler is started.
+
+Under the prefork server every worker counts its own requests. Workers
+write snapshots to a shared directory (``write_worker_snapshot``), and
+/metrics adds up the counters and histograms of all workers, including
+the exited ones so that totals never go backwards: the master folds the
+last snapshot of every worker it reaps into one file of retired totals.
+Per-process gauges get a ``worker`` label, the worker's spawn number.
+"""
+
+from __future__ import annotations
+
+import bisect
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# seconds; covers the compiled single-row predict (~10 µs) up to slow GPX uploads
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+PREFIX = "hikeplanner"
+
+
+class Histogram:
+    """Cumulative-bucket histogram with a sum and a count, like a Prometheus histogram."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        """``(le, cumulative count)`` pairs ending with ``+Inf``."""
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            yield ("+Inf" if bound == float("inf") else repr(bound)), cumulative
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+class _StageTimer:
+    # a plain class instead of @contextmanager: no generator per use on the hot path
+    __slots__ = ("metrics", "name", "started")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.started)
+
+
+class Metrics:
+    """Stage latency histograms, request and error counters and startup phase durations."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._requests = {}
+        self._requests_total = Counter()
+        self._errors = Counter()
+        self._startup = {}
+        self._values = {}
+        self.model_version = None
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def observe_value(self, name, value, buckets):
+        """Record ``value`` in the histogram ``name`` with its own ``buckets`` (e.g. batch sizes)."""
+        with self._lock:
+            histogram = self._values.get(name)
+            if histogram is None:
+                histogram = self._values[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def stage(self, name):
+        """Record the duration of the ``with`` block as stage ``name``."""
+        return _StageTimer(self, name)
+
+    @contextmanager
+    def startup_phase(self, name):
+        """Record the duration of a model loading phase (last value wins)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.set_startup_phase(name, time.perf_counter() - started)
+
+    def set_startup_phase(self, name, seconds):
+        with self._lock:
+            self._startup[name] = seconds
+
+    def record_request(self, endpoint, status, seconds):
+        with self._lock:
+            histogram = self._requests.get(endpoint)
+            if histogram is None:
+                histogram = self._requests[endpoint] = Histogram()
+            histogram.observe(seconds)
+            self._requests_total[(endpoint, status)] += 1
+            if status >= 500:
+                self._errors[endpoint] += 1
+
+    def snapshot(self):
+        """The recorded values as plain JSON data; snapshots of several processes add up with ``merge``."""
+
+        def histograms(values):
+            return {name: [list(h.buckets), list(h.counts), h.sum, h.count] for name, h in values.items()}
+
+        with self._lock:
+            return {
+                "stages": histograms(self._stages),
+                "requests": histograms(self._requests),
+                "values": histograms(self._values),
+                "requests_total": [[endpoint, status, count] for (endpoint, status), count in self._requests_total.items()],
+                "errors": dict(self._errors),
+                "startup": dict(self._startup),
+                "model_version": self.model_version,
+            }
+
+    @staticmethod
+    def merge(snapshots):
+        """Sum of the counters and histograms of ``snapshots``; startup phases and version of the first one."""
+        snapshots = list(snapshots)
+        merged = {"stages": {}, "requests": {}, "values": {}, "requests_total": [], "errors": {},
+                  "startup": snapshots[0]["startup"] if snapshots else {},
+                  "model_version": snapshots[0]["model_version"] if snapshots else None}
+        requests_total = Counter()
+        for snapshot in snapshots:
+            for kind in ("stages", "requests", "values"):
+                for name, (buckets, counts, total, count) in snapshot[kind].items():
+                    current = merged[kind].get(name)
+                    if current is None:
+                        merged[kind][name] = [buckets, list(counts), total, count]
+                    else:
+                        current[1] = [a + b for a, b in zip(current[1], counts)]
+                        current[2] += total
+                        current[3] += count
+            for endpoint, status, count in snapshot["requests_total"]:
+                requests_total[(endpoint, status)] += count
+            for endpoint, count in snapshot["errors"].items():
+                merged["errors"][endpoint] = merged["errors"].get(endpoint, 0) + count
+        merged["requests_total"] = [[endpoint, status, count] for (endpoint, status), count in requests_total.items()]
+        return merged
+
+    def render(self, gauges=None, snapshot=None, worker_gauges=None):
+        """The Prometheus text exposition of ``snapshot`` (default: this process) plus gauges.
+
+        ``gauges`` is ``{name: value}``; ``worker_gauges`` is ``{worker: {name: value}}`` for the
+        per-process values of a multi-process server, rendered with a ``worker`` label.
+        """
+        if snapshot is None:
+            snapshot = self.snapshot()
+
+        def samples(buckets, counts):
+            cumulative = 0
+            for bound, count in zip(list(buckets) + [float("inf")], counts):
+                cumulative += count
+                yield ("+Inf" if bound == float("inf") else repr(bound)), cumulative
+
+        lines = []
+
+        def histogram(name, help_text, label, values):
+            lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}_{name} histogram")
+            for key, (buckets, counts, total, count) in sorted(values.items()):
+                for le, cumulative in samples(buckets, counts):
+                    lines.append(f"{PREFIX}_{name}_bucket{_labels([(label, key), ('le', le)])} {cumulative}")
+                lines.append(f"{PREFIX}_{name}_sum{_labels([(label, key)])} {total!r}")
+                lines.append(f"{PREFIX}_{name}_count{_labels([(label, key)])} {count}")
+
+        histogram("stage_seconds", "Latency of the request processing stages.", "stage", snapshot["stages"])
+        histogram("request_seconds", "Request latency per endpoint.", "endpoint", snapshot["requests"])
+        for name, (buckets, counts, total, count) in sorted(snapshot["values"].items()):
+            lines.append(f"# TYPE {PREFIX}_{name} histogram")
+            for le, cumulative in samples(buckets, counts):
+                lines.append(f"{PREFIX}_{name}_bucket{_labels([('le', le)])} {cumulative}")
+            lines.append(f"{PREFIX}_{name}_sum {total!r}")
+            lines.append(f"{PREFIX}_{name}_count {count}")
+
+        lines.append(f"# HELP {PREFIX}_requests_total Requests per endpoint and status code.")
+        lines.append(f"# TYPE {PREFIX}_requests_total counter")
+        for endpoint, status, count in sorted(snapshot["requests_total"]):
+            lines.append(f"{PREFIX}_requests_total{_labels([('endpoint', endpoint), ('status', status)])} {count}")
+        lines.append(f"# HELP {PREFIX}_errors_total Requests per endpoint answered with a 5xx status.")
+        lines.append(f"# TYPE {PREFIX}_errors_total counter")
+        for endpoint, count in sorted(snapshot["errors"].items()):
+            lines.append(f"{PREFIX}_errors_total{_labels([('endpoint', endpoint)])} {count}")
+
+        lines.append(f"# HELP {PREFIX}_startup_seconds Duration of the last run of each model loading phase.")
+        lines.append(f"# TYPE {PREFIX}_startup_seconds gauge")
+        for phase, seconds in sorted(snapshot["startup"].items()):
+            lines.append(f"{PREFIX}_startup_seconds{_labels([('phase', phase)])} {seconds!r}")
+        if snapshot["model_version"] is not None:
+            lines.append(f"# HELP {PREFIX}_model_info Version of the model being served.")
+            lines.append(f"# TYPE {PREFIX}_model_info gauge")
+            lines.append(f"{PREFIX}_model_info{_labels([('version', snapshot['model_version'])])} 1")
+        for name, value in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE {PREFIX}_{name} gauge")
+            lines.append(f"{PREFIX}_{name} {value!r}")
+        per_name = {}
+        for worker, values in (worker_gauges or {}).items():
+            for name, value in values.items():
+                per_name.setdefault(name, []).append((str(worker), value))
+        for name, values in sorted(per_name.items()):
+            lines.append(f"# TYPE {PREFIX}_{name} gauge")
+            for worker, value in sorted(values):
+                lines.append(f"{PREFIX}_{name}{_labels([('worker', worker)])} {value!r}")
+        return "\n".join(lines) + "\n"
+
+
+RETIRED_NAME = "retired.json"
+
+
+def _worker_path(directory, worker):
+    return os.path.join(directory, f"worker-{worker}.json")
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding="utf-8") as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as handle:
+        json.dump(data, handle)
+    os.replace(tmp_path, path)
+
+
+def write_worker_snapshot(directory, worker, snapshot, gauges, alive=True):
+    """Replace the snapshot file of ``worker`` (its spawn number, never reused) in ``directory`` atomically."""
+    _write_json(
+        _worker_path(directory, worker),
+        {"worker": worker, "pid": os.getpid(), "alive": alive, "metrics": snapshot, "gauges": gauges},
+    )
+
+
+def retire_worker_snapshot(directory, worker):
+    """Fold the last snapshot of the exited ``worker`` into the retired totals and remove its file.
+
+    Called by the master only, after reaping the worker. The retired totals
+    list the workers folded into them and readers skip those files, so a
+    scrape between the two steps counts the worker exactly once.
+    """
+    path = _worker_path(directory, worker)
+    snapshot = _read_json(path)
+    if snapshot is None:
+        return False
+    retired_path = os.path.join(directory, RETIRED_NAME)
+    retired = _read_json(retired_path) or {"workers": [], "metrics": None}
+    parts = [snapshot["metrics"]] + ([retired["metrics"]] if retired["metrics"] is not None else [])
+    _write_json(retired_path, {"workers": retired["workers"] + [worker], "metrics": Metrics.merge(parts)})
+    os.unlink(path)
+    return True
+
+
+def _running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def read_worker_snapshots(directory):
+    """The snapshots of the workers not retired yet, plus one entry (worker "retired") with the totals of the others.
+
+    ``alive`` is false for exited workers.
+    """
+    snapshots = []
+    for name in os.listdir(directory):
+        if not (name.startswith("worker-") and name.endswith(".json")):
+            continue
+        snapshot = _read_json(os.path.join(directory, name))
+        if snapshot is None:
+            continue
+        # a killed worker never wrote its final snapshot
+        snapshot["alive"] = snapshot["alive"] and _running(snapshot["pid"])
+        snapshots.append(snapshot)
+    # read after the worker files: a worker retired in between is found here and skipped above
+    retired = _read_json(os.path.join(directory, RETIRED_NAME))
+    if retired is not None:
+        folded = set(retired["workers"])
+        snapshots = [snapshot for snapshot in snapshots if snapshot["worker"] not in folded]
+        snapshots.append({"worker": "retired", "pid": None, "alive": False, "metrics": retired["metrics"], "gauges": {}})
+    return snapshots
+
+
+class SamplingProfiler:
+    """Samples the stacks of all other threads every ``interval`` seconds while running.
+
+    ``collapsed()`` returns the counts in the collapsed-stack format that
+    flamegraph tools read (``frame;frame;frame count`` per line).
+    """
+
+    def __init__(self, interval=0.005, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        # guards ``stacks`` between the sampling thread and readers; ``_lock`` is held while joining it
+        self._stacks_lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=None):
+        with self._lock:
+            if self.running:
+                return False
+            if interval:
+                self.interval = interval
+            self.stacks = Counter()
+            self.samples = 0
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True, name="sampling-profiler")
+            self._thread.start()
+            return True
+
+    def stop(self):
+        with self._lock:
+            if not self.running:
+                return False
+            self._stop.set()
+            self._thread.join()
+            return True
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            sample = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                    frame = frame.f_back
+                sample.append(";".join(reversed(stack)))
+            with self._stacks_lock:
+                self.stacks.update(sample)
+                self.samples += 1
+
+    def collapsed(self, limit=None):
+        with self._stacks_lock:
+            stacks = Counter(self.stacks)
+        stacks = stacks.most_common(limit)
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
@@ -0,0 +1,171 @@
+"""Local, checksum-verified cache of the model blobs in Azure Blob Storage.
+
+Every synced container version lives in its own directory under
+``versions/`` of the model folder; the manifest names the active one and
+records the MD5/ETag of every blob. On startup:
+
+* if the latest container is the one already synced and every file of its
+  directory still matches its recorded MD5, nothing else is requested from
+  storage;
+* otherwise a new version directory is staged: blobs whose content did not
+  change are hard-linked from the active version, the others downloaded
+  concurrently and streamed to disk in chunks. Only when every file is
+  there and verified does the manifest, replaced atomically, switch to the
+  new directory. A failed sync leaves the active version untouched.
+
+Blobs that disappeared from the container are not carried over, and
+version directories other than the new and the previous one (which the
+running process may still have mapped) are removed after the switch.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+MANIFEST_NAME = "manifest.json"
+VERSIONS_DIR = "versions"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def latest_model_container(blob_service_client, prefix):
+    """Return the name of the ``{prefix}-N`` container with the highest N."""
+    suffix = max(
+        int(container.name.split("-")[-1])
+        for container in blob_service_client.list_containers()
+        if container.name.startswith(prefix)
+    )
+    return f"{prefix}-{suffix}"
+
+
+def file_md5(path):
+    digest = hashlib.md5()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_manifest(local_dir):
+    try:
+        with open(Path(local_dir, MANIFEST_NAME), encoding="utf-8") as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return {"container": None, "path": None, "blobs": {}}
+
+
+def model_path(local_dir):
+    """Directory of the active synced version; ``local_dir`` itself for files not synced from storage."""
+    path = read_manifest(local_dir).get("path")
+    return Path(local_dir, path) if path else Path(local_dir)
+
+
+def _write_manifest(local_dir, manifest):
+    path = Path(local_dir, MANIFEST_NAME)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as handle:
+        json.dump(manifest, handle, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _blob_md5(blob):
+    content_md5 = blob.content_settings.content_md5 if blob.content_settings else None
+    return bytes(content_md5).hex() if content_md5 else None
+
+
+def _is_current(directory, name, entry):
+    path = Path(directory, name)
+    return path.is_file() and path.stat().st_size == entry["size"] and file_md5(path) == entry["md5"]
+
+
+def _link(source, target):
+    """Reuse an unchanged file in the staged version; files are never written in place, sharing is safe."""
+    target.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def _download(container_client, blob, directory):
+    """Stream one blob into ``directory`` and verify its MD5."""
+    path = Path(directory, blob.name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.md5()
+    with open(path, "wb") as handle:
+        for chunk in container_client.download_blob(blob.name).chunks():
+            digest.update(chunk)
+            handle.write(chunk)
+    md5 = digest.hexdigest()
+    expected = _blob_md5(blob)
+    if expected and md5 != expected:
+        raise IOError(f"checksum mismatch for {blob.name}: expected {expected}, got {md5}")
+    return {"etag": blob.etag, "md5": md5, "size": blob.size}
+
+
+def _prune(local_dir, keep):
+    """Remove the version directories not in ``keep``, including those of failed syncs."""
+    for entry in Path(local_dir, VERSIONS_DIR).iterdir():
+        if entry.name not in keep:
+            print(f"removing stale model version {entry.name}")
+            shutil.rmtree(entry, ignore_errors=True)
+
+
+def sync_model(blob_service_client, container_name, local_dir, max_workers=4):
+    """Bring the active version in ``local_dir`` up to date with ``container_name``; returns its directory."""
+    local_dir = Path(local_dir)
+    versions = local_dir / VERSIONS_DIR
+    versions.mkdir(parents=True, exist_ok=True)
+    manifest = read_manifest(local_dir)
+    active = model_path(local_dir)
+    if manifest["container"] == container_name and manifest["blobs"] and all(
+        _is_current(active, name, entry) for name, entry in manifest["blobs"].items()
+    ):
+        print(f"model cache is up to date with {container_name}")
+        return active
+
+    container_client = blob_service_client.get_container_client(container_name)
+    staging = Path(tempfile.mkdtemp(prefix=f"{container_name}.", dir=versions))
+    try:
+        blobs = {}
+        changed = []
+        for blob in container_client.list_blobs():
+            entry = manifest["blobs"].get(blob.name)
+            md5 = _blob_md5(blob)
+            unchanged = entry is not None and (
+                (md5 is not None and md5 == entry["md5"]) or blob.etag == entry["etag"]
+            )
+            if unchanged and _is_current(active, blob.name, entry):
+                print(f"reusing cached {blob.name}")
+                _link(Path(active, blob.name), Path(staging, blob.name))
+                blobs[blob.name] = dict(entry, etag=blob.etag)
+            else:
+                changed.append(blob)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {blob.name: executor.submit(_download, container_client, blob, staging) for blob in changed}
+            for name, future in futures.items():
+                blobs[name] = future.result()
+                print(f"downloaded {name}")
+
+        # verify the staged set as a whole, reused files included, before switching to it
+        for name, entry in blobs.items():
+            if not _is_current(staging, name, entry):
+                raise IOError(f"staged {name} does not match its checksum")
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    _write_manifest(local_dir, {
+        "container": container_name,
+        "path": staging.relative_to(local_dir).as_posix(),
+        "blobs": blobs,
+    })
+    print(f"switched model files to {staging.resolve()}")
+    _prune(local_dir, {staging.name, active.name})
+    return staging
@@ -0,0 +1,311 @@
+"""Preforking production server for the HikePlanner backend.
+
+Startup is staged: the master binds the socket and immediately forks
+workers without models, which answer with the formula estimates (and 503
+on /readyz). It then runs the model loading phase once (download,
+unpickle, compile, warm-up), freezes the loaded objects out of the garbage
+collector's reach and replaces those workers with ones forked from the
+loaded state. Every worker serves the app on the shared listening socket
+with a threaded WSGI server, and all of them read the master's model pages
+copy-on-write instead of holding a copy each. If the loading phase fails,
+the workers are replaced by formula-only ones that report the error on
+/readyz, and loading is retried every LOAD_RETRY_INTERVAL seconds. Linux/macOS
+only (``os.fork``).
+
+Signals to the master:
+
+* ``SIGHUP``: graceful restart. The master loads the latest model, forks a
+  new set of workers and only then lets the old ones finish their
+  in-flight requests and exit. The socket stays open throughout, so no
+  request is refused. ``/api/admin/reload`` in a worker sends this signal.
+* ``SIGTERM``/``SIGINT``: graceful shutdown of all workers, then exit.
+
+Crashed workers are replaced. With HIKEPLANNER_RELOAD_INTERVAL set the
+master checks for a new model version and restarts the workers when it
+finds one. Workers publish their metrics every METRICS_INTERVAL seconds to
+a directory shared with the others (HIKEPLANNER_METRICS_DIR, default a
+fresh temporary one), so /metrics reports the totals of all workers
+whichever one answers the scrape. The master folds the metrics of every
+worker it reaps into one file of retired totals.
+
+    python serve.py --port 80 --workers 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import os
+import signal
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import app as backend
+from metrics import RETIRED_NAME, retire_worker_snapshot
+
+ENV_WORKERS_KEY = "HIKEPLANNER_WORKERS"
+ENV_METRICS_DIR_KEY = "HIKEPLANNER_METRICS_DIR"
+ENV_RELOAD_INTERVAL_KEY = backend.ENV_RELOAD_INTERVAL_KEY
+WORKER_SHUTDOWN_TIMEOUT = 30
+# seconds before a failed initial model load is retried
+LOAD_RETRY_INTERVAL = 30
+# idle keep-alive connections are closed after this many seconds, so retiring workers can finish
+KEEPALIVE_TIMEOUT = 5
+# seconds between metric snapshots of a worker; a scrape sees the other workers this much delayed
+METRICS_INTERVAL = 1.0
+
+
+def listen(host, port, backlog=2048):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def publish_metrics_periodically(stopped):
+    while not stopped.wait(METRICS_INTERVAL):
+        try:
+            backend.publish_metrics()
+        except OSError as ex:
+            print(f"worker {os.getpid()} cannot publish its metrics: {ex}", file=sys.stderr)
+
+
+def run_worker(sock, models, master_pid, metrics_dir, worker_id):
+    """Body of a forked worker; never returns."""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class RequestHandler(WSGIRequestHandler):
+        timeout = KEEPALIVE_TIMEOUT
+
+    for signum in (signal.SIGHUP, signal.SIGINT, signal.SIGTERM, signal.SIGCHLD):
+        signal.signal(signum, signal.SIG_DFL)
+    backend.request_restart = lambda: os.kill(master_pid, signal.SIGHUP)
+    backend.metrics_dir = metrics_dir
+    backend.worker_id = worker_id
+    application = backend.create_app(models, background_tasks=False, load=False)
+    host, port = sock.getsockname()[:2]
+    server = make_server(host, port, application, threaded=True, request_handler=RequestHandler, fd=sock.fileno())
+    # wait for in-flight requests on shutdown instead of dropping them
+    server.daemon_threads = False
+    server.block_on_close = True
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever() to return, so it cannot run in this (serving) thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stopped = threading.Event()
+    threading.Thread(target=publish_metrics_periodically, args=(stopped,), daemon=True).start()
+    code = 0
+    try:
+        backend.publish_metrics()
+        server.serve_forever()
+        server.server_close()
+    except Exception as ex:
+        print(f"worker {os.getpid()} failed: {ex}", file=sys.stderr)
+        code = 1
+    finally:
+        stopped.set()
+        try:
+            # the final counts stay part of the totals after the worker is gone
+            backend.publish_metrics(alive=False)
+        except OSError:
+            pass
+        os._exit(code)
+
+
+class Master:
+    def __init__(self, sock, workers, reload_interval=0, metrics_dir=None):
+        self.sock = sock
+        self.metrics_dir = metrics_dir
+        self.worker_count = workers
+        self.reload_interval = reload_interval
+        self.models = None
+        self.workers = set()
+        self.retiring = {}
+        # pid -> spawn number; numbers are never reused, pids may be
+        self.worker_ids = {}
+        self.spawned = 0
+        self.restart_requested = False
+        self.stopping = False
+        self.retry_at = None
+        # error of the failed initial load the current workers report
+        self.load_error = None
+
+    def load(self):
+        # let the cyclic collector see the previous model again so it can be freed
+        gc.unfreeze()
+        if self.models is None:
+            self.models = backend.load_initial_models()
+        else:
+            client = backend.storage_client()
+            if client is not None:
+                version = backend.latest_version(client)
+                self.models = backend.load_models(version, backend.download_model(client, version))
+            else:
+                self.models = backend.load_models()
+        # objects that exist before the fork are never collected; keeping the GC from
+        # touching their headers keeps their pages shared with the workers
+        gc.collect()
+        gc.freeze()
+        print(f"*** Master {os.getpid()} serving model {self.models.version} ***")
+
+    def spawn(self):
+        self.spawned += 1
+        pid = os.fork()
+        if pid == 0:
+            run_worker(self.sock, self.models, os.getppid(), self.metrics_dir, self.spawned)
+        self.workers.add(pid)
+        self.worker_ids[pid] = self.spawned
+
+    def retire(self, pids):
+        deadline = time.monotonic() + WORKER_SHUTDOWN_TIMEOUT
+        for pid in pids:
+            self.workers.discard(pid)
+            self.retiring[pid] = deadline
+            self._signal(pid, signal.SIGTERM)
+
+    def restart(self):
+        """Load the latest model, start new workers, then retire the old ones."""
+        self.restart_requested = False
+        previous_version = self.models.version if self.models is not None else "the formulas only"
+        try:
+            self.load()
+        except Exception as ex:
+            print(f"model loading failed, keeping {previous_version}: {ex}", file=sys.stderr)
+            if self.models is None:
+                self.retry_at = time.monotonic() + LOAD_RETRY_INTERVAL
+                if str(ex) != self.load_error:
+                    # the formula workers were forked while loading; new ones inherit the failed
+                    # state, so /readyz reports the error instead of "loading"
+                    self.load_error = str(ex)
+                    self.replace_workers()
+                    print(f"*** Restarted {self.worker_count} workers with the formulas only ***")
+            return
+        self.load_error = None
+        self.replace_workers()
+        print(f"*** Restarted {self.worker_count} workers with model {self.models.version} ***")
+
+    def replace_workers(self):
+        old_workers = list(self.workers)
+        self.workers = set()
+        for _ in range(self.worker_count):
+            self.spawn()
+        self.retire(old_workers)
+
+    def _signal(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self._retire_metrics(pid)
+            if pid in self.retiring:
+                del self.retiring[pid]
+            elif pid in self.workers:
+                self.workers.discard(pid)
+                if not self.stopping:
+                    print(f"worker {pid} exited with status {status}, starting a new one", file=sys.stderr)
+                    self.spawn()
+
+    def _retire_metrics(self, pid):
+        worker_id = self.worker_ids.pop(pid, None)
+        if worker_id is None or self.metrics_dir is None:
+            return
+        try:
+            retire_worker_snapshot(self.metrics_dir, worker_id)
+        except (OSError, ValueError, KeyError) as ex:
+            print(f"cannot fold the metrics of worker {worker_id} into the retired totals: {ex}", file=sys.stderr)
+
+    def _new_version_available(self):
+        client = backend.storage_client()
+        if client is None:
+            return False
+        try:
+            return backend.latest_version(client) != self.models.version
+        except Exception as ex:
+            print(f"checking for a new model failed: {ex}", file=sys.stderr)
+            return False
+
+    def run(self):
+        signal.signal(signal.SIGHUP, lambda signum, frame: setattr(self, "restart_requested", True))
+        signal.signal(signal.SIGTERM, lambda signum, frame: setattr(self, "stopping", True))
+        signal.signal(signal.SIGINT, lambda signum, frame: setattr(self, "stopping", True))
+        # answer with the formulas right away, the model-backed workers replace these once loaded
+        for _ in range(self.worker_count):
+            self.spawn()
+        print(f"*** {self.worker_count} workers listening on {self.sock.getsockname()[:2]} ***")
+        self.restart()
+
+        next_check = time.monotonic() + self.reload_interval
+        while not self.stopping:
+            time.sleep(0.2)
+            self._reap()
+            if self.models is None and self.retry_at is not None and time.monotonic() >= self.retry_at:
+                self.restart_requested = True
+            if self.reload_interval > 0 and time.monotonic() >= next_check:
+                next_check = time.monotonic() + self.reload_interval
+                if self._new_version_available():
+                    self.restart_requested = True
+            if self.restart_requested:
+                self.restart()
+            for pid, deadline in list(self.retiring.items()):
+                if time.monotonic() > deadline:
+                    self._signal(pid, signal.SIGKILL)
+
+        self.retire(list(self.workers))
+        while self.retiring:
+            time.sleep(0.1)
+            self._reap()
+            for pid, deadline in list(self.retiring.items()):
+                if time.monotonic() > deadline:
+                    self._signal(pid, signal.SIGKILL)
+        self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=80)
+    parser.add_argument(
+        "-w", "--workers",
+        type=int,
+        default=int(os.environ.get(ENV_WORKERS_KEY, os.cpu_count() or 1)),
+        help=f"worker processes (default: ${ENV_WORKERS_KEY} or one per CPU)",
+    )
+    args = parser.parse_args()
+    sock = listen(args.host, args.port)
+    metrics_dir = os.environ.get(ENV_METRICS_DIR_KEY)
+    own_dir = not metrics_dir
+    if own_dir:
+        metrics_dir = tempfile.mkdtemp(prefix="hikeplanner-metrics-")
+    else:
+        # counters restart with the server, like those of a single process
+        os.makedirs(metrics_dir, exist_ok=True)
+        for name in os.listdir(metrics_dir):
+            if name.startswith("worker-") or name == RETIRED_NAME:
+                os.unlink(os.path.join(metrics_dir, name))
+    try:
+        Master(sock, args.workers, float(os.environ.get(ENV_RELOAD_INTERVAL_KEY, 0)), metrics_dir).run()
+    finally:
+        if own_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""Index of the recorded hikes for "similar hikes" queries.
+
+The artifact (``SimilarHikes.npz``, no pickles) holds per hike the features
+(downhill, uphill, length_3d, max_elevation), the recorded moving time, the
+bounding box (lon/lat) and the name and URL as one UTF-8 blob with offsets.
+Two structures answer the queries without touching MongoDB:
+
+* KD-trees on the features scaled to unit variance, built when the index
+  is loaded, find the k nearest hikes: one over all four features and one
+  without max_elevation, for queries that do not give it;
+* a uniform lon/lat grid in CSR form (sorted cell keys, start offsets and
+  member ids) lists the hikes whose bounding box touches each cell, so a
+  map region is resolved to its candidates by looking up the covered cells.
+
+A region query ranks its candidates directly when there are few of them and
+otherwise asks the tree for more and more neighbours until k of them lie
+in the region.
+"""
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import numpy as np
+
+INDEX_NAME = "SimilarHikes.npz"
+FEATURE_COLUMNS = ['downhill', 'uphill', 'length_3d', 'max_elevation']
+# degrees; hikes span a few km, so most boxes fall into one or two cells
+CELL_SIZE = 0.1
+# region candidates up to this count are ranked directly instead of through the tree
+DIRECT_RANKING_LIMIT = 2000
+# regions covering more cells are filtered by testing every bounding box
+REGION_CELL_LIMIT = 64
+# lon/lat extent of the world, regions are clipped to it
+WORLD = (-180.0, -90.0, 180.0, 90.0)
+
+
+def parse_bounds(bounds):
+    """``(min_lon, min_lat, max_lon, max_lat)`` of a track's ``bounds`` field, or None.
+
+    The hikr dump stores the bounds as ``{"min": Point, "max": Point}`` with
+    GeoJSON ``[lon, lat]`` coordinates; from the CSV import they arrive as
+    the string form of that dict.
+    """
+    if isinstance(bounds, str):
+        try:
+            bounds = json.loads(bounds.replace("'", '"'))
+        except ValueError:
+            return None
+    try:
+        (min_lon, min_lat), (max_lon, max_lat) = bounds["min"]["coordinates"][:2], bounds["max"]["coordinates"][:2]
+    except (KeyError, TypeError, ValueError):
+        return None
+    return float(min_lon), float(min_lat), float(max_lon), float(max_lat)
+
+
+def _cells(bounds, cell_size):
+    """Integer (x, y) ranges of the grid cells a box covers."""
+    low = np.floor(np.asarray(bounds[:2]) / cell_size).astype(np.int64)
+    high = np.floor(np.asarray(bounds[2:]) / cell_size).astype(np.int64)
+    return range(low[0], high[0] + 1), range(low[1], high[1] + 1)
+
+
+def _cell_key(x, y):
+    # x in [-1800, 1800], y in [-900, 900] for 0.1 degree cells: one int64 per cell
+    return (x << 32) + (y & 0xFFFFFFFF)
+
+
+def build_index(path, features, moving_time, bounds, names, urls, cell_size=CELL_SIZE, meta=None):
+    """Write the index of ``n`` hikes; ``bounds`` rows are NaN where unknown."""
+    features = np.asarray(features, dtype=np.float32)
+    bounds = np.asarray(bounds, dtype=np.float64)
+    members = {}
+    for hike, box in enumerate(bounds):
+        if np.isnan(box).any():
+            continue
+        xs, ys = _cells(box, cell_size)
+        for x in xs:
+            for y in ys:
+                members.setdefault(_cell_key(x, y), []).append(hike)
+    keys = np.array(sorted(members), dtype=np.int64)
+    starts = np.zeros(len(keys) + 1, dtype=np.int64)
+    starts[1:] = np.cumsum([len(members[key]) for key in keys])
+    cell_members = np.array([hike for key in keys for hike in members[key]], dtype=np.int32)
+
+    encoded = [text.encode("utf-8") for pair in zip(names, urls) for text in pair]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(text) for text in encoded])
+
+    scale = features.std(axis=0)
+    header = dict(meta or {}, hikes=len(features), columns=FEATURE_COLUMNS)
+    tmp_path = Path(path).with_name(Path(path).name + ".tmp")
+    with open(tmp_path, "wb") as handle:
+        np.savez(
+            handle,
+            header=np.array(json.dumps(header)),
+            features=features,
+            mean=features.mean(axis=0),
+            scale=np.where(scale > 0, scale, 1),
+            moving_time=np.asarray(moving_time, dtype=np.float32),
+            bounds=bounds.astype(np.float32),
+            text=np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            text_offsets=offsets,
+            cell_size=np.float64(cell_size),
+            cell_keys=keys,
+            cell_starts=starts,
+            cell_members=cell_members,
+        )
+    Path(tmp_path).replace(path)
+    return header
+
+
+class SimilarHikes:
+    """The loaded index; ``query`` is safe to call from many threads."""
+
+    def __init__(self, arrays):
+        from sklearn.neighbors import KDTree
+
+        self.header = json.loads(str(arrays["header"]))
+        self.features = arrays["features"]
+        self.mean = arrays["mean"].astype(np.float64)
+        self.scale = arrays["scale"].astype(np.float64)
+        self.moving_time = arrays["moving_time"]
+        self.bounds = arrays["bounds"]
+        self._text = arrays["text"].tobytes()
+        self._offsets = arrays["text_offsets"]
+        self.cell_size = float(arrays["cell_size"])
+        self._cell_keys = arrays["cell_keys"]
+        self._cell_starts = arrays["cell_starts"]
+        self._cell_members = arrays["cell_members"]
+        # one contiguous array per edge keeps the overlap test to four vectorized comparisons
+        self._min_lon, self._min_lat, self._max_lon, self._max_lat = (
+            np.ascontiguousarray(self.bounds[:, column]) for column in range(4)
+        )
+        self._scaled = (self.features - self.mean) / self.scale
+        # by number of query features; a missing max_elevation must not count as 0 m
+        self._trees = {
+            len(FEATURE_COLUMNS): KDTree(self._scaled),
+            len(FEATURE_COLUMNS) - 1: KDTree(self._scaled[:, :-1]),
+        }
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls({name: arrays[name] for name in arrays.files})
+
+    def __len__(self):
+        return len(self.features)
+
+    def _string(self, index):
+        return self._text[self._offsets[index]:self._offsets[index + 1]].decode("utf-8")
+
+    def _overlaps(self, region, ids=slice(None)):
+        # NaN bounds compare False, hikes without bounds never match a region
+        return (
+            (self._min_lon[ids] <= region[2]) & (self._max_lon[ids] >= region[0])
+            & (self._min_lat[ids] <= region[3]) & (self._max_lat[ids] >= region[1])
+        )
+
+    def in_region(self, region):
+        """Ids of the hikes whose bounding box intersects ``(min_lon, min_lat, max_lon, max_lat)``."""
+        region = np.asarray(region, dtype=np.float64)
+        if not np.isfinite(region).all():
+            raise ValueError("region must be finite")
+        # beyond the world the cell numbers of huge regions would overflow
+        region = np.clip(region, WORLD[:2] * 2, WORLD[2:] * 2)
+        xs, ys = _cells(region, self.cell_size)
+        if len(xs) * len(ys) > REGION_CELL_LIMIT:
+            # a large region covers most hikes anyway, testing all boxes is cheaper than merging cells
+            return np.flatnonzero(self._overlaps(region))
+        x, y = np.meshgrid(np.arange(xs.start, xs.stop), np.arange(ys.start, ys.stop), indexing="ij")
+        keys = _cell_key(x.ravel(), y.ravel())
+        positions = np.searchsorted(self._cell_keys, keys)
+        found = positions < len(self._cell_keys)
+        positions, keys = positions[found], keys[found]
+        positions = positions[self._cell_keys[positions] == keys]
+        if len(positions) == 0:
+            return np.empty(0, dtype=np.intp)
+        candidates = np.unique(np.concatenate(
+            [self._cell_members[self._cell_starts[p]:self._cell_starts[p + 1]] for p in positions]
+        ))
+        return candidates[self._overlaps(region, candidates)]
+
+    def query(self, features, k=5, region=None):
+        """``[(id, distance)]`` of the ``k`` hikes closest to ``features``, optionally within ``region``.
+
+        ``features`` are the ``FEATURE_COLUMNS``, or all but max_elevation to
+        compare the other three only. ``region`` is clipped to the world; a
+        non-finite feature or region coordinate raises ValueError.
+        """
+        columns = len(features)
+        if columns not in self._trees:
+            raise ValueError(f"expected {len(FEATURE_COLUMNS)} or {len(FEATURE_COLUMNS) - 1} features, got {columns}")
+        tree = self._trees[columns]
+        point = ((np.asarray(features, dtype=np.float64) - self.mean[:columns]) / self.scale[:columns])[None, :]
+        if not np.isfinite(point).all():
+            raise ValueError("features must be finite")
+        k = min(k, len(self))
+        if region is None:
+            distances, ids = tree.query(point, k=k)
+            return list(zip(ids[0].tolist(), distances[0].tolist()))
+
+        allowed = self.in_region(region)
+        if len(allowed) <= DIRECT_RANKING_LIMIT:
+            distances = np.sqrt(((self._scaled[allowed, :columns] - point) ** 2).sum(axis=1))
+            order = np.argsort(distances, kind="stable")[:k]
+            return list(zip(allowed[order].tolist(), distances[order].tolist()))
+        mask = np.zeros(len(self), dtype=bool)
+        mask[allowed] = True
+        wanted = min(k, len(allowed))
+        fetch = 4 * k
+        while True:
+            distances, ids = tree.query(point, k=min(fetch, len(self)))
+            inside = mask[ids[0]]
+            if inside.sum() >= wanted or fetch >= len(self):
+                return list(zip(ids[0][inside][:k].tolist(), distances[0][inside][:k].tolist()))
+            fetch *= 4
+
+    def hike(self, index, distance=None):
+        """JSON-ready description of one hike."""
+        downhill, uphill, length, max_elevation = self.features[index].tolist()
+        box = self.bounds[index].tolist()
+        return {
+            "name": self._string(2 * index),
+            "url": self._string(2 * index + 1),
+            "moving_time": float(self.moving_time[index]),
+            "downhill": downhill,
+            "uphill": uphill,
+            "length": length,
+            "max_elevation": max_elevation,
+            "bounds": None if np.isnan(box).any() else box,
+            "distance": distance,
+        }
@@ -0,0 +1,157 @@
+"""Per-user corrections of the global hiking time model.
+
+A user's correction is a small ridge regression of the log ratio between
+their recorded moving times and the global GradientBoostingRegressor's
+predictions on the standardized (downhill, uphill, length_3d) of their
+tracks. The personalized estimate is::
+
+    global prediction * exp(clip(intercept + coef . standardized features, ±log 3))
+
+The intercept alone is a speed factor, the coefficients say where the user
+deviates, e.g. slower than average on long descents. The ridge penalty
+shrinks users with few tracks towards the global model. The linear term is
+unbounded far outside the training data, so the factor is limited to
+``[1/MAX_FACTOR, MAX_FACTOR]``.
+
+All users share one artifact: ``UserCorrections.npy``, a record array
+sorted by a 64-bit hash of the user id (the ids themselves are not
+stored) with the track count and the parameters, plus a JSON header with
+the standardization, the penalty and the MD5 of the global model the
+corrections belong to. The backend memory-maps the array and keeps only
+the sorted keys (8 bytes per user) in memory; a user is found by binary
+search and only the pages of the users actually asked for are read. The
+decoded corrections of recent users are kept in a byte-capped LRU by the
+caller.
+
+    python user_corrections.py ../model --user someone
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from model_store import file_md5
+
+CORRECTIONS_NAME = "UserCorrections.npy"
+HEADER_NAME = "UserCorrections.json"
+GLOBAL_MODEL_NAME = "GradientBoostingRegressor.pkl"
+CORRECTION_FEATURES = ["downhill", "uphill", "length_3d"]
+RECORD_DTYPE = np.dtype([
+    ("key", "<u8"),
+    ("tracks", "<u4"),
+    ("params", "<f4", (len(CORRECTION_FEATURES) + 1,)),
+])
+# a correction at most triples or thirds the global prediction
+MAX_FACTOR = 3.0
+MAX_LOG_FACTOR = math.log(MAX_FACTOR)
+
+
+def user_key(user_id):
+    """Stable 64-bit key of a user id."""
+    digest = hashlib.blake2b(str(user_id).strip().lower().encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def write_corrections(model_dir, keys, tracks, params, header):
+    """Write the records sorted by key and the header; returns the header."""
+    records = np.empty(len(keys), dtype=RECORD_DTYPE)
+    records["key"] = keys
+    records["tracks"] = tracks
+    records["params"] = params
+    records.sort(order="key")
+    if (records["key"][1:] == records["key"][:-1]).any():
+        raise ValueError("duplicate user keys")
+    header = dict(header, users=len(records), md5=file_md5(Path(model_dir, GLOBAL_MODEL_NAME)))
+    tmp_records = Path(model_dir, CORRECTIONS_NAME + ".tmp")
+    with open(tmp_records, "wb") as handle:
+        np.save(handle, records)
+    tmp_header = Path(model_dir, HEADER_NAME + ".tmp")
+    with open(tmp_header, "w", encoding="utf-8") as handle:
+        json.dump(header, handle, indent=2)
+    os.replace(tmp_records, Path(model_dir, CORRECTIONS_NAME))
+    os.replace(tmp_header, Path(model_dir, HEADER_NAME))
+    return header
+
+
+class UserCorrection:
+    __slots__ = ("intercept", "coef", "tracks")
+
+    def __init__(self, intercept, coef, tracks):
+        self.intercept = intercept
+        self.coef = coef
+        self.tracks = tracks
+
+    @property
+    def nbytes(self):
+        """Approximate memory held by this object, for the byte budget of the LRU cache."""
+        return sys.getsizeof(self) + sys.getsizeof(self.coef) + sum(sys.getsizeof(c) for c in self.coef)
+
+    def factor(self, standardized):
+        exponent = self.intercept + sum(c * x for c, x in zip(self.coef, standardized))
+        return math.exp(min(max(exponent, -MAX_LOG_FACTOR), MAX_LOG_FACTOR))
+
+
+class UserCorrections:
+    """Memory-mapped per-user parameters; ``get`` looks a user up by binary search."""
+
+    def __init__(self, records, header):
+        self.records = records
+        self.header = header
+        self.mean = header["mean"]
+        self.scale = header["scale"]
+        # the sorted key column as its own array, binary search on the strided record field is slower
+        self._keys = np.ascontiguousarray(records["key"])
+
+    @classmethod
+    def load(cls, model_dir):
+        with open(Path(model_dir, HEADER_NAME), encoding="utf-8") as handle:
+            header = json.load(handle)
+        records = np.load(Path(model_dir, CORRECTIONS_NAME), mmap_mode="r")
+        if records.dtype != RECORD_DTYPE:
+            raise ValueError(f"unexpected record layout {records.dtype}")
+        return cls(records.view(np.ndarray), header)
+
+    def matches(self, model_dir):
+        """True if the corrections were fitted on the global model in ``model_dir``."""
+        return file_md5(Path(model_dir, GLOBAL_MODEL_NAME)) == self.header["md5"]
+
+    def __len__(self):
+        return len(self.records)
+
+    def get(self, user_id):
+        """The user's ``UserCorrection``, or None if the user has none."""
+        key = user_key(user_id)
+        position = int(np.searchsorted(self._keys, key))
+        if position == len(self._keys) or int(self._keys[position]) != key:
+            return None
+        record = self.records[position]
+        params = record["params"].tolist()
+        return UserCorrection(params[0], params[1:], int(record["tracks"]))
+
+    def standardize(self, downhill, uphill, length):
+        return [(value - mean) / scale for value, mean, scale in zip((downhill, uphill, length), self.mean, self.scale)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the stored correction of a user.")
+    parser.add_argument("model_dir", nargs="?", default="model")
+    parser.add_argument("--user", required=True)
+    args = parser.parse_args()
+    corrections = UserCorrections.load(args.model_dir)
+    correction = corrections.get(args.user)
+    if correction is None:
+        raise SystemExit(f"No correction for {args.user!r} among {len(corrections)} users.")
+    print(f"{args.user}: {correction.tracks} tracks, speed factor {math.exp(correction.intercept):.3f}, "
+          f"coefficients {dict(zip(CORRECTION_FEATURES, (round(c, 4) for c in correction.coef)))}")
+
+
+if __name__ == "__main__":
+    main()
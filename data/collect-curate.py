@@ -1,11 +1,18 @@
-﻿import csv
+﻿import argparse
+import csv
+import hashlib
 import json
 import re
 import shutil
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 
 import gpxpy
+import numpy as np
+
+from gpx_simplify import CHECKED_METRICS, simplify_checked
 
 
 def _safe_id(raw: str, index: int) -> str:
@@ -23,7 +30,133 @@ def _has_points(gpx: gpxpy.gpx.GPX) -> bool:
     return False
 
 
+def _curate(gpx_text: str, settings: dict | None = None) -> tuple[str, str | None, dict | None]:
+    """Validate one track in a worker; returns (kept/empty/invalid, XML, simplification statistics).
+
+    Without ``settings`` the XML is pretty-printed as recorded. With them it
+    is written compact and, if ``settings["tolerance"]`` is set, simplified
+    (see gpx_simplify.py).
+    """
+    try:
+        gpx = gpxpy.parse(gpx_text)
+    except Exception:
+        return "invalid", None, None
+
+    if not _has_points(gpx):
+        return "empty", None, None
+
+    if settings is None:
+        return "kept", gpx.to_xml(prettyprint=True), None
+
+    stats = {}
+    if settings["tolerance"]:
+        stats = simplify_checked(
+            gpx, settings["tolerance"], settings["elevation_tolerance"], settings["max_metric_error"]
+        )
+    xml = gpx.to_xml(prettyprint=False)
+    stats["bytes"] = len(gpx_text.encode("utf-8"))
+    stats["output_bytes"] = len(xml.encode("utf-8"))
+    return "kept", xml, stats
+
+
+def _content_hash(gpx_text: str, settings: dict | None = None) -> str:
+    digest = hashlib.sha256(gpx_text.encode("utf-8"))
+    if settings is not None:
+        # other tolerances produce other files, an incremental run must redo the track
+        digest.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _read_manifest(manifest_path: Path) -> dict:
+    try:
+        return json.loads(manifest_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def _iter_chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _simplification_report(entries) -> None:
+    """Totals of the per-track statistics recorded in the manifest."""
+    stats = [entry["simplify"] for entry in entries if entry.get("simplify")]
+    if not stats:
+        return
+    input_bytes = sum(item["bytes"] for item in stats)
+    output_bytes = sum(item["output_bytes"] for item in stats)
+    print(f"\n*** Compact output: {input_bytes / 1e6:.1f} MB -> {output_bytes / 1e6:.1f} MB "
+          f"({input_bytes / max(output_bytes, 1):.1f}x) ***")
+    simplified = [item for item in stats if "points" in item]
+    if not simplified:
+        return
+    accepted = [item for item in simplified if item["accepted"]]
+    points = sum(item["points"] for item in simplified)
+    kept_points = sum(item["kept_points"] for item in simplified)
+    print(f"Simplified {len(accepted)} of {len(simplified)} tracks, the others exceeded the metric error; "
+          f"points {points} -> {kept_points} ({points / max(kept_points, 1):.1f}x)")
+    if accepted:
+        allowance = ", ".join(f"{field} {value:g}" for field, value in CHECKED_METRICS.items())
+        print(f"Relative metric errors; small values may exceed --max-metric-error within ({allowance})")
+        print(f"{'metric':<14} {'p50':>8} {'p95':>8} {'max':>8}")
+        for field in CHECKED_METRICS:
+            errors = np.array([item["errors"][field] for item in accepted if item["errors"][field] is not None])
+            if len(errors):
+                p50, p95, worst = np.percentile(errors, [50, 95, 100]) * 100
+                print(f"{field:<14} {p50:>7.2f}% {p95:>7.2f}% {worst:>7.2f}%")
+
+
 def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only validate rows whose GPX changed since the last run",
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=None, help="worker processes (default: number of cores)"
+    )
+    parser.add_argument(
+        "--chunk-size", type=int, default=256, help="rows handed to the pool at a time"
+    )
+    parser.add_argument(
+        "--compact", action="store_true", help="write the GPX without indentation"
+    )
+    parser.add_argument(
+        "--simplify",
+        action="store_true",
+        help="drop points a straight line reproduces within the tolerances (implies --compact)",
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=2.0, help="horizontal simplification tolerance in metres"
+    )
+    parser.add_argument(
+        "--elevation-tolerance", type=float, default=0.1, help="vertical simplification tolerance in metres"
+    )
+    parser.add_argument(
+        "--max-metric-error",
+        type=float,
+        default=0.02,
+        help="tracks whose length, uphill, downhill or moving time would change by more "
+        "than this fraction keep all their points",
+    )
+    args = parser.parse_args()
+
+    settings = None
+    if args.simplify or args.compact:
+        settings = {
+            "tolerance": args.tolerance if args.simplify else None,
+            "elevation_tolerance": args.elevation_tolerance if args.simplify else None,
+            "max_metric_error": args.max_metric_error if args.simplify else None,
+        }
+
     base_dir = Path(__file__).resolve().parent
     data_dir = base_dir / "gpx-data"
     input_path = data_dir / "hikr-raw-data" / "gpx-tracks-from-hikr.org.csv"
@@ -31,13 +164,18 @@ def main() -> None:
     metadata_dir = data_dir / "gpx-metadata"
     raw_dir = data_dir / "gpx-raw"
     metadata_path = metadata_dir / "tracks.jl"
+    # row id -> {"hash": sha256 of the GPX text and settings, "status": kept/empty/invalid,
+    #            "simplify": statistics of the compact or simplified output}
+    manifest_path = metadata_dir / "manifest.json"
 
-    if output_dir.exists():
-        shutil.rmtree(output_dir)
-    if metadata_dir.exists():
-        shutil.rmtree(metadata_dir)
-    if raw_dir.exists():
-        shutil.rmtree(raw_dir)
+    manifest = _read_manifest(manifest_path) if args.incremental else {}
+    if not args.incremental:
+        if output_dir.exists():
+            shutil.rmtree(output_dir)
+        if metadata_dir.exists():
+            shutil.rmtree(metadata_dir)
+        if raw_dir.exists():
+            shutil.rmtree(raw_dir)
 
     output_dir.mkdir(parents=True, exist_ok=True)
     metadata_dir.mkdir(parents=True, exist_ok=True)
@@ -47,41 +185,87 @@ def main() -> None:
     kept = 0
     skipped_empty = 0
     skipped_invalid = 0
+    unchanged = 0
+    new_manifest = {}
+    kept_ids = set()
+    tmp_metadata_path = metadata_path.with_suffix(".tmp")
 
-    with input_path.open("r", encoding="utf-8", newline="") as handle:
-        with metadata_path.open("w", encoding="utf-8", newline="\n") as meta_handle:
-            for index, row in enumerate(csv.DictReader(handle), start=1):
-                gpx_text = row.get("gpx")
-                if not gpx_text:
-                    continue
-
-                try:
-                    gpx = gpxpy.parse(gpx_text)
-                except Exception:
-                    skipped_invalid += 1
-                    continue
-
-                if not _has_points(gpx):
-                    skipped_empty += 1
-                    continue
-
-                file_id = _safe_id(row.get("_id", ""), index)
-                filename = f"{file_id}.gpx"
-                (output_dir / filename).write_text(
-                    gpx.to_xml(prettyprint=True), encoding="utf-8"
+    with input_path.open("r", encoding="utf-8", newline="") as handle, ProcessPoolExecutor(
+        max_workers=args.workers
+    ) as executor:
+        with tmp_metadata_path.open("w", encoding="utf-8", newline="\n") as meta_handle:
+            rows = (
+                (index, row)
+                for index, row in enumerate(csv.DictReader(handle), start=1)
+                if row.get("gpx")
+            )
+            for chunk in _iter_chunks(rows, args.chunk_size):
+                statuses = {}
+                todo = []
+                for index, row in chunk:
+                    file_id = _safe_id(row.get("_id", ""), index)
+                    content_hash = _content_hash(row["gpx"], settings)
+                    previous = manifest.get(file_id)
+                    # a duplicate id in this run must be rewritten, the last row wins
+                    if (
+                        previous
+                        and previous["hash"] == content_hash
+                        and file_id not in new_manifest
+                        and (previous["status"] != "kept" or (output_dir / f"{file_id}.gpx").exists())
+                    ):
+                        statuses[index] = (previous["status"], None, previous.get("simplify"))
+                        unchanged += 1
+                    else:
+                        todo.append((index, file_id))
+                    new_manifest[file_id] = {"hash": content_hash, "status": None}
+
+                rows_by_index = dict(chunk)
+                results = executor.map(
+                    partial(_curate, settings=settings), [rows_by_index[index]["gpx"] for index, _ in todo]
                 )
-                row_meta = {k: v for k, v in row.items() if k != "gpx"}
-                row_meta["gpx_filename"] = filename
-                meta_handle.write(json.dumps(row_meta, ensure_ascii=True) + "\n")
-                kept += 1
+                for (index, _), result in zip(todo, results):
+                    statuses[index] = result
+
+                # write in CSV order, independent of worker scheduling
+                for index, row in chunk:
+                    file_id = _safe_id(row.get("_id", ""), index)
+                    status, xml, stats = statuses[index]
+                    new_manifest[file_id]["status"] = status
+                    if stats:
+                        new_manifest[file_id]["simplify"] = stats
+                    if status == "invalid":
+                        skipped_invalid += 1
+                        continue
+                    if status == "empty":
+                        skipped_empty += 1
+                        continue
+
+                    filename = f"{file_id}.gpx"
+                    if xml is not None:
+                        (output_dir / filename).write_text(xml, encoding="utf-8")
+                    kept_ids.add(file_id)
+                    row_meta = {k: v for k, v in row.items() if k != "gpx"}
+                    row_meta["gpx_filename"] = filename
+                    meta_handle.write(json.dumps(row_meta, ensure_ascii=True) + "\n")
+                    kept += 1
+
+                    if kept % 1000 == 0:
+                        print(f"{kept} tracks processed...")
+
+    # tracks that left the raw dump must not survive an incremental run
+    for file_id, entry in manifest.items():
+        if entry["status"] == "kept" and file_id not in kept_ids:
+            (output_dir / f"{file_id}.gpx").unlink(missing_ok=True)
 
-                if kept % 1000 == 0:
-                    print(f"{kept} tracks processed...")
+    tmp_metadata_path.replace(metadata_path)
+    manifest_path.write_text(json.dumps(new_manifest), encoding="utf-8")
 
     print(
         f"Wrote {kept} GPX files to {output_dir}. "
-        f"Skipped empty: {skipped_empty}, invalid: {skipped_invalid}."
+        f"Skipped empty: {skipped_empty}, invalid: {skipped_invalid}. "
+        f"Unchanged: {unchanged}."
     )
+    _simplification_report(new_manifest.values())
 
 
 if __name__ == "__main__":
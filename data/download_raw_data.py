@@ -1,37 +1,28 @@
-"""Download latest hikr.org raw data container to the local workspace."""
+"""Download latest hikr.org raw data container to the local workspace.
+
+Only blobs that differ from the local copy are fetched, see raw_sync.py;
+an interrupted download continues where it stopped on the next run.
+Local files that are not in the container are kept unless ``--delete``
+is given. ``--latest-container`` only prints the name of the container a
+download would fetch, the CI workflow keys its cache of RAW_DIR on it.
+"""
 
 from __future__ import annotations
 
+import argparse
 import os
-import shutil
 from pathlib import Path
 
 from azure.storage.blob import BlobServiceClient
 from dotenv import load_dotenv
 
+from raw_sync import CHUNK_SIZE, MAX_WORKERS, download, latest_complete_container
+
 RAW_DIR = Path(__file__).resolve().parent / "gpx-data" / "hikr-raw-data"
 RAW_CONTAINER_PREFIX = "hikeplanner-raw-data"
 
 
-def _latest_container(blob_service_client: BlobServiceClient) -> str:
-    prefix = f"{RAW_CONTAINER_PREFIX}-"
-    suffix = -1
-    latest = None
-    for container in blob_service_client.list_containers():
-        name = container["name"]
-        if name.startswith(prefix):
-            rest = name[len(prefix) :]
-            if rest.isdigit():
-                current = int(rest)
-                if current > suffix:
-                    suffix = current
-                    latest = name
-    if not latest:
-        raise SystemExit("No raw data containers found in storage account.")
-    return latest
-
-
-def download_raw_data() -> None:
+def _storage_client() -> BlobServiceClient:
     env_path = Path(__file__).resolve().parent.parent / ".env"
     load_dotenv(env_path, override=True)
     conn_str = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
@@ -40,22 +31,24 @@ def download_raw_data() -> None:
             "Missing AZURE_STORAGE_CONNECTION_STRING in .env or environment."
         )
 
-    blob_service_client = BlobServiceClient.from_connection_string(conn_str)
-    container_name = _latest_container(blob_service_client)
-    container_client = blob_service_client.get_container_client(container_name)
-    blobs = list(container_client.list_blobs())
-    if RAW_DIR.exists():
-        shutil.rmtree(RAW_DIR)
-    RAW_DIR.mkdir(parents=True, exist_ok=True)
-    print(f"Downloading raw data from {container_name} into {RAW_DIR}")
-    for blob in blobs:
-        download_path = RAW_DIR / blob.name
-        download_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(download_path, "wb") as handle:
-            handle.write(container_client.download_blob(blob).readall())
-        print(f"Downloaded {blob.name}")
-    print(f"Finished downloading {len(blobs)} files from {container_name}")
+    return BlobServiceClient.from_connection_string(conn_str)
+
+
+def download_raw_data(workers: int = MAX_WORKERS, chunk_size: int = CHUNK_SIZE, delete: bool = False) -> None:
+    download(_storage_client(), RAW_DIR, RAW_CONTAINER_PREFIX, workers=workers, chunk_size=chunk_size, delete=delete)
 
 
 if __name__ == "__main__":
-    download_raw_data()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="concurrent range downloads")
+    parser.add_argument("--chunk-size-mb", type=int, default=CHUNK_SIZE // (1024 * 1024), help="range size of large blobs")
+    parser.add_argument("--delete", action="store_true", help="remove local files that are not in the container")
+    parser.add_argument("--latest-container", action="store_true", help="print the name of the container to download and exit")
+    args = parser.parse_args()
+    if args.latest_container:
+        name = latest_complete_container(_storage_client(), RAW_CONTAINER_PREFIX)
+        if name is None:
+            raise SystemExit(f"No complete {RAW_CONTAINER_PREFIX} container.")
+        print(name)
+    else:
+        download_raw_data(args.workers, args.chunk_size_mb * 1024 * 1024, args.delete)
@@ -0,0 +1,114 @@
+"""Append-only columnar store for the per-track training features.
+
+Every column is a raw little-endian binary file next to a ``schema.json``
+that records the dtype of each column and the number of committed rows.
+Appends write all columns first and then replace the schema atomically, so
+a crash mid-append never exposes a partial row. Readers map the files with
+``numpy.memmap`` and get zero-copy column arrays.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+SCHEMA_NAME = "schema.json"
+
+# column name -> dtype; everything train_model.py reads from a track document
+COLUMNS = {
+    "min_elevation": "<f8",
+    "max_elevation": "<f8",
+    "uphill": "<f8",
+    "downhill": "<f8",
+    "max_speed": "<f8",
+    "length_2d": "<f8",
+    "length_3d": "<f8",
+    "moving_time": "<f8",
+    "difficulty_num": "<i4",
+    "ingested_at": "<f8",
+    "track_key": "<u8",
+}
+MISSING_DIFFICULTY = -1
+
+
+def track_key(track_id):
+    """Stable 64-bit key of a track ``_id``; train_model.py derives the fixed holdout from it."""
+    digest = hashlib.blake2b(str(track_id).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def difficulty_num(difficulty):
+    """Numeric part of a hikr difficulty like ``"T3"``, ``MISSING_DIFFICULTY`` if unknown."""
+    try:
+        return int(difficulty[1])
+    except (TypeError, IndexError, ValueError):
+        return MISSING_DIFFICULTY
+
+
+def _column_path(path, column):
+    return Path(path, f"{column}.bin")
+
+
+def read_schema(path):
+    with open(Path(path, SCHEMA_NAME), encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+def _write_schema(path, schema):
+    schema_path = Path(path, SCHEMA_NAME)
+    tmp_path = schema_path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as handle:
+        json.dump(schema, handle, indent=2)
+    os.replace(tmp_path, schema_path)
+
+
+class FeatureStoreWriter:
+    """Appends batches of track documents to the store at ``path``."""
+
+    def __init__(self, path, reset=False):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        if reset or not Path(self.path, SCHEMA_NAME).exists():
+            for column in COLUMNS:
+                _column_path(self.path, column).write_bytes(b"")
+            _write_schema(self.path, {"rows": 0, "columns": COLUMNS})
+        self.schema = read_schema(self.path)
+        if self.schema["columns"] != COLUMNS:
+            raise SystemExit(f"Feature store {self.path} has a different schema, rebuild it with a full import.")
+        # drop bytes of an append that never committed its schema
+        for column, dtype in COLUMNS.items():
+            with open(_column_path(self.path, column), "r+b") as handle:
+                handle.truncate(self.schema["rows"] * np.dtype(dtype).itemsize)
+
+    def append(self, documents):
+        if not documents:
+            return
+        for column, dtype in COLUMNS.items():
+            if column == "difficulty_num":
+                values = [difficulty_num(document.get("difficulty")) for document in documents]
+            elif column == "track_key":
+                values = [track_key(document.get("_id")) for document in documents]
+            else:
+                values = [np.nan if document.get(column) is None else document[column] for document in documents]
+            with open(_column_path(self.path, column), "ab") as handle:
+                handle.write(np.asarray(values, dtype=dtype).tobytes())
+        self.schema["rows"] += len(documents)
+        _write_schema(self.path, self.schema)
+
+
+def load_features(path, columns=None):
+    """Return ``{column: read-only memmap}`` for the committed rows of the store."""
+    schema = read_schema(path)
+    rows = schema["rows"]
+    features = {}
+    for column in columns or schema["columns"]:
+        dtype = np.dtype(schema["columns"][column])
+        if rows == 0:
+            features[column] = np.empty(0, dtype=dtype)
+        else:
+            features[column] = np.memmap(_column_path(path, column), dtype=dtype, mode="r", shape=(rows,))
+    return features
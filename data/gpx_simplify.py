@@ -0,0 +1,154 @@
+"""Douglas-Peucker simplification of GPX tracks for the curation step.
+
+Hikr tracks are mostly recorded with one point per second, thousands of
+points whose neighbours differ by less than the GPS noise. ``simplify_gpx``
+drops the points that a straight line between the kept ones reproduces
+within the tolerances:
+
+* horizontally, a point is measured against the position interpolated
+  along the chord by its timestamp (the synchronized distance), not the
+  perpendicular distance, so that stops and speed changes survive and the
+  moving time keeps its meaning; points without times fall back to the
+  perpendicular distance to the chord;
+* vertically, against the elevation interpolated the same way, so that
+  climbs and descents are kept even where the path is straight.
+
+The implementation is level-synchronous: every round evaluates all open
+chords of a segment with one set of array operations and splits each at
+its worst point, instead of recursing chord by chord in Python.
+
+``metric_errors`` compares the track metrics before and after; curation
+keeps the original points of a track whose metrics move by more than
+the accepted error.
+"""
+
+from __future__ import annotations
+
+import math
+
+import numpy as np
+
+from track_metrics import ONE_DEGREE, compute_metrics, segment_arrays
+
+# metrics checked after simplification, with the absolute deviation always
+# accepted (metres, seconds) so that tiny values do not fail on relative error
+CHECKED_METRICS = {
+    "length_2d": 10.0,
+    "length_3d": 10.0,
+    "uphill": 5.0,
+    "downhill": 5.0,
+    "max_elevation": 5.0,
+    "moving_time": 30.0,
+}
+
+
+def keep_mask(lat, lon, ele, seconds, tolerance, elevation_tolerance):
+    """Boolean mask of the points of one segment that are kept; the end points always are."""
+    count = len(lat)
+    keep = np.ones(count, dtype=bool)
+    if count < 3:
+        return keep
+    keep[1:-1] = False
+    # local equirectangular projection in metres, ample for a hike
+    x = lon * math.cos(math.radians(float(np.mean(lat)))) * ONE_DEGREE
+    y = lat * ONE_DEGREE
+    timed = not np.isnan(seconds).any() and (np.diff(seconds) >= 0).all()
+
+    starts = np.array([0])
+    ends = np.array([count - 1])
+    while len(starts):
+        inner = ends - starts - 1
+        open_chords = inner > 0
+        starts, ends, inner = starts[open_chords], ends[open_chords], inner[open_chords]
+        if not len(starts):
+            break
+        chord = np.repeat(np.arange(len(starts)), inner)
+        offsets = np.cumsum(inner) - inner
+        index = np.arange(int(inner.sum())) - offsets[chord] + starts[chord] + 1
+        a, b = starts[chord], ends[chord]
+
+        dx, dy = x[b] - x[a], y[b] - y[a]
+        if timed:
+            span = seconds[b] - seconds[a]
+            fraction = np.divide(seconds[index] - seconds[a], span, out=np.zeros(len(index)), where=span > 0)
+        else:
+            squared = dx * dx + dy * dy
+            projection = (x[index] - x[a]) * dx + (y[index] - y[a]) * dy
+            fraction = np.clip(np.divide(projection, squared, out=np.zeros(len(index)), where=squared > 0), 0, 1)
+        horizontal = np.hypot(x[index] - x[a] - fraction * dx, y[index] - y[a] - fraction * dy) / tolerance
+        vertical = np.abs(ele[index] - ele[a] - fraction * (ele[b] - ele[a])) / elevation_tolerance
+        # missing elevations do not force a point to be kept
+        score = np.maximum(horizontal, np.nan_to_num(vertical))
+
+        worst = np.maximum.reduceat(score, offsets)
+        candidates = np.flatnonzero(score == worst[chord])
+        _, first = np.unique(chord[candidates], return_index=True)
+        split = worst > 1
+        far = index[candidates[first]][split]
+        keep[far] = True
+        starts = np.concatenate([starts[split], far])
+        ends = np.concatenate([far, ends[split]])
+    return keep
+
+
+def simplify_gpx(gpx, tolerance, elevation_tolerance):
+    """Simplify the tracks and routes of ``gpx`` in place.
+
+    Returns ``(points before, points after, undo)``; ``restore(undo)``
+    puts the original points back.
+    """
+    undo = []
+    before = after = 0
+    owners = [segment for track in gpx.tracks for segment in track.segments] + list(gpx.routes)
+    for owner in owners:
+        points = owner.points
+        before += len(points)
+        if len(points) < 3:
+            after += len(points)
+            continue
+        lat, lon, ele, seconds = segment_arrays(owner)
+        mask = keep_mask(lat, lon, ele, seconds, tolerance, elevation_tolerance)
+        undo.append((owner, points))
+        owner.points = [point for point, kept in zip(points, mask.tolist()) if kept]
+        after += len(owner.points)
+    return before, after, undo
+
+
+def restore(undo):
+    for owner, points in undo:
+        owner.points = points
+
+
+def metric_errors(original, simplified):
+    """Relative deviation of each checked metric after simplification."""
+    errors = {}
+    for field in CHECKED_METRICS:
+        reference = original[field] or 0.0
+        deviation = abs((simplified[field] or 0.0) - reference)
+        # None where the original is 0 and a relative error is undefined
+        errors[field] = deviation / abs(reference) if reference else (0.0 if deviation == 0 else None)
+    return errors
+
+
+def within(original, simplified, max_error):
+    """True if every checked metric is within ``max_error`` relative or its absolute allowance."""
+    return all(
+        math.isclose(simplified[field] or 0.0, original[field] or 0.0, rel_tol=max_error, abs_tol=allowance)
+        for field, allowance in CHECKED_METRICS.items()
+    )
+
+
+def simplify_checked(gpx, tolerance, elevation_tolerance, max_error):
+    """Simplify ``gpx`` unless that moves its metrics by more than ``max_error``; returns the statistics."""
+    original = compute_metrics(gpx)
+    before, after, undo = simplify_gpx(gpx, tolerance, elevation_tolerance)
+    simplified = compute_metrics(gpx)
+    accepted = within(original, simplified, max_error)
+    if not accepted:
+        restore(undo)
+    return {
+        "points": before,
+        "kept_points": after if accepted else before,
+        "errors": metric_errors(original, simplified),
+        "accepted": accepted,
+    }
@@ -0,0 +1,507 @@
+"""Incremental, concurrent and resumable sync of the raw data with Azure Blob Storage.
+
+The raw dump lives in versioned ``hikeplanner-raw-data-N`` containers. A
+manifest next to the local files (``.sync-manifest.json``) records the size,
+modification time and MD5 of every file and the container it was last
+synced with, so unchanged files are neither hashed again nor transferred.
+
+* ``upload`` compares the local files with the latest complete container.
+  If nothing changed it does nothing. Otherwise it creates the next
+  container, copies unchanged blobs server-side and uploads only the changed
+  files, large ones as blocks staged in parallel. Block IDs are derived
+  from the file's MD5, so a rerun after an interruption finds the already
+  staged blocks and only sends the missing ones. The container is marked
+  complete at the end; until then downloads ignore it and the next upload
+  resumes into it.
+* ``download`` fetches only the blobs that differ from the local copy.
+  Large blobs are fetched as parallel byte ranges written straight into a
+  ``.part`` file, with the finished ranges recorded next to it, so a rerun
+  continues where it stopped. Files are verified against the blob MD5 and
+  moved into place atomically. Local files that are not in the container
+  are kept and reported; with ``delete=True`` (``--delete``) they are
+  removed, making the folder an exact copy of the container.
+
+Memory use is bounded by one chunk per worker, whatever the file size.
+
+Test against the Azurite storage emulator instead of a real account:
+
+    docker run -p 10000:10000 mcr.microsoft.com/azure-storage/azurite azurite-blob --blobHost 0.0.0.0
+    AZURE_STORAGE_CONNECTION_STRING="UseDevelopmentStorage=true" python raw_sync.py --check
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+MANIFEST_NAME = ".sync-manifest.json"
+PART_SUFFIX = ".part"
+STATE_SUFFIX = ".part.json"
+CHUNK_SIZE = 8 * 1024 * 1024
+MAX_WORKERS = 8
+HASH_CHUNK_SIZE = 1024 * 1024
+COPY_POLL_INTERVAL = 0.5
+# container metadata key; containers without it were uploaded before this module and count as complete
+STATE_KEY = "sync_state"
+
+
+def file_md5(path: Path) -> str:
+    digest = hashlib.md5()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_manifest(root: Path) -> dict:
+    try:
+        with open(root / MANIFEST_NAME, encoding="utf-8") as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return {"container": None, "files": {}}
+
+
+def _write_manifest(root: Path, manifest: dict) -> None:
+    path = root / MANIFEST_NAME
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as handle:
+        json.dump(manifest, handle, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _is_sync_file(name: str) -> bool:
+    return name.startswith(MANIFEST_NAME) or name.endswith((PART_SUFFIX, STATE_SUFFIX))
+
+
+def local_inventory(root: Path, manifest: dict) -> dict:
+    """``{name: {size, mtime_ns, md5, etag}}`` of the files below ``root``.
+
+    The MD5 recorded in the manifest is reused while size and modification
+    time are unchanged.
+    """
+    known = manifest["files"]
+    files = {}
+    for path in sorted(root.rglob("*")):
+        name = path.relative_to(root).as_posix()
+        if not path.is_file() or _is_sync_file(path.name):
+            continue
+        stat = path.stat()
+        entry = known.get(name)
+        if entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            files[name] = dict(entry)
+        else:
+            files[name] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "md5": file_md5(path), "etag": None}
+    return files
+
+
+def _blob_md5(blob) -> str | None:
+    content_md5 = blob.content_settings.content_md5 if blob.content_settings else None
+    return bytes(content_md5).hex() if content_md5 else None
+
+
+def remote_inventory(container_client) -> dict:
+    """``{name: {size, md5, etag}}`` of the blobs in a container; ``md5`` is None if the service has none."""
+    return {
+        blob.name: {"size": blob.size, "md5": _blob_md5(blob), "etag": blob.etag}
+        for blob in container_client.list_blobs()
+    }
+
+
+def _versioned_containers(blob_service_client, prefix: str) -> list:
+    """``(suffix, name, complete)`` of the ``{prefix}-N`` containers, in ascending order."""
+    containers = []
+    for container in blob_service_client.list_containers(name_starts_with=f"{prefix}-", include_metadata=True):
+        suffix = container.name[len(prefix) + 1 :]
+        if suffix.isdigit():
+            complete = (container.metadata or {}).get(STATE_KEY, "complete") == "complete"
+            containers.append((int(suffix), container.name, complete))
+    return sorted(containers)
+
+
+def latest_complete_container(blob_service_client, prefix: str) -> str | None:
+    complete = [name for _, name, is_complete in _versioned_containers(blob_service_client, prefix) if is_complete]
+    return complete[-1] if complete else None
+
+
+def _same_content(local: dict, remote: dict) -> bool:
+    if local["size"] != remote["size"]:
+        return False
+    if remote["md5"] is not None:
+        return local["md5"] == remote["md5"]
+    # blobs uploaded in blocks by other tools carry no MD5, fall back to the ETag we downloaded
+    return local.get("etag") is not None and local["etag"] == remote["etag"]
+
+
+def _chunks(size: int, chunk_size: int) -> list:
+    return [(offset, min(chunk_size, size - offset)) for offset in range(0, size, chunk_size)]
+
+
+def _block_id(md5: str, chunk_size: int, index: int) -> str:
+    # same content and chunking give the same IDs, so staged blocks survive an interruption
+    return f"{md5}-{chunk_size:010d}-{index:06d}"
+
+
+def _stage_block(blob_client, path: Path, block_id: str, offset: int, length: int) -> int:
+    with open(path, "rb") as handle:
+        handle.seek(offset)
+        data = handle.read(length)
+    blob_client.stage_block(block_id, data, length=length, validate_content=True)
+    return length
+
+
+def _upload_small(blob_client, path: Path, content_settings) -> int:
+    with open(path, "rb") as handle:
+        blob_client.upload_blob(handle, overwrite=True, content_settings=content_settings)
+    return path.stat().st_size
+
+
+def _copy_blob(blob_client, source_url: str) -> int:
+    """Server-side copy of an unchanged blob from the previous container."""
+    blob_client.start_copy_from_url(source_url)
+    while True:
+        properties = blob_client.get_blob_properties()
+        if properties.copy.status != "pending":
+            break
+        time.sleep(COPY_POLL_INTERVAL)
+    if properties.copy.status != "success":
+        raise IOError(f"copying {blob_client.blob_name} failed: {properties.copy.status_description}")
+    return 0
+
+
+def _staged_blocks(blob_client) -> set:
+    from azure.core.exceptions import ResourceNotFoundError
+
+    try:
+        _, uncommitted = blob_client.get_block_list("uncommitted")
+    except ResourceNotFoundError:
+        return set()
+    return {block.id for block in uncommitted}
+
+
+def upload(
+    blob_service_client,
+    root: Path,
+    prefix: str,
+    workers: int = MAX_WORKERS,
+    chunk_size: int = CHUNK_SIZE,
+) -> dict:
+    """Publish ``root`` as the next ``{prefix}-N`` container unless the latest one already matches."""
+    from azure.core.exceptions import ResourceExistsError
+    from azure.storage.blob import BlobBlock, ContentSettings
+
+    root = Path(root)
+    manifest = read_manifest(root)
+    local = local_inventory(root, manifest)
+    containers = _versioned_containers(blob_service_client, prefix)
+    complete = [name for _, name, is_complete in containers if is_complete]
+    latest = complete[-1] if complete else None
+    remote = remote_inventory(blob_service_client.get_container_client(latest)) if latest else {}
+    stats = {"container": latest, "uploaded": 0, "copied": 0, "skipped": 0, "bytes": 0}
+
+    if latest is not None and remote.keys() == local.keys() and all(
+        _same_content(entry, remote[name]) for name, entry in local.items()
+    ):
+        print(f"Raw data unchanged, {latest} is up to date")
+        stats["skipped"] = len(local)
+        _write_manifest(root, {"container": latest, "files": local})
+        return stats
+
+    # resume an interrupted upload instead of starting another container
+    if containers and not containers[-1][2]:
+        container_name = containers[-1][1]
+        print(f"Resuming upload into {container_name}")
+    else:
+        container_name = f"{prefix}-{containers[-1][0] + 1 if containers else 1}"
+        print(f"Creating container {container_name} for this upload")
+    container_client = blob_service_client.get_container_client(container_name)
+    try:
+        container_client.create_container(metadata={STATE_KEY: "incomplete"})
+    except ResourceExistsError:
+        pass
+    target = remote_inventory(container_client)
+    source_client = blob_service_client.get_container_client(latest) if latest else None
+
+    commits = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for name, entry in local.items():
+            blob_client = container_client.get_blob_client(name)
+            if name in target and _same_content(entry, target[name]):
+                stats["skipped"] += 1
+            elif name in remote and _same_content(entry, remote[name]):
+                futures[pool.submit(_copy_blob, blob_client, source_client.get_blob_client(name).url)] = (name, "copied")
+            else:
+                path = root / name
+                content_settings = ContentSettings(content_md5=bytearray.fromhex(entry["md5"]))
+                if entry["size"] <= chunk_size:
+                    futures[pool.submit(_upload_small, blob_client, path, content_settings)] = (name, "uploaded")
+                    continue
+                staged = _staged_blocks(blob_client)
+                block_ids = []
+                for index, (offset, length) in enumerate(_chunks(entry["size"], chunk_size)):
+                    block_id = _block_id(entry["md5"], chunk_size, index)
+                    block_ids.append(block_id)
+                    if block_id not in staged:
+                        futures[pool.submit(_stage_block, blob_client, path, block_id, offset, length)] = (name, "block")
+                commits[name] = (blob_client, block_ids, content_settings)
+
+        failures = []
+        for future in as_completed(futures):
+            name, kind = futures[future]
+            try:
+                stats["bytes"] += future.result()
+            except Exception as ex:
+                # keep going: every block staged now is one less to send on the rerun
+                failures.append(ex)
+                continue
+            if kind != "block":
+                stats[kind] += 1
+                print(f"{kind.capitalize()} {name}")
+
+    if failures:
+        raise failures[0]
+    for name, (blob_client, block_ids, content_settings) in commits.items():
+        blob_client.commit_block_list([BlobBlock(block_id=block_id) for block_id in block_ids], content_settings=content_settings)
+        stats["uploaded"] += 1
+        print(f"Uploaded {name} in {len(block_ids)} blocks")
+
+    # blobs of files deleted locally since an interrupted run
+    for name in target.keys() - local.keys():
+        container_client.delete_blob(name)
+    container_client.set_container_metadata({STATE_KEY: "complete"})
+    _write_manifest(root, {"container": container_name, "files": local})
+    stats["container"] = container_name
+    print(
+        f"Uploaded {stats['uploaded']} files ({stats['bytes'] / 1024 / 1024:.1f} MB), "
+        f"copied {stats['copied']} unchanged ones into {container_name}"
+    )
+    return stats
+
+
+def _fetch_range(container_client, name: str, fd: int, offset: int, length: int, etag: str) -> int:
+    from azure.core import MatchConditions
+
+    stream = container_client.download_blob(
+        name, offset=offset, length=length, etag=etag, match_condition=MatchConditions.IfNotModified
+    )
+    position = offset
+    for chunk in stream.chunks():
+        os.pwrite(fd, chunk, position)
+        position += len(chunk)
+    return position - offset
+
+
+class _Download:
+    """One blob being fetched into ``<file>.part``, with its finished ranges in ``<file>.part.json``."""
+
+    def __init__(self, root: Path, name: str, blob: dict, chunk_size: int):
+        self.name = name
+        self.blob = blob
+        self.path = root / name
+        self.part_path = self.path.with_name(self.path.name + PART_SUFFIX)
+        self.state_path = self.path.with_name(self.path.name + STATE_SUFFIX)
+        self.chunk_size = chunk_size
+        self.chunks = _chunks(blob["size"], chunk_size)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.done = self._resume_state()
+        if not self.done:
+            with open(self.part_path, "wb") as handle:
+                handle.truncate(blob["size"])
+        self.fd = os.open(self.part_path, os.O_RDWR)
+
+    def _resume_state(self) -> set:
+        try:
+            with open(self.state_path, encoding="utf-8") as handle:
+                state = json.load(handle)
+        except (OSError, ValueError):
+            return set()
+        same_blob = state.get("etag") == self.blob["etag"] and state.get("chunk_size") == self.chunk_size
+        if same_blob and self.part_path.is_file() and self.part_path.stat().st_size == self.blob["size"]:
+            return set(state["done"])
+        return set()
+
+    @property
+    def pending(self) -> list:
+        return [(index, offset, length) for index, (offset, length) in enumerate(self.chunks) if index not in self.done]
+
+    def mark_done(self, index: int) -> None:
+        self.done.add(index)
+        tmp_path = self.state_path.with_name(self.state_path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump({"etag": self.blob["etag"], "chunk_size": self.chunk_size, "done": sorted(self.done)}, handle)
+        os.replace(tmp_path, self.state_path)
+
+    def finish(self) -> dict:
+        os.fsync(self.fd)
+        os.close(self.fd)
+        md5 = file_md5(self.part_path)
+        if self.blob["md5"] is not None and md5 != self.blob["md5"]:
+            # a corrupted range cannot be located, start this file over on the next run
+            self.state_path.unlink(missing_ok=True)
+            raise IOError(f"checksum mismatch for {self.name}: expected {self.blob['md5']}, got {md5}")
+        os.replace(self.part_path, self.path)
+        self.state_path.unlink(missing_ok=True)
+        stat = self.path.stat()
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "md5": md5, "etag": self.blob["etag"]}
+
+
+def download(
+    blob_service_client,
+    root: Path,
+    prefix: str,
+    workers: int = MAX_WORKERS,
+    chunk_size: int = CHUNK_SIZE,
+    delete: bool = False,
+) -> dict:
+    """Bring ``root`` up to date with the latest complete ``{prefix}-N`` container.
+
+    Local files that are not in the container are only removed with ``delete``.
+    """
+    root = Path(root)
+    container_name = latest_complete_container(blob_service_client, prefix)
+    if container_name is None:
+        raise SystemExit("No raw data containers found in storage account.")
+    container_client = blob_service_client.get_container_client(container_name)
+    remote = remote_inventory(container_client)
+    root.mkdir(parents=True, exist_ok=True)
+    manifest = read_manifest(root)
+    local = local_inventory(root, manifest)
+    stats = {"container": container_name, "downloaded": 0, "skipped": 0, "deleted": 0, "kept": 0, "bytes": 0}
+
+    files = {}
+    for name in sorted(local.keys() - remote.keys()):
+        if delete:
+            (root / name).unlink()
+            stats["deleted"] += 1
+            print(f"Deleted {name}")
+        else:
+            # not ours to remove, but remember the hash so the next run does not read it again
+            files[name] = dict(local[name], etag=None)
+            stats["kept"] += 1
+    if stats["kept"]:
+        print(f"Keeping {stats['kept']} local files that are not in {container_name}, use --delete to remove them")
+    downloads = []
+    for name, blob in remote.items():
+        if name in local and _same_content(local[name], blob):
+            files[name] = dict(local[name], etag=blob["etag"])
+            stats["skipped"] += 1
+        else:
+            downloads.append(_Download(root, name, blob, chunk_size))
+    print(f"Syncing {len(downloads)} of {len(remote)} files from {container_name} into {root}")
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {}
+            for transfer in downloads:
+                for index, offset, length in transfer.pending:
+                    future = pool.submit(_fetch_range, container_client, transfer.name, transfer.fd, offset, length, transfer.blob["etag"])
+                    futures[future] = (transfer, index)
+            failures = []
+            for future in as_completed(futures):
+                transfer, index = futures[future]
+                try:
+                    stats["bytes"] += future.result()
+                except Exception as ex:
+                    # record the other finished ranges before giving up
+                    failures.append(ex)
+                    continue
+                transfer.mark_done(index)
+                if len(transfer.done) == len(transfer.chunks):
+                    files[transfer.name] = transfer.finish()
+                    stats["downloaded"] += 1
+                    print(f"Downloaded {transfer.name}")
+            # empty blobs have no ranges to fetch
+            for transfer in downloads:
+                if not transfer.chunks:
+                    files[transfer.name] = transfer.finish()
+                    stats["downloaded"] += 1
+                    print(f"Downloaded {transfer.name}")
+        if failures:
+            raise failures[0]
+    finally:
+        # keep what is finished even if another file failed
+        for transfer in downloads:
+            if transfer.name not in files:
+                try:
+                    os.close(transfer.fd)
+                except OSError:
+                    pass
+        _write_manifest(root, {"container": container_name, "files": files})
+
+    print(
+        f"Downloaded {stats['downloaded']} files ({stats['bytes'] / 1024 / 1024:.1f} MB), "
+        f"{stats['skipped']} unchanged, {stats['deleted']} deleted, {stats['kept']} kept"
+    )
+    return stats
+
+
+def _tree_contents(root: Path) -> dict:
+    return {
+        path.relative_to(root).as_posix(): path.read_bytes()
+        for path in root.rglob("*")
+        if path.is_file() and not _is_sync_file(path.name)
+    }
+
+
+def check(blob_service_client, chunk_size: int = 256 * 1024) -> None:
+    """Round trip through scratch containers: upload, no-op upload, download, change, resync."""
+    prefix = f"hikeplanner-synccheck-{uuid.uuid4().hex[:8]}"
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as source, tempfile.TemporaryDirectory() as target:
+        source, target = Path(source), Path(target)
+        (source / "nested").mkdir()
+        (source / "small.txt").write_text("hikr\n")
+        (source / "empty.csv").write_bytes(b"")
+        (source / "nested" / "large.csv").write_bytes(rng.randbytes(3 * chunk_size + 12345))
+        try:
+            first = upload(blob_service_client, source, prefix, chunk_size=chunk_size)
+            assert first["uploaded"] == 3, first
+            again = upload(blob_service_client, source, prefix, chunk_size=chunk_size)
+            assert again["container"] == first["container"] and again["uploaded"] == 0, again
+
+            fetched = download(blob_service_client, target, prefix, chunk_size=chunk_size)
+            assert fetched["downloaded"] == 3 and _tree_contents(target) == _tree_contents(source), fetched
+            assert download(blob_service_client, target, prefix, chunk_size=chunk_size)["downloaded"] == 0
+
+            (source / "small.txt").write_text("hikr, changed\n")
+            (source / "empty.csv").unlink()
+            second = upload(blob_service_client, source, prefix, chunk_size=chunk_size)
+            assert second["container"] != first["container"] and second["uploaded"] == 1 and second["copied"] == 1, second
+            fetched = download(blob_service_client, target, prefix, chunk_size=chunk_size)
+            assert fetched["downloaded"] == 1 and fetched["deleted"] == 0 and fetched["kept"] == 1, fetched
+            fetched = download(blob_service_client, target, prefix, chunk_size=chunk_size, delete=True)
+            assert fetched["downloaded"] == 0 and fetched["deleted"] == 1, fetched
+            assert _tree_contents(target) == _tree_contents(source)
+        finally:
+            for _, name, _ in _versioned_containers(blob_service_client, prefix):
+                blob_service_client.delete_container(name)
+    print("raw data sync check passed")
+
+
+def main():
+    from azure.storage.blob import BlobServiceClient
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Check the raw data sync against a storage account or emulator.")
+    parser.add_argument("--check", action="store_true", help="round trip through scratch containers")
+    args = parser.parse_args()
+    load_dotenv(Path(__file__).resolve().parent.parent / ".env", override=True)
+    conn_str = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
+    if not conn_str:
+        raise SystemExit("Missing AZURE_STORAGE_CONNECTION_STRING in .env or environment.")
+    if args.check:
+        check(BlobServiceClient.from_connection_string(conn_str))
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
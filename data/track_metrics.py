@@ -0,0 +1,190 @@
+"""Vectorized GPX track metrics for the MongoDB import.
+
+Every segment's points are copied into NumPy arrays in a single pass over
+the parsed gpxpy object; all document fields are then derived from those
+arrays instead of walking the points once per gpxpy helper. The formulas
+mirror gpxpy (distance approximation with haversine fallback, smoothed
+uphill/downhill, moving time with the 1 km/h stop threshold, max speed
+without outliers). Results agree with gpxpy up to floating point summation
+order; ``compare_with_gpxpy`` checks this against ``TOLERANCE``.
+"""
+
+from __future__ import annotations
+
+import math
+
+import numpy as np
+
+# same constants as gpxpy.geo / gpxpy.gpx
+EARTH_RADIUS = 6378.137 * 1000
+ONE_DEGREE = (2 * math.pi * EARTH_RADIUS) / 360
+STOPPED_SPEED_THRESHOLD = 1  # km/h
+IGNORE_TOP_SPEED_PERCENTILES = 0.05
+
+# relative deviation from gpxpy that is accepted for float fields
+TOLERANCE = 1e-6
+
+METRIC_FIELDS = [
+    "min_elevation",
+    "max_elevation",
+    "uphill",
+    "downhill",
+    "max_speed",
+    "length_2d",
+    "length_3d",
+    "moving_time",
+]
+
+
+def segment_arrays(segment):
+    """Return latitude, longitude, elevation and time arrays (NaN when missing) of one segment."""
+    points = segment.points
+    first_time = next((point.time for point in points if point.time is not None), None)
+    rows = [
+        (
+            point.latitude,
+            point.longitude,
+            np.nan if point.elevation is None else point.elevation,
+            np.nan if point.time is None else (point.time - first_time).total_seconds(),
+        )
+        for point in points
+    ]
+    data = np.array(rows, dtype=np.float64).reshape(-1, 4)
+    return data[:, 0], data[:, 1], data[:, 2], data[:, 3]
+
+
+def _distances(lat, lon, ele, use_elevation):
+    """Distance from each point to its successor, as ``gpxpy.geo.distance`` computes it."""
+    lat1, lat2 = lat[1:], lat[:-1]
+    lon1, lon2 = lon[1:], lon[:-1]
+    coef = np.cos(np.radians(lat1))
+    x = lat1 - lat2
+    y = (lon1 - lon2) * coef
+    distance_2d = np.sqrt(x * x + y * y) * ONE_DEGREE
+
+    far = (np.abs(lat1 - lat2) > .2) | (np.abs(lon1 - lon2) > .2)
+    if far.any():
+        d_lon = np.radians(lon1[far] - lon2[far])
+        r_lat1 = np.radians(lat1[far])
+        r_lat2 = np.radians(lat2[far])
+        a = np.sin((r_lat1 - r_lat2) / 2) ** 2 + np.sin(d_lon / 2) ** 2 * np.cos(r_lat1) * np.cos(r_lat2)
+        distance_2d[far] = EARTH_RADIUS * 2 * np.arcsin(np.sqrt(a))
+
+    d_ele = ele[1:] - ele[:-1]
+    with_ele = use_elevation & ~far & ~np.isnan(d_ele) & (d_ele != 0)
+    distance_3d = np.where(with_ele, np.sqrt(distance_2d ** 2 + np.nan_to_num(d_ele) ** 2), distance_2d)
+    return distance_2d, distance_3d
+
+
+def _uphill_downhill(ele):
+    elevations = ele[~np.isnan(ele)]
+    if len(elevations) < 2:
+        return 0.0, 0.0
+    smoothed = elevations.copy()
+    smoothed[1:-1] = elevations[:-2] * .3 + elevations[1:-1] * .4 + elevations[2:] * .3
+    climbs = np.diff(smoothed)
+    return float(climbs[climbs > 0].sum()), float(-climbs[climbs <= 0].sum())
+
+
+def _max_speed(speeds, distances):
+    """``gpxpy.geo.calculate_max_speed`` with outlier removal by distance."""
+    if len(speeds) < 2:
+        return None
+    average_distance = distances.mean()
+    deviation = math.sqrt(((distances - average_distance) ** 2).mean())
+    kept = np.sort(speeds[np.abs(distances - average_distance) <= deviation * 1.5])
+    if not len(kept):
+        return None
+    index = int(len(kept) * (1 - IGNORE_TOP_SPEED_PERCENTILES))
+    return float(kept[index if index < len(kept) else -1])
+
+
+def _moving_data(lat, lon, ele, seconds):
+    if len(lat) < 2:
+        return 0.0, None
+    # gpxpy only uses the 3D distance here when both elevations are non-zero
+    has_ele = ~np.isnan(ele) & (ele != 0)
+    _, distance = _distances(lat, lon, ele, has_ele[1:] & has_ele[:-1])
+    delta = seconds[1:] - seconds[:-1]
+    valid = ~np.isnan(delta) & (delta > 0) & (distance != 0)
+    delta = np.where(valid, delta, 1.0)
+    speed_kmh = (distance / 1000) / (delta / 60 ** 2)
+    moving = valid & (speed_kmh > STOPPED_SPEED_THRESHOLD)
+    moving_time = float(delta[moving].sum())
+
+    # speeds are collected from the first moving step on, stopped ones included
+    if not moving.any():
+        return moving_time, None
+    collected = valid & (np.arange(len(valid)) >= np.argmax(moving))
+    return moving_time, _max_speed(distance[collected] / delta[collected], distance[collected])
+
+
+def compute_metrics(gpx):
+    """Compute the track fields of a MongoDB document from a parsed ``gpxpy.gpx.GPX``."""
+    min_elevation = None
+    max_elevation = None
+    uphill = downhill = length_2d = length_3d = moving_time = 0.0
+    max_speed = 0.0
+    for track in gpx.tracks:
+        for segment in track.segments:
+            if not segment.points:
+                continue
+            lat, lon, ele, seconds = segment_arrays(segment)
+            if not np.isnan(ele).all():
+                segment_min, segment_max = float(np.nanmin(ele)), float(np.nanmax(ele))
+                min_elevation = segment_min if min_elevation is None else min(min_elevation, segment_min)
+                max_elevation = segment_max if max_elevation is None else max(max_elevation, segment_max)
+            segment_uphill, segment_downhill = _uphill_downhill(ele)
+            uphill += segment_uphill
+            downhill += segment_downhill
+            if len(lat) > 1:
+                distance_2d, distance_3d = _distances(lat, lon, ele, True)
+                length_2d += float(distance_2d.sum())
+                length_3d += float(distance_3d.sum())
+            segment_moving_time, segment_max_speed = _moving_data(lat, lon, ele, seconds)
+            moving_time += segment_moving_time
+            if segment_max_speed is not None and segment_max_speed > max_speed:
+                max_speed = segment_max_speed
+
+    return {
+        "min_elevation": min_elevation,
+        "max_elevation": max_elevation,
+        "uphill": uphill,
+        "downhill": downhill,
+        "max_speed": max_speed,
+        "length_2d": length_2d,
+        "length_3d": length_3d,
+        "moving_time": moving_time,
+    }
+
+
+def gpxpy_metrics(gpx):
+    """The same fields computed with gpxpy's own helpers (reference implementation)."""
+    min_elevation, max_elevation = gpx.get_elevation_extremes()
+    uphill, downhill = gpx.get_uphill_downhill()
+    moving_data = gpx.get_moving_data()
+    return {
+        "min_elevation": min_elevation,
+        "max_elevation": max_elevation,
+        "uphill": uphill,
+        "downhill": downhill,
+        "max_speed": moving_data.max_speed,
+        "length_2d": gpx.length_2d(),
+        "length_3d": gpx.length_3d(),
+        "moving_time": moving_data.moving_time,
+    }
+
+
+def compare_with_gpxpy(gpx, metrics=None):
+    """Return ``{field: (numpy, gpxpy)}`` for every field that deviates by more than ``TOLERANCE``."""
+    metrics = compute_metrics(gpx) if metrics is None else metrics
+    reference = gpxpy_metrics(gpx)
+    deviations = {}
+    for field in METRIC_FIELDS:
+        ours, theirs = metrics[field], reference[field]
+        if ours is None or theirs is None:
+            if ours != theirs:
+                deviations[field] = (ours, theirs)
+        elif not math.isclose(ours, theirs, rel_tol=TOLERANCE, abs_tol=TOLERANCE):
+            deviations[field] = (ours, theirs)
+    return deviations
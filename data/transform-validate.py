@@ -1,6 +1,10 @@
 import argparse
 import json
 import os
+import queue
+import threading
+import time
+from collections import deque
 from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
@@ -9,23 +13,23 @@ from pymongo import MongoClient
 
 import gpxpy
 
-def to_document(gpx_dir, item):
+from feature_store import FeatureStoreWriter
+from track_metrics import compare_with_gpxpy, compute_metrics, gpxpy_metrics
+
+def to_document(gpx_dir, item, engine="numpy", verify=False):
     try:
         gpx_path = gpx_dir / item["gpx_filename"]
         gpx = gpxpy.parse(gpx_path.read_text(encoding="UTF-8"))
         doc = dict(item)
-        doc.update(
-            {
-                "min_elevation": gpx.get_elevation_extremes()[0],
-                "max_elevation": gpx.get_elevation_extremes()[1],
-                "uphill": gpx.get_uphill_downhill()[0],
-                "downhill": gpx.get_uphill_downhill()[1],
-                "max_speed": gpx.get_moving_data().max_speed,
-                "length_2d": gpx.length_2d(),
-                "length_3d": gpx.length_3d(),
-                "moving_time": gpx.get_moving_data().moving_time,
-            }
-        )
+        if engine == "gpxpy":
+            doc.update(gpxpy_metrics(gpx))
+        else:
+            metrics = compute_metrics(gpx)
+            if verify:
+                deviations = compare_with_gpxpy(gpx, metrics)
+                if deviations:
+                    print(f"Metrics of {item['gpx_filename']} deviate from gpxpy", deviations)
+            doc.update(metrics)
         return doc
 
     except Exception as e:
@@ -33,7 +37,55 @@ def to_document(gpx_dir, item):
         return None
 
 
+def to_documents(gpx_dir, batch, engine="numpy", verify=False):
+    """Convert one batch in a worker process; failed tracks are left out."""
+    started = time.perf_counter()
+    documents = []
+    for item in batch:
+        document = to_document(gpx_dir, item, engine, verify)
+        if document is not None:
+            documents.append(document)
+    return len(batch), documents, time.perf_counter() - started
+
+
+class StageCounters:
+    """Items and busy time per pipeline stage, for the throughput report."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def add(self, stage, items, seconds):
+        with self.lock:
+            count, busy = self.stages.get(stage, (0, 0.0))
+            self.stages[stage] = (count + items, busy + seconds)
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        print(f"\n{'*** Stage ***':<12} {'items':>10} {'busy [s]':>10} {'items/s':>10}")
+        for stage, (count, busy) in self.stages.items():
+            rate = count / busy if busy else 0.0
+            print(f"{stage:<12} {count:>10} {busy:>10.2f} {rate:>10.1f}")
+        total = self.stages.get("insert", (0, 0.0))[0]
+        print(f"{'total':<12} {total:>10} {elapsed:>10.2f} {total / elapsed if elapsed else 0.0:>10.1f}")
+
+
 class JsonLinesImporter:
+    """Streams JSON lines through a long-lived worker pool into MongoDB.
+
+    Up to ``workers * 2`` batches are parsed concurrently while a writer
+    thread runs unordered ``insert_many`` calls, so parsing of the next
+    batches overlaps the insert of the current one. Both hand-offs are
+    bounded, keeping memory flat for arbitrarily large inputs. If a feature
+    store path is given, the writer also appends every inserted batch to it.
+
+    Every document is stamped with ``ingested_at`` (Unix seconds). In append
+    mode the collection and feature store are kept and tracks whose ``_id``
+    is already stored are skipped before parsing, so earlier tracks keep
+    their timestamp and incremental training only sees the new ones.
+    """
+
     def __init__(
         self,
         file,
@@ -41,48 +93,124 @@ class JsonLinesImporter:
         mongo_uri,
         batch_size=200,
         db="tracks",
+        engine="numpy",
+        verify=False,
+        workers=None,
+        insert_queue_size=4,
+        feature_store=None,
+        append=False,
     ):
         self.file = file
         self.gpx_dir = gpx_dir
         self.batch_size = batch_size
+        self.engine = engine
+        self.verify = verify
+        self.workers = workers or os.cpu_count() or 1
+        self.insert_queue_size = insert_queue_size
+        self.feature_store = feature_store
+        self.append = append
+        self.existing_ids = set()
         self.client = MongoClient(mongo_uri)
         self.db = db
         self.collection = "tracks"
+        self.counters = None
+        self.insert_error = None
 
     def read_lines(self):
         with open(self.file, encoding='UTF-8') as f:
             batch = []
+            started = time.perf_counter()
             for line in f:
-                batch.append(json.loads(line))
+                item = json.loads(line)
+                if item.get("_id") in self.existing_ids:
+                    continue
+                batch.append(item)
                 if len(batch) == self.batch_size:
+                    self.counters.add("read", len(batch), time.perf_counter() - started)
                     yield batch
-                    batch.clear()
-            yield batch
+                    batch = []
+                    started = time.perf_counter()
+            if batch:
+                self.counters.add("read", len(batch), time.perf_counter() - started)
+                yield batch
 
     def save_to_mongodb(self):
         db = self.client[self.db]
         collection = db[self.collection]
-        collection.drop()
+        if self.append:
+            self.existing_ids = set(collection.distinct("_id"))
+            print(f"appending to {len(self.existing_ids)} existing tracks")
+        else:
+            collection.drop()
+            self.existing_ids = set()
+        features = None
+        if self.feature_store:
+            features = FeatureStoreWriter(self.feature_store, reset=not self.append)
+        inserts = queue.Queue(maxsize=self.insert_queue_size)
+        self.counters = StageCounters()
+        self.insert_error = None
+        writer = threading.Thread(target=self._insert_batches, args=(collection, features, inserts), name="mongo-writer")
+        writer.start()
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                pending = deque()
+                for batch in self.read_lines():
+                    pending.append(executor.submit(to_documents, self.gpx_dir, batch, self.engine, self.verify))
+                    if len(pending) >= self.workers * 2:
+                        self._hand_over(pending.popleft(), inserts)
+                while pending:
+                    self._hand_over(pending.popleft(), inserts)
+        finally:
+            inserts.put(None)
+            writer.join()
+        if self.insert_error is not None:
+            raise self.insert_error
+        self.counters.report()
+
+    def _hand_over(self, future, inserts):
+        if self.insert_error is not None:
+            raise self.insert_error
+        lines, documents, seconds = future.result()
+        # busy time of the worker, summed over all workers
+        self.counters.add("parse", lines, seconds)
+        inserts.put(documents)
+
+    def _insert_batches(self, collection, features, inserts):
         processed = 0
-        for idx, batch in enumerate(self.read_lines()):
-            documents = self.prepare_documents(batch)
-            if documents:
-                collection.insert_many(documents)
-                processed += len(documents)
-            print(f"inserting batch {idx} ({processed} tracks processed)")
-
-    def prepare_documents(self, batch):
-        documents = []
-        with ProcessPoolExecutor() as executor:
-            for document in executor.map(to_document, [self.gpx_dir] * len(batch), batch):
-                if document is not None:
-                    documents.append(document)
-        return documents
+        idx = 0
+        while (documents := inserts.get()) is not None:
+            if self.insert_error is not None:
+                # keep draining so the producer never blocks on a full queue
+                continue
+            try:
+                started = time.perf_counter()
+                ingested_at = time.time()
+                for document in documents:
+                    document["ingested_at"] = ingested_at
+                if documents:
+                    collection.insert_many(documents, ordered=False)
+                    processed += len(documents)
+                self.counters.add("insert", len(documents), time.perf_counter() - started)
+                if features is not None:
+                    started = time.perf_counter()
+                    features.append(documents)
+                    self.counters.add("features", len(documents), time.perf_counter() - started)
+                print(f"inserting batch {idx} ({processed} tracks processed)")
+                idx += 1
+            except Exception as ex:
+                self.insert_error = ex
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('-i', '--input', help="input file in JSON Lines format")
+    parser.add_argument('--engine', choices=["numpy", "gpxpy"], default="numpy", help="track metrics implementation")
+    parser.add_argument('--verify', action='store_true', help="compare numpy metrics with gpxpy and report deviations")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="worker processes (default: number of cores)")
+    parser.add_argument('-b', '--batch-size', type=int, default=200, help="tracks per parse and insert batch")
+    parser.add_argument('--feature-store', help="columnar feature store to rebuild (default: gpx-data/features)")
+    parser.add_argument('--no-feature-store', action='store_true', help="only write to MongoDB")
+    parser.add_argument('--append', action='store_true', help="keep existing tracks and only import new ids")
     args = parser.parse_args()
     env_path = Path(__file__).resolve().parent.parent / ".env"
     load_dotenv(env_path, override=True)
@@ -94,5 +222,18 @@ if __name__ == "__main__":
     base_dir = Path(__file__).resolve().parent / "gpx-data"
     input_path = Path(args.input) if args.input else base_dir / "gpx-metadata" / "tracks.jl"
     gpx_dir = base_dir / "gpx-collected-curated"
-    importer = JsonLinesImporter(input_path, gpx_dir, mongo_uri=mongo_uri)
+    feature_store = None
+    if not args.no_feature_store:
+        feature_store = Path(args.feature_store) if args.feature_store else base_dir / "features"
+    importer = JsonLinesImporter(
+        input_path,
+        gpx_dir,
+        mongo_uri=mongo_uri,
+        batch_size=args.batch_size,
+        engine=args.engine,
+        verify=args.verify,
+        workers=args.workers,
+        feature_store=feature_store,
+        append=args.append,
+    )
     importer.save_to_mongodb()
@@ -1,37 +1,25 @@
-"""Upload hikr.org raw data to Azure Blob Storage using versioned containers."""
+"""Upload hikr.org raw data to Azure Blob Storage using versioned containers.
+
+Only changed files are sent, see raw_sync.py; an unchanged dump creates no
+new container.
+"""
 
 from __future__ import annotations
 
+import argparse
 import os
 from pathlib import Path
 
-from azure.core.exceptions import ResourceExistsError
 from azure.storage.blob import BlobServiceClient
 from dotenv import load_dotenv
 
+from raw_sync import CHUNK_SIZE, MAX_WORKERS, upload
+
 RAW_DIR = Path(__file__).resolve().parent / "gpx-data" / "hikr-raw-data"
 RAW_CONTAINER_PREFIX = "hikeplanner-raw-data"
 
 
-def _iter_files(root: Path):
-    for path in root.rglob("*"):
-        if path.is_file():
-            yield path
-
-
-def _compute_next_container(blob_service_client: BlobServiceClient) -> str:
-    prefix = f"{RAW_CONTAINER_PREFIX}-"
-    max_suffix = 0
-    for container in blob_service_client.list_containers():
-        name = container["name"]
-        if name.startswith(prefix):
-            suffix = name[len(prefix) :]
-            if suffix.isdigit():
-                max_suffix = max(max_suffix, int(suffix))
-    return f"{RAW_CONTAINER_PREFIX}-{max_suffix + 1}"
-
-
-def upload_raw_data() -> None:
+def upload_raw_data(workers: int = MAX_WORKERS, chunk_size: int = CHUNK_SIZE) -> None:
     if not RAW_DIR.exists():
         raise SystemExit(f"Source directory not found: {RAW_DIR}")
 
@@ -44,23 +32,12 @@ def upload_raw_data() -> None:
         )
 
     blob_service_client = BlobServiceClient.from_connection_string(conn_str)
-    container_name = _compute_next_container(blob_service_client)
-    print(f"Creating container {container_name} for this upload")
-    try:
-        container_client = blob_service_client.create_container(container_name)
-    except ResourceExistsError:
-        container_client = blob_service_client.get_container_client(container_name)
-
-    uploaded = 0
-    for path in _iter_files(RAW_DIR):
-        blob_name = path.relative_to(RAW_DIR).as_posix()
-        with path.open("rb") as data:
-            container_client.upload_blob(blob_name, data)
-        uploaded += 1
-        print(f"Uploaded {path.name} -> {blob_name}")
-
-    print(f"Uploaded {uploaded} files to container {container_name}")
+    upload(blob_service_client, RAW_DIR, RAW_CONTAINER_PREFIX, workers=workers, chunk_size=chunk_size)
 
 
 if __name__ == "__main__":
-    upload_raw_data()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="concurrent block and file transfers")
+    parser.add_argument("--chunk-size-mb", type=int, default=CHUNK_SIZE // (1024 * 1024), help="block size of large files")
+    args = parser.parse_args()
+    upload_raw_data(args.workers, args.chunk_size_mb * 1024 * 1024)
@@ -0,0 +1,174 @@
+"""Compare loading the training tracks from MongoDB and from the feature store.
+
+Generates synthetic track documents, writes them to a scratch collection
+of a MongoDB server and to a temporary feature store, then loads each
+source in a fresh process and reports load time, peak RSS and the ratio
+to the feature store:
+
+* mongo: every document, as train_model.py loaded them before the store;
+* mongo-pushdown: curated rows and training columns only, the current
+  MongoDB path of train_model.py;
+* features: the memory-mapped feature store.
+
+The numbers only mean something against a real mongod; by default a local
+one, which the benchmark drops its scratch collection from. Never point
+``--mongo-uri`` at the production database.
+
+    mongod --dbpath /tmp/mongo-benchmark &
+    python benchmark_feature_store.py --rows 200000
+"""
+
+import argparse
+import json
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+BENCHMARK_DB = "benchmark"
+BENCHMARK_COLLECTION = "tracks"
+LOCAL_MONGO_URI = "mongodb://localhost:27017"
+SOURCES = ["mongo", "mongo-pushdown", "features"]
+
+
+def synthetic_documents(rows, seed=42):
+    rng = random.Random(seed)
+    for idx in range(rows):
+        length_2d = rng.uniform(1000, 40000)
+        yield {
+            "_id": f"track-{idx}",
+            "user": f"user{rng.randrange(5000)}",
+            "difficulty": f"T{rng.randrange(1, 7)}",
+            "gpx_filename": f"track-{idx}.gpx",
+            "min_elevation": rng.uniform(200, 1500),
+            "max_elevation": rng.uniform(1500, 4000),
+            "uphill": rng.uniform(0, 2500),
+            "downhill": rng.uniform(0, 2500),
+            "max_speed": rng.uniform(0.5, 3),
+            "length_2d": length_2d,
+            "length_3d": length_2d * 1.05,
+            "moving_time": rng.uniform(1800, 30000),
+            "ingested_at": 1.7e9 + idx,
+        }
+
+
+def generate(rows, store_path, mongo_uri):
+    import repo_paths  # noqa: F401
+    from feature_store import FeatureStoreWriter
+
+    writer = FeatureStoreWriter(store_path, reset=True)
+    collection = None
+    if mongo_uri:
+        from pymongo import MongoClient
+
+        collection = MongoClient(mongo_uri)[BENCHMARK_DB][BENCHMARK_COLLECTION]
+        collection.drop()
+    batch = []
+    for document in synthetic_documents(rows):
+        batch.append(document)
+        if len(batch) == 5000:
+            writer.append(batch)
+            if collection is not None:
+                collection.insert_many(batch)
+            batch = []
+    if batch:
+        writer.append(batch)
+        if collection is not None:
+            collection.insert_many(batch)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def check_mongo(mongo_uri):
+    """Exit with a hint unless a MongoDB server answers at ``mongo_uri``."""
+    from pymongo import MongoClient
+    from pymongo.errors import PyMongoError
+
+    try:
+        version = MongoClient(mongo_uri, serverSelectionTimeoutMS=3000).server_info()["version"]
+    except PyMongoError as ex:
+        raise SystemExit(
+            f"No MongoDB server at {mongo_uri} ({ex}).\n"
+            "Start a local one (mongod --dbpath /tmp/mongo-benchmark) or pass --features-only."
+        )
+    print(f"MongoDB {version}")
+
+
+def child(source, store_path, mongo_uri):
+    from track_data import load_tracks_feature_store, load_tracks_mongo, load_training_columns
+
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    if source.startswith("mongo"):
+        from pymongo import MongoClient
+
+        collection = MongoClient(mongo_uri)[BENCHMARK_DB][BENCHMARK_COLLECTION]
+        df = load_tracks_mongo(collection) if source == "mongo" else load_training_columns(collection)[0]
+    else:
+        df = load_tracks_feature_store(store_path)
+    # touch every value so lazily mapped pages are counted as well
+    df.sum(numeric_only=True)
+    seconds = time.perf_counter() - started
+    print(json.dumps({
+        "source": source,
+        "rows": len(df),
+        "seconds": seconds,
+        "baseline_rss_mb": baseline,
+        "peak_rss_mb": peak_rss_mb(),
+    }))
+
+
+def run_child(source, store_path, mongo_uri):
+    output = subprocess.run(
+        [sys.executable, __file__, "--child", source, "--store", str(store_path), "--mongo-uri", mongo_uri],
+        check=True,
+        capture_output=True,
+        text=True,
+        cwd=Path(__file__).resolve().parent,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--mongo-uri", default=LOCAL_MONGO_URI, help=f"scratch MongoDB server (default: {LOCAL_MONGO_URI})")
+    parser.add_argument("--features-only", action="store_true", help="measure the feature store alone, no comparison")
+    parser.add_argument("--child", choices=SOURCES, help=argparse.SUPPRESS)
+    parser.add_argument("--store", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.store, args.mongo_uri)
+        return
+
+    mongo_uri = None if args.features_only else args.mongo_uri
+    if mongo_uri:
+        check_mongo(mongo_uri)
+    with tempfile.TemporaryDirectory() as tmp:
+        store_path = Path(tmp, "features")
+        print(f"Generating {args.rows} synthetic tracks...")
+        generate(args.rows, store_path, mongo_uri)
+        sources = SOURCES if mongo_uri else ["features"]
+        results = [run_child(source, store_path, args.mongo_uri) for source in sources]
+
+    features = results[-1]
+    print(f"\n{'*** Source ***':<16} {'rows':>10} {'load [s]':>10} {'peak RSS [MB]':>14} {'+RSS [MB]':>10} {'x features':>11}")
+    for result in results:
+        print(
+            f"{result['source']:<16} {result['rows']:>10} {result['seconds']:>10.3f} "
+            f"{result['peak_rss_mb']:>14.1f} {result['peak_rss_mb'] - result['baseline_rss_mb']:>10.1f} "
+            f"{result['seconds'] / features['seconds']:>11.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
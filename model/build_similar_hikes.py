@@ -0,0 +1,62 @@
+"""Build the similar hikes index (SimilarHikes.npz) from the curated tracks in MongoDB.
+
+Run after train_model.py; publish_model.py uploads the index next to the
+model and the backend answers /api/similar from it.
+"""
+
+import argparse
+import datetime
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+import numpy as np
+from pymongo import MongoClient
+
+import repo_paths  # noqa: F401
+from similar_hikes import CELL_SIZE, FEATURE_COLUMNS, INDEX_NAME, build_index, parse_bounds
+from track_data import load_hike_catalog
+
+
+def build_from_documents(documents, output, cell_size=CELL_SIZE):
+    features = np.array([[document[column] for column in FEATURE_COLUMNS] for document in documents], dtype=np.float64)
+    bounds = np.array(
+        [parse_bounds(document.get("bounds")) or (np.nan,) * 4 for document in documents], dtype=np.float64
+    )
+    header = build_index(
+        output,
+        features,
+        [document["moving_time"] for document in documents],
+        bounds,
+        [str(document.get("name") or "") for document in documents],
+        [str(document.get("url") or "") for document in documents],
+        cell_size=cell_size,
+        meta={"built_at": datetime.datetime.now().isoformat(timespec="seconds")},
+    )
+    located = int((~np.isnan(bounds).any(axis=1)).sum())
+    print(
+        f"Indexed {header['hikes']} hikes ({located} with bounds) in {output} "
+        f"({os.path.getsize(output) / 1024 / 1024:.1f} MB)"
+    )
+    return header
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", default=INDEX_NAME, help=f"index file (default: {INDEX_NAME})")
+    parser.add_argument("--cell-size", type=float, default=CELL_SIZE, help="spatial grid cell size in degrees")
+    args = parser.parse_args()
+
+    env_path = Path(__file__).resolve().parent.parent / ".env"
+    load_dotenv(env_path, override=True)
+    mongo_uri = os.getenv("MONGO_DB_CONNECTION_STRING")
+    if not mongo_uri:
+        raise SystemExit("Missing MongoDB URI. Set MONGO_DB_CONNECTION_STRING in .env or in the environment.")
+    documents = load_hike_catalog(MongoClient(mongo_uri)["tracks"]["tracks"])
+    if not documents:
+        raise SystemExit("No curated tracks found in MongoDB.")
+    build_from_documents(documents, args.output, args.cell_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Cross-validated model search for ``train_model.py --search``.
+
+Every candidate is cross-validated and then refit on the whole training
+split in a process pool. Single-row predict latency is measured afterwards
+in the parent process, one candidate at a time and through the same
+predictor the backend would use (the compiled engine where available),
+so the timings are not disturbed by fits running in parallel. The
+leaderboard lists accuracy, fit time, p50/p99 latency and pickled size;
+the winner is the most accurate candidate whose p99 latency fits the
+budget.
+"""
+
+import fnmatch
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.base import clone
+from sklearn.ensemble import GradientBoostingRegressor, HistGradientBoostingRegressor
+from sklearn.metrics import mean_squared_error, r2_score
+from sklearn.model_selection import KFold
+from threadpoolctl import threadpool_limits
+
+import repo_paths  # noqa: F401
+from inference import SklearnPredictor, compile_model
+
+LEADERBOARD_NAME = "leaderboard.json"
+
+
+def default_candidates():
+    """Candidate name -> unfitted estimator for the boosting slot (the linear baseline is always trained)."""
+    candidates = {}
+    for n_estimators in (50, 100, 200):
+        for max_depth in (3, 5):
+            candidates[f"gbr-{n_estimators}-d{max_depth}"] = GradientBoostingRegressor(
+                n_estimators=n_estimators, max_depth=max_depth, random_state=9000
+            )
+    for max_iter in (100, 300):
+        for max_leaf_nodes in (15, 31):
+            candidates[f"hgb-{max_iter}-l{max_leaf_nodes}"] = HistGradientBoostingRegressor(
+                max_iter=max_iter, max_leaf_nodes=max_leaf_nodes, early_stopping=False, random_state=9000
+            )
+    return candidates
+
+
+def select_candidates(patterns=None):
+    """Candidates whose name matches one of the comma separated glob ``patterns``."""
+    candidates = default_candidates()
+    if not patterns:
+        return candidates
+    selected = {
+        name: estimator
+        for name, estimator in candidates.items()
+        if any(fnmatch.fnmatch(name, pattern.strip()) for pattern in patterns.split(","))
+    }
+    if not selected:
+        raise SystemExit(f"No candidate matches {patterns!r}, choose from: {', '.join(candidates)}")
+    return selected
+
+
+def _cross_validate(name, estimator, x, y, folds):
+    # one thread per process, the pool already runs one candidate per core
+    with threadpool_limits(1):
+        scores = []
+        for train_idx, test_idx in KFold(n_splits=folds, shuffle=True, random_state=42).split(x):
+            model = clone(estimator)
+            started = time.perf_counter()
+            model.fit(x.iloc[train_idx], y.iloc[train_idx])
+            fit_seconds = time.perf_counter() - started
+            y_pred = model.predict(x.iloc[test_idx])
+            scores.append((r2_score(y.iloc[test_idx], y_pred), mean_squared_error(y.iloc[test_idx], y_pred), fit_seconds))
+        model = clone(estimator)
+        model.fit(x, y)
+    r2, mse, fit_seconds = np.asarray(scores).T
+    return {
+        "name": name,
+        "model": type(estimator).__name__,
+        "r2": float(r2.mean()),
+        "r2_std": float(r2.std()),
+        "mse": float(mse.mean()),
+        "fit_seconds": float(fit_seconds.mean()),
+    }, model
+
+
+def serving_predictor(model, columns):
+    """The predictor the backend would use: compiled if supported, else sklearn."""
+    try:
+        return compile_model(model), "compiled"
+    except ValueError:
+        return SklearnPredictor(model, columns), "sklearn"
+
+
+def predict_latency(model, rows, columns):
+    """p50/p99 single-row latency in microseconds and the engine used."""
+    predictor, engine = serving_predictor(model, columns)
+    predictor.predict_one(rows[0])
+    timings = []
+    for row in rows:
+        started = time.perf_counter_ns()
+        predictor.predict_one(row)
+        timings.append(time.perf_counter_ns() - started)
+    p50, p99 = np.percentile(timings, [50, 99]) / 1000
+    return float(p50), float(p99), engine
+
+
+def run_search(x, y, candidates, folds=5, latency_budget_ms=1.0, latency_rows=1000, workers=None):
+    """Cross-validate ``candidates`` on ``x``/``y``; returns (leaderboard, best name, fitted best model).
+
+    The leaderboard is sorted by mean cross-validated R2.
+    """
+    workers = workers or min(len(candidates), os.cpu_count() or 1)
+    print(f"\n*** Model Search: {len(candidates)} candidates, {folds}-fold CV, {workers} workers ***")
+    fitted = {}
+    leaderboard = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_cross_validate, name, estimator, x, y, folds) for name, estimator in candidates.items()]
+        for future in futures:
+            entry, model = future.result()
+            fitted[entry["name"]] = model
+            leaderboard.append(entry)
+            print(f"cross-validated {entry['name']}")
+
+    rng = np.random.default_rng(42)
+    rows = x.to_numpy(dtype=np.float64)[rng.integers(0, len(x), latency_rows)].tolist()
+    budget_us = latency_budget_ms * 1000
+    for entry in leaderboard:
+        model = fitted[entry["name"]]
+        entry["p50_us"], entry["p99_us"], entry["engine"] = predict_latency(model, rows, list(x.columns))
+        entry["size_bytes"] = len(pickle.dumps(model))
+        entry["within_budget"] = entry["p99_us"] <= budget_us
+    leaderboard.sort(key=lambda entry: entry["r2"], reverse=True)
+
+    print(
+        f"\n{'*** Leaderboard ***':<20} {'R2':>8} {'±':>7} {'MSE':>12} {'fit [s]':>8} "
+        f"{'p50 [us]':>9} {'p99 [us]':>9} {'size [KB]':>10} {'engine':>9}"
+    )
+    for entry in leaderboard:
+        marker = "" if entry["within_budget"] else "  over budget"
+        print(
+            f"{entry['name']:<20} {entry['r2']:>8.4f} {entry['r2_std']:>7.4f} {entry['mse']:>12.0f} "
+            f"{entry['fit_seconds']:>8.2f} {entry['p50_us']:>9.1f} {entry['p99_us']:>9.1f} "
+            f"{entry['size_bytes'] / 1024:>10.1f} {entry['engine']:>9}{marker}"
+        )
+
+    eligible = [entry for entry in leaderboard if entry["within_budget"]]
+    if not eligible:
+        raise SystemExit(f"No candidate predicts within the p99 latency budget of {latency_budget_ms} ms.")
+    best = eligible[0]
+    print(f"\nSelected {best['name']} (p99 {best['p99_us']:.1f} us, budget {budget_us:.0f} us)")
+    return leaderboard, best["name"], fitted[best["name"]]
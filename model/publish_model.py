@@ -29,9 +29,18 @@ try:
     suffix += 1
     container_name = f"hikeplanner-model-{suffix}"
     print(f"Using container: {container_name}")
-    blob_service_client.create_container(container_name)
 
     local_files = ["GradientBoostingRegressor.pkl", "LinearRegression.pkl"]
+
+    blob_service_client.create_container(container_name)
+
+    # training state for train_model.py --incremental, evaluation metrics, search leaderboard,
+    # similar hikes index and per-user corrections
+    optional_files = (
+        "TrainingState.npz", "metrics.json", "leaderboard.json", "SimilarHikes.npz",
+        "UserCorrections.npy", "UserCorrections.json",
+    )
+    local_files += [name for name in optional_files if os.path.exists(name)]
     for local_file_name in local_files:
         upload_file_path = os.path.join(".", local_file_name)
         # Create a blob client using the local file name as the name for the blob
@@ -0,0 +1,17 @@
+"""Make the backend and data modules importable from the model scripts.
+
+The scripts run from this folder and import their neighbours as top-level
+modules; ``import repo_paths`` before importing from ``backend/`` or
+``data/`` adds those folders to ``sys.path``, after this one.
+"""
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND_DIR = ROOT / "backend"
+DATA_DIR = ROOT / "data"
+
+for directory in (BACKEND_DIR, DATA_DIR):
+    if str(directory) not in sys.path:
+        sys.path.append(str(directory))
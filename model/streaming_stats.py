@@ -0,0 +1,219 @@
+"""One-pass statistics of the training tracks for the report and the heatmap.
+
+``TrackStatistics`` is updated batch by batch and keeps per column the
+count, mean, sum of squared deviations, minimum, maximum and a histogram
+with a fixed bin width, and per pair of columns the co-moment. Like
+``pandas.DataFrame.corr`` the pair statistics only use the rows where
+both columns have a value, so every pair carries its own count and means.
+Within a batch the moments are computed around the batch means, batches
+and the statistics of other processes are combined with the pairwise
+update of Chan et al.; the result equals the two-pass computation over
+all rows up to floating point rounding. Memory depends on the number of
+columns, not on the number of tracks.
+
+    python streaming_stats.py [feature store] --workers 4
+"""
+
+import argparse
+import math
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# histogram bin widths, in the units of the columns; other columns use DEFAULT_BIN_WIDTH
+BIN_WIDTHS = {
+    "min_elevation": 100.0,
+    "max_elevation": 100.0,
+    "uphill": 100.0,
+    "downhill": 100.0,
+    "max_speed": 0.25,
+    "length_2d": 1000.0,
+    "length_3d": 1000.0,
+    "moving_time": 900.0,
+    "avg_speed": 0.05,
+    "difficulty_num": 1.0,
+}
+DEFAULT_BIN_WIDTH = 1.0
+UPDATE_ROWS = 4096
+# numeric columns of the feature store that identify a track and are no measurement
+IDENTIFIERS = ["track_key"]
+
+
+class TrackStatistics:
+    """Mergeable pairwise moments, ranges and histograms of numeric columns."""
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        size = len(self.columns)
+        # [i, j]: over the rows where columns i and j both have a value
+        self.n = np.zeros((size, size))
+        self.mean_i = np.zeros((size, size))  # mean of column i
+        self.mean_j = np.zeros((size, size))  # mean of column j
+        self.m2_i = np.zeros((size, size))  # squared deviations of column i
+        self.m2_j = np.zeros((size, size))
+        self.comoment = np.zeros((size, size))
+        self.minimum = np.full(size, np.nan)
+        self.maximum = np.full(size, np.nan)
+        self.widths = [BIN_WIDTHS.get(column, DEFAULT_BIN_WIDTH) for column in self.columns]
+        self.histograms = [{} for _ in self.columns]
+
+    @classmethod
+    def from_frame(cls, frame, columns=None):
+        statistics = cls(frame.columns if columns is None else columns)
+        statistics.update(frame)
+        return statistics
+
+    def update(self, frame):
+        """Add the rows of a DataFrame with (at least) these columns."""
+        values = frame[self.columns].to_numpy(dtype=np.float64)
+        # the pairwise arrays are rows x columns x columns, bound them whatever the batch size
+        for start in range(0, len(values), UPDATE_ROWS):
+            self._add(self._of_values(values[start:start + UPDATE_ROWS]))
+        return self
+
+    def _of_values(self, values):
+        valid = ~np.isnan(values)
+        both = valid[:, :, None] & valid[:, None, :]
+        n = both.sum(axis=0).astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            column_i = np.where(both, values[:, :, None], 0.0)
+            column_j = np.where(both, values[:, None, :], 0.0)
+            mean_i = np.where(n > 0, column_i.sum(axis=0) / n, 0.0)
+            mean_j = np.where(n > 0, column_j.sum(axis=0) / n, 0.0)
+        deviation_i = np.where(both, column_i - mean_i, 0.0)
+        deviation_j = np.where(both, column_j - mean_j, 0.0)
+        batch = TrackStatistics(self.columns)
+        batch.n = n
+        batch.mean_i, batch.mean_j = mean_i, mean_j
+        batch.m2_i = (deviation_i * deviation_i).sum(axis=0)
+        batch.m2_j = (deviation_j * deviation_j).sum(axis=0)
+        batch.comoment = (deviation_i * deviation_j).sum(axis=0)
+        present = valid.any(axis=0)
+        batch.minimum = np.where(present, np.where(valid, values, np.inf).min(axis=0), np.nan)
+        batch.maximum = np.where(present, np.where(valid, values, -np.inf).max(axis=0), np.nan)
+        for column, width in enumerate(self.widths):
+            bins, counts = np.unique(np.floor(values[valid[:, column], column] / width), return_counts=True)
+            batch.histograms[column] = dict(zip(bins.astype(np.int64).tolist(), counts.tolist()))
+        return batch
+
+    def _add(self, other):
+        n = self.n + other.n
+        with np.errstate(invalid="ignore", divide="ignore"):
+            share = np.where(n > 0, other.n / n, 0.0)
+            weight = np.where(n > 0, self.n * other.n / n, 0.0)
+        delta_i = other.mean_i - self.mean_i
+        delta_j = other.mean_j - self.mean_j
+        self.mean_i = self.mean_i + delta_i * share
+        self.mean_j = self.mean_j + delta_j * share
+        self.m2_i = self.m2_i + other.m2_i + delta_i * delta_i * weight
+        self.m2_j = self.m2_j + other.m2_j + delta_j * delta_j * weight
+        self.comoment = self.comoment + other.comoment + delta_i * delta_j * weight
+        self.n = n
+        self.minimum = np.fmin(self.minimum, other.minimum)
+        self.maximum = np.fmax(self.maximum, other.maximum)
+        for histogram, counts in zip(self.histograms, other.histograms):
+            for key, count in counts.items():
+                histogram[key] = histogram.get(key, 0) + count
+
+    def merge(self, other):
+        """Statistics of the union of both row sets, e.g. from two worker processes."""
+        if other.columns != self.columns:
+            raise ValueError(f"cannot merge statistics over {other.columns} into {self.columns}")
+        merged = TrackStatistics(self.columns)
+        merged._add(self)
+        merged._add(other)
+        return merged
+
+    def correlation(self):
+        """Pearson correlation with pairwise complete rows, as ``DataFrame.corr()`` computes it."""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            divisor = np.sqrt(self.m2_i * self.m2_j)
+            values = np.where((self.n > 0) & (divisor != 0), self.comoment / divisor, np.nan)
+        return pd.DataFrame(values, index=self.columns, columns=self.columns)
+
+    def summary(self):
+        """Count, mean, std, min and max per column, the first rows of ``DataFrame.describe()``."""
+        count = np.diag(self.n)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(count > 0, np.diag(self.mean_i), np.nan)
+            std = np.where(count > 1, np.sqrt(np.diag(self.m2_i) / (count - 1)), np.nan)
+        return pd.DataFrame(
+            [count, mean, std, self.minimum, self.maximum],
+            index=["count", "mean", "std", "min", "max"],
+            columns=self.columns,
+        )
+
+    def histogram(self, column):
+        """``(bin starts, counts)`` of a column, bins without rows included."""
+        index = self.columns.index(column)
+        counts = self.histograms[index]
+        if not counts:
+            return np.empty(0), np.empty(0, dtype=np.int64)
+        bins = np.arange(min(counts), max(counts) + 1)
+        return bins * self.widths[index], np.array([counts.get(int(key), 0) for key in bins], dtype=np.int64)
+
+    def to_json(self):
+        """Summary and histograms as plain JSON values, for metrics.json."""
+        summary = self.summary()
+        result = {}
+        for index, column in enumerate(self.columns):
+            result[column] = {
+                name: None if math.isnan(value) else float(value) for name, value in summary[column].items()
+            }
+            # sparse [bin start, count] pairs, a single outlier must not produce millions of empty bins
+            width = self.widths[index]
+            result[column]["histogram"] = {
+                "width": width,
+                "bins": [[key * width, count] for key, count in sorted(self.histograms[index].items())],
+            }
+        return result
+
+
+def iter_frames(frame, batch_rows):
+    for start in range(0, len(frame), batch_rows):
+        yield frame.iloc[start:start + batch_rows]
+
+
+def _statistics_of_range(path, start, stop, batch_rows):
+    from track_data import load_tracks_feature_store
+
+    frame = load_tracks_feature_store(path).drop(columns=IDENTIFIERS, errors="ignore").iloc[start:stop]
+    statistics = TrackStatistics(frame.columns)
+    for batch in iter_frames(frame, batch_rows):
+        statistics.update(batch)
+    return statistics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the streamed statistics of a feature store with pandas.")
+    parser.add_argument("feature_store", nargs="?", help="feature store directory (default: the one of train_model.py)")
+    parser.add_argument("--workers", type=int, default=2, help="processes, each streaming a slice of the rows")
+    parser.add_argument("--batch-rows", type=int, default=10000)
+    args = parser.parse_args()
+
+    from track_data import FEATURE_STORE_DIR, load_tracks_feature_store
+
+    path = args.feature_store or FEATURE_STORE_DIR
+    frame = load_tracks_feature_store(path).drop(columns=IDENTIFIERS, errors="ignore")
+    bounds = np.linspace(0, len(frame), args.workers + 1).astype(int)
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        parts = executor.map(
+            _statistics_of_range, [path] * args.workers, bounds[:-1], bounds[1:], [args.batch_rows] * args.workers
+        )
+        statistics = TrackStatistics(frame.columns)
+        for part in parts:
+            statistics = statistics.merge(part)
+
+    corr_difference = np.nanmax(np.abs(statistics.correlation().to_numpy() - frame.corr().to_numpy()))
+    expected = frame.describe().loc[["count", "mean", "std", "min", "max"]]
+    summary_difference = np.nanmax(np.abs(statistics.summary().to_numpy() - expected.to_numpy()) / np.maximum(
+        np.abs(expected.to_numpy()), 1))
+    print(statistics.summary().T)
+    print(f"\n{len(frame)} rows in {args.workers} processes")
+    print(f"max correlation difference to pandas: {corr_difference:.2e}")
+    print(f"max relative summary difference to pandas: {summary_difference:.2e}")
+
+
+if __name__ == "__main__":
+    main()
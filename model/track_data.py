@@ -0,0 +1,216 @@
+"""Load the training tracks from MongoDB or from the local feature store."""
+
+from pathlib import Path
+
+import bson
+import numpy as np
+import pandas as pd
+
+from repo_paths import DATA_DIR
+from feature_store import SCHEMA_NAME, difficulty_num, load_features, track_key
+
+FEATURE_STORE_DIR = DATA_DIR / "gpx-data" / "features"
+MONGO_PROJECTION = {"gpx": 0, "url": 0, "bounds": 0, "name": 0}
+
+# numeric columns in document order, as the correlation matrix shows them
+NUMERIC_COLUMNS = [
+    "min_elevation",
+    "max_elevation",
+    "uphill",
+    "downhill",
+    "max_speed",
+    "length_2d",
+    "length_3d",
+    "moving_time",
+]
+TRAINING_COLUMNS = ["downhill", "uphill", "length_3d", "max_elevation", "moving_time"]
+# tracks whose track_key falls in this fold of HOLDOUT_FOLDS are never trained on, full or incremental
+HOLDOUT_FOLDS = 5
+HOLDOUT_FOLD = 0
+HOLDOUT_RULE = f"blake2b-64(_id) % {HOLDOUT_FOLDS} == {HOLDOUT_FOLD}"
+# {"$gte": -inf} only matches numbers that are not NaN, which also excludes missing fields
+NOT_NAN = {"$gte": float("-inf")}
+
+
+def training_pipeline(since=None):
+    """Curation rules of train_model.py as an aggregation pipeline.
+
+    With ``since`` only tracks ingested after that Unix timestamp are returned.
+
+    ``avg_speed = length_3d / moving_time < 2`` is written without a division
+    (which fails on a zero moving time) as ``length_3d < 2 * moving_time``
+    with a positive moving time; rows pandas would turn into NaN or inf are
+    dropped either way.
+    """
+    match = {column: dict(NOT_NAN) for column in TRAINING_COLUMNS}
+    match["moving_time"] = {"$gt": 0}
+    match["min_elevation"] = {"$gt": 0}
+    match["length_2d"] = {"$lt": 100000}
+    match["$expr"] = {"$lt": ["$length_3d", {"$multiply": [2, "$moving_time"]}]}
+    if since is not None:
+        match["ingested_at"] = {"$gt": since}
+    projection = {"_id": 1, "difficulty": 1, "ingested_at": 1}
+    projection.update({column: 1 for column in NUMERIC_COLUMNS})
+    return [{"$match": match}, {"$project": projection}]
+
+
+def in_holdout(keys):
+    """Boolean mask of the track keys in the fixed evaluation holdout."""
+    return np.asarray(keys, dtype=np.uint64) % np.uint64(HOLDOUT_FOLDS) == np.uint64(HOLDOUT_FOLD)
+
+
+def catalog_pipeline():
+    """The curated tracks with the fields the similar hikes index shows: name, URL and bounds."""
+    match, _ = training_pipeline()
+    projection = {"_id": 1, "name": 1, "url": 1, "bounds": 1, "moving_time": 1}
+    projection.update({column: 1 for column in TRAINING_COLUMNS})
+    return [match, {"$project": projection}]
+
+
+def user_tracks_pipeline():
+    """The curated tracks of identified users, with the fields the per-user corrections need."""
+    match, _ = training_pipeline()
+    match = {"$match": dict(match["$match"], user={"$type": "string", "$ne": ""})}
+    projection = {"_id": 1, "user": 1}
+    projection.update({column: 1 for column in TRAINING_COLUMNS})
+    return [match, {"$project": projection}]
+
+
+def _raw_batches(collection, pipeline, batch_size):
+    try:
+        yield from collection.aggregate_raw_batches(pipeline, batchSize=batch_size)
+    except NotImplementedError:
+        # in-process stand-ins such as mongomock only implement aggregate()
+        for document in collection.aggregate(pipeline):
+            yield bson.encode(document)
+
+
+def _training_frame(documents):
+    columns = {column: [] for column in NUMERIC_COLUMNS + ["ingested_at"]}
+    difficulties = []
+    keys = []
+    for document in documents:
+        for column, values in columns.items():
+            value = document.get(column)
+            values.append(np.nan if value is None else value)
+        difficulties.append(difficulty_num(document.get("difficulty")))
+        keys.append(track_key(document.get("_id")))
+    df = pd.DataFrame({column: np.asarray(values, dtype=np.float64) for column, values in columns.items()})
+    df["difficulty_num"] = np.asarray(difficulties, dtype=np.int32)
+    df["track_key"] = np.asarray(keys, dtype=np.uint64)
+    return df
+
+
+def iter_training_batches(collection, batch_size=10000, since=None):
+    """Curated rows with the needed columns as one DataFrame per raw BSON batch.
+
+    Yields ``(DataFrame, bytes of the batch)``; only one batch is decoded at a time.
+    """
+    for batch in _raw_batches(collection, training_pipeline(since), batch_size):
+        yield _training_frame(bson.decode_all(batch)), len(batch)
+
+
+def load_training_columns(collection, batch_size=10000, since=None):
+    """Load only curated rows and needed columns; returns (DataFrame, bytes transferred).
+
+    Results arrive as raw BSON batches and are decoded straight into
+    per-column arrays, one batch at a time.
+    """
+    frames = [_training_frame([])]
+    transferred = 0
+    for df, size in iter_training_batches(collection, batch_size, since):
+        frames.append(df)
+        transferred += size
+    df = pd.concat(frames, ignore_index=True)
+    print(f"Loaded {len(df)} curated tracks ({transferred / 1e6:.1f} MB)")
+    return df, transferred
+
+
+def load_hike_catalog(collection, batch_size=10000):
+    """Curated tracks as a list of documents with the training columns, name, url and bounds."""
+    documents = []
+    for batch in _raw_batches(collection, catalog_pipeline(), batch_size):
+        documents.extend(bson.decode_all(batch))
+    print(f"Loaded {len(documents)} curated tracks for the catalog")
+    return documents
+
+
+def load_user_tracks(collection, batch_size=10000):
+    """Curated tracks with a user as a DataFrame of the training columns plus ``user`` and ``track_key``."""
+    documents = []
+    for batch in _raw_batches(collection, user_tracks_pipeline(), batch_size):
+        documents.extend(bson.decode_all(batch))
+    df = pd.DataFrame(documents, columns=TRAINING_COLUMNS + ["user"])
+    df["track_key"] = np.asarray([track_key(document.get("_id")) for document in documents], dtype=np.uint64)
+    print(f"Loaded {len(df)} curated tracks of {df['user'].nunique()} users")
+    return df
+
+
+def transfer_report(collection, batch_size=10000):
+    """Rows and bytes sent by the server for the full download and for the pushed-down query."""
+    before_rows = before_bytes = 0
+    try:
+        for batch in collection.find_raw_batches(projection=MONGO_PROJECTION, batch_size=batch_size):
+            before_bytes += len(batch)
+            before_rows += len(bson.decode_all(batch))
+    except NotImplementedError:
+        for document in collection.find(projection=MONGO_PROJECTION):
+            before_bytes += len(bson.encode(document))
+            before_rows += 1
+    after_rows = after_bytes = 0
+    for batch in _raw_batches(collection, training_pipeline(), batch_size):
+        after_bytes += len(batch)
+        after_rows += len(bson.decode_all(batch))
+    return {
+        "before": {"rows": before_rows, "bytes": before_bytes},
+        "after": {"rows": after_rows, "bytes": after_bytes},
+    }
+
+
+def feature_store_exists(path=FEATURE_STORE_DIR):
+    return Path(path, SCHEMA_NAME).exists()
+
+
+def load_tracks_mongo(collection, chunk_size=2000):
+    """All documents as one DataFrame, built chunk by chunk from a cursor."""
+    chunks = []
+    batch = []
+    cursor = collection.find(projection=MONGO_PROJECTION)
+    total_loaded = 0
+    for idx, doc in enumerate(cursor, start=1):
+        batch.append(doc)
+        total_loaded = idx
+        if idx % chunk_size == 0:
+            chunks.append(pd.DataFrame(batch))
+            print(f"Loaded {idx} tracks...")
+            batch.clear()
+    if batch:
+        chunks.append(pd.DataFrame(batch))
+        print(f"Loaded {total_loaded} tracks...")
+
+    return pd.concat(chunks, ignore_index=True).set_index("_id")
+
+
+def iter_feature_store_batches(path=FEATURE_STORE_DIR, since=None, batch_rows=100000):
+    """The feature store as DataFrames of ``batch_rows`` rows, sliced from the memory-mapped columns."""
+    features = load_features(path)
+    rows = len(next(iter(features.values()), ()))
+    for column in ["track_key"] + (["ingested_at"] if since is not None else []):
+        if column not in features:
+            raise SystemExit(f"Feature store {path} has no {column} column, rebuild it with a full import.")
+    for start in range(0, rows, batch_rows):
+        df = pd.DataFrame({column: values[start:start + batch_rows] for column, values in features.items()})
+        if since is not None:
+            df = df[df["ingested_at"] > since].reset_index(drop=True)
+        yield df
+
+
+def load_tracks_feature_store(path=FEATURE_STORE_DIR, since=None):
+    """The feature columns as a DataFrame backed by the memory-mapped column files."""
+    df = pd.DataFrame(load_features(path), copy=False)
+    if since is not None:
+        if "ingested_at" not in df:
+            raise SystemExit(f"Feature store {path} has no ingested_at column, rebuild it with a full import.")
+        df = df[df["ingested_at"] > since].reset_index(drop=True)
+    print(f"Loaded {len(df)} tracks from {path}")
+    return df
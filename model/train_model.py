@@ -1,4 +1,9 @@
+import argparse
+import datetime
+import json
 import os
+import pickle
+import time
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -9,82 +14,232 @@ import pandas as pd
 import seaborn as sn
 from pymongo import MongoClient
 
+from track_data import (
+    FEATURE_STORE_DIR,
+    HOLDOUT_RULE,
+    MONGO_PROJECTION,
+    TRAINING_COLUMNS,
+    feature_store_exists,
+    in_holdout,
+    iter_feature_store_batches,
+    iter_training_batches,
+    transfer_report,
+)
+from model_search import LEADERBOARD_NAME, run_search, select_candidates
+from streaming_stats import TrackStatistics
+from training_state import STATE_NAME, LinearStatistics, fetch_previous
+
+FEATURES = ['downhill', 'uphill', 'length_3d', 'max_elevation']
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--source",
+    choices=["auto", "mongo", "features"],
+    default="auto",
+    help="where to load the tracks from (auto: feature store if it exists, else MongoDB)",
+)
+parser.add_argument("--feature-store", default=str(FEATURE_STORE_DIR), help="feature store directory")
+parser.add_argument(
+    "--report-transfer",
+    action="store_true",
+    help="print rows and bytes sent by MongoDB with and without the pushed-down query",
+)
+parser.add_argument(
+    "--incremental",
+    action="store_true",
+    help="update the previous models with the tracks ingested since they were trained",
+)
+parser.add_argument(
+    "--previous",
+    default=".",
+    help="directory with the previous GradientBoostingRegressor.pkl and training state "
+    "(missing files are downloaded from the latest published model)",
+)
+parser.add_argument(
+    "--incremental-estimators",
+    type=int,
+    default=10,
+    help="boosting stages added to the previous ensemble in incremental mode",
+)
+parser.add_argument(
+    "--search",
+    action="store_true",
+    help="cross-validate the candidate models and publish the best one within the latency budget "
+    "instead of the fixed GradientBoostingRegressor",
+)
+parser.add_argument("--candidates", help="comma separated name patterns of the search candidates, e.g. 'gbr-*,hgb-100-*'")
+parser.add_argument("--folds", type=int, default=5, help="cross-validation folds of the search")
+parser.add_argument(
+    "--latency-budget-ms",
+    type=float,
+    default=1.0,
+    help="p99 single-row predict latency the selected model has to stay within",
+)
+parser.add_argument("--search-workers", type=int, help="processes for the search (default: one per CPU)")
+args = parser.parse_args()
+if args.search and args.incremental:
+    parser.error("--search runs on the full data set and cannot be combined with --incremental")
+started = time.perf_counter()
 env_path = Path(__file__).resolve().parent.parent / ".env"
 load_dotenv(env_path, override=True)
-mongo_uri = os.getenv("MONGO_DB_CONNECTION_STRING")
-if not mongo_uri:
-    raise SystemExit("Missing MongoDB URI. Set MONGO_DB_CONNECTION_STRING in .env or in the environment.")
-mongo_db = "tracks"
-mongo_collection = "tracks"
-
-client = MongoClient(mongo_uri)
-db = client[mongo_db]
-collection = db[mongo_collection]
-
-# fetch a single document
-projection = {"gpx": 0, "url": 0, "bounds": 0, "name": 0}
-track = collection.find_one(projection=projection)
-if not track:
-    raise SystemExit("No tracks found in MongoDB.")
-
-print("\n*** Loading Tracks from MongoDB ***")
-chunks = []
-batch = []
-chunk_size = 2000
-cursor = collection.find(projection=projection)
-total_loaded = 0
-for idx, doc in enumerate(cursor, start=1):
-    batch.append(doc)
-    total_loaded = idx
-    if idx % chunk_size == 0:
-        chunks.append(pd.DataFrame(batch))
-        print(f"Loaded {idx} tracks...")
-        batch.clear()
-if batch:
-    chunks.append(pd.DataFrame(batch))
-    print(f"Loaded {total_loaded} tracks...")
-
-df = pd.concat(chunks, ignore_index=True).set_index("_id")
-
-df['avg_speed'] = df['length_3d']/df['moving_time']
-df['difficulty_num'] = df['difficulty'].map(lambda x: int(x[1])).astype('int32')
-
-# drop na values
-df.dropna()
-df = df[df['avg_speed'] < 2] # an avg of > 2m/s is probably not a hiking activity
-df = df[df['min_elevation'] > 0]
-df = df[df['length_2d'] < 100000]
+
+since = None
+if args.incremental:
+    previous_dir = Path(args.previous)
+    previous_files = [STATE_NAME, "GradientBoostingRegressor.pkl"]
+    if not all((previous_dir / name).exists() for name in previous_files):
+        fetch_previous(previous_dir, previous_files)
+    try:
+        previous_state = LinearStatistics.load(previous_dir / STATE_NAME)
+    except ValueError as ex:
+        raise SystemExit(f"{ex}, run a full training first.")
+    since = previous_state.trained_until
+    if since is None:
+        raise SystemExit("Previous training state has no ingestion time, run a full training first.")
+    print(f"\n*** Incremental Training: tracks ingested after {datetime.datetime.fromtimestamp(since)} ***")
+
+source = args.source
+if source == "auto":
+    source = "features" if feature_store_exists(args.feature_store) else "mongo"
+
+load_started = time.time()
+if source == "features":
+    print("\n*** Loading Tracks from Feature Store ***")
+    batches = ((batch, 0) for batch in iter_feature_store_batches(args.feature_store, since=since))
+else:
+    mongo_uri = os.getenv("MONGO_DB_CONNECTION_STRING")
+    if not mongo_uri:
+        raise SystemExit("Missing MongoDB URI. Set MONGO_DB_CONNECTION_STRING in .env or in the environment.")
+    mongo_db = "tracks"
+    mongo_collection = "tracks"
+
+    client = MongoClient(mongo_uri)
+    db = client[mongo_db]
+    collection = db[mongo_collection]
+
+    # fetch a single document
+    track = collection.find_one(projection=MONGO_PROJECTION)
+    if not track:
+        raise SystemExit("No tracks found in MongoDB.")
+
+    if args.report_transfer:
+        report = transfer_report(collection)
+        print(f"\n{'*** Transfer ***':<20} {'rows':>10} {'MB':>10}")
+        for name, counts in report.items():
+            print(f"{name:<20} {counts['rows']:>10} {counts['bytes'] / 1e6:>10.2f}")
+
+    # curation rules and projection run on the server, see track_data.training_pipeline
+    print("\n*** Loading Tracks from MongoDB ***")
+    batches = iter_training_batches(collection, since=since)
+
+def curate(df):
+    df['avg_speed'] = df['length_3d']/df['moving_time']
+    if 'difficulty' in df:
+        df['difficulty_num'] = df['difficulty'].map(lambda x: int(x[1])).astype('int32')
+    else:
+        # keep the column order of the MongoDB path for the correlation matrix
+        df['difficulty_num'] = df.pop('difficulty_num')
+
+    # drop na values
+    df = df.dropna(subset=TRAINING_COLUMNS)
+    df = df[df['avg_speed'] < 2] # an avg of > 2m/s is probably not a hiking activity
+    df = df[df['min_elevation'] > 0]
+    df = df[df['length_2d'] < 100000]
+    return df
+
+# one pass over the batches: the report statistics are accumulated, only the training columns are kept
+statistics = None
+parts = []
+loaded = transferred = 0
+latest_ingested = None
+for batch, size in batches:
+    loaded += len(batch)
+    transferred += size
+    batch = curate(batch)
+    ingested_at = batch.pop('ingested_at') if 'ingested_at' in batch else None
+    holdout = in_holdout(batch.pop('track_key'))
+    if ingested_at is not None and ingested_at.notna().any():
+        batch_latest = ingested_at.max()
+        latest_ingested = batch_latest if latest_ingested is None else max(latest_ingested, batch_latest)
+    if statistics is None:
+        statistics = TrackStatistics(batch.select_dtypes('number').columns)
+    statistics.update(batch)
+    parts.append(batch[TRAINING_COLUMNS].assign(holdout=holdout))
+if source == "features":
+    print(f"Loaded {loaded} tracks from {args.feature_store}")
+    if not loaded and not args.incremental:
+        raise SystemExit("No tracks found in the feature store.")
+else:
+    print(f"Loaded {loaded} curated tracks ({transferred / 1e6:.1f} MB)")
+df = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=TRAINING_COLUMNS + ['holdout'])
 print(f"{len(df)} tracks processed.")
 
-corr = df.corr(numeric_only=True)
+if args.incremental and df.empty:
+    raise SystemExit("No new tracks since the previous training, nothing to update.")
+if statistics is None:
+    raise SystemExit("No curated tracks to train on.")
+if latest_ingested is not None:
+    trained_until = float(latest_ingested)
+else:
+    # documents imported before ingestion times were recorded
+    trained_until = since if args.incremental else load_started
+
+corr = statistics.correlation()
 
 print("\n*** Correlation Matrix ***")
 print(corr)
-plt.figure(figsize=(10, 8))
-sn.heatmap(corr, annot=True, fmt=".2f", annot_kws={"size": 7})
-static_dir = Path(__file__).resolve().parent.parent / "frontend" / "static" / "images"
-static_dir.mkdir(parents=True, exist_ok=True)
-plt.tight_layout()
-plt.savefig(static_dir / "heatmap.png", dpi=150)
-plt.close()
+print("\n*** Summary ***")
+print(statistics.summary().T)
+if args.incremental:
+    # the heatmap describes the whole data set, keep the one of the last full training
+    print("Incremental training, heatmap not updated.")
+else:
+    plt.figure(figsize=(10, 8))
+    sn.heatmap(corr, annot=True, fmt=".2f", annot_kws={"size": 7})
+    static_dir = Path(__file__).resolve().parent.parent / "frontend" / "static" / "images"
+    static_dir.mkdir(parents=True, exist_ok=True)
+    plt.tight_layout()
+    plt.savefig(static_dir / "heatmap.png", dpi=150)
+    plt.close()
 
 from sklearn.linear_model import LinearRegression
 from sklearn.metrics import mean_squared_error, r2_score
-from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import Normalizer
 
-y = df.reset_index()['moving_time']
-x = df.reset_index()[['downhill', 'uphill', 'length_3d', 'max_elevation']]
-
-x_train, x_test, y_train, y_test = train_test_split(x, y, test_size=0.20, random_state=42)
+# a fixed holdout by track, so full and incremental runs are evaluated on the same tracks
+test = df['holdout'].to_numpy(dtype=bool)
+x_train = df.loc[~test, FEATURES].reset_index(drop=True)
+y_train = df.loc[~test, 'moving_time'].reset_index(drop=True)
+new_statistics = LinearStatistics.from_rows(x_train, y_train, FEATURES)
+new_statistics.holdout_x = df.loc[test, FEATURES].to_numpy(dtype=float)
+new_statistics.holdout_y = df.loc[test, 'moving_time'].to_numpy(dtype=float)
+if x_train.empty:
+    raise SystemExit("All tracks of this run are in the holdout, nothing to train on.")
+evaluation = {}
 
 # Baseline Linear Regression
-lr = LinearRegression()
-lr.fit(x_train, y_train)
+fit_started = time.perf_counter()
+if args.incremental:
+    # refit from the merged sufficient statistics, equivalent to fitting all training rows so far
+    linear_state = previous_state.merge(new_statistics)
+    lr = linear_state.linear_regression()
+else:
+    linear_state = new_statistics
+    lr = LinearRegression()
+    lr.fit(x_train, y_train)
+linear_state.trained_until = trained_until
+evaluation['linear'] = {'fit_seconds': time.perf_counter() - fit_started}
+
+# in incremental mode the holdout rows of the previous runs plus those of the new tracks
+x_test = pd.DataFrame(linear_state.holdout_x, columns=FEATURES)
+y_test = linear_state.holdout_y
+if not len(x_test):
+    raise SystemExit("No tracks in the holdout, cannot evaluate the models.")
 
 y_pred_lr = lr.predict(x_test)
 r2 = r2_score(y_test, y_pred_lr)
 mse = mean_squared_error(y_test, y_pred_lr)
+evaluation['linear'].update(r2=r2, mse=mse)
 
 # Mean Squared Error / R2
 print(f"\n{'*** Models ***':<30} {'R2':>10} {'MSE':>14}")
@@ -92,15 +247,48 @@ print(f"{'Linear Regression':<30} {r2:>10.4f} {mse:>14.2f}")
 
 # GradientBoostingRegressor
 from sklearn.ensemble import GradientBoostingRegressor
-from sklearn.model_selection import train_test_split
 
-gbr = GradientBoostingRegressor(n_estimators=50, random_state=9000)
-gbr.fit(x_train, y_train)
+fit_started = time.perf_counter()
+if args.incremental:
+    # grow the previous ensemble: the new stages fit the residuals on the new tracks
+    with open(previous_dir / 'GradientBoostingRegressor.pkl', 'rb') as fid:
+        gbr = pickle.load(fid)
+    # a search may have published HistGradientBoostingRegressor, which counts its stages in max_iter
+    stages = next((name for name in ('n_estimators', 'max_iter') if name in gbr.get_params()), None)
+    if stages is None:
+        raise SystemExit(f"The previous {type(gbr).__name__} cannot be grown incrementally, run a full training.")
+    gbr.set_params(warm_start=True, **{stages: gbr.get_params()[stages] + args.incremental_estimators})
+    gbr.fit(x_train, y_train)
+    gbr_label = 'Gradient Boosting Regressor'
+elif args.search:
+    # the winner is already fit on the training split and takes the place of the boosting model
+    leaderboard, winner, gbr = run_search(
+        x_train,
+        y_train,
+        select_candidates(args.candidates),
+        folds=args.folds,
+        latency_budget_ms=args.latency_budget_ms,
+        workers=args.search_workers,
+    )
+    with open(LEADERBOARD_NAME, 'w', encoding='utf-8') as fid:
+        json.dump(
+            {'winner': winner, 'estimator': type(gbr).__name__, 'latency_budget_ms': args.latency_budget_ms,
+             'candidates': leaderboard},
+            fid,
+            indent=2,
+        )
+    gbr_label = f"Search: {winner}"
+else:
+    gbr = GradientBoostingRegressor(n_estimators=50, random_state=9000)
+    gbr.fit(x_train, y_train)
+    gbr_label = 'Gradient Boosting Regressor'
+evaluation['gradient_boosting'] = {'model': type(gbr).__name__, 'fit_seconds': time.perf_counter() - fit_started}
 y_pred_gbr = gbr.predict(x_test)
 r2 = r2_score(y_test, y_pred_gbr)
 mse = mean_squared_error(y_test, y_pred_gbr)
+evaluation['gradient_boosting'].update(r2=r2, mse=mse)
 
-print(f"{'Gradient Boosting Regressor':<30} {r2:>10.4f} {mse:>14.2f}")
+print(f"{gbr_label:<30} {r2:>10.4f} {mse:>14.2f}")
 
 def din33466(uphill, downhill, distance):
     km = distance / 1000.0
@@ -121,8 +309,6 @@ samples = [
     {"downhill": 100, "uphill": 250, "length_3d": 5000, "max_elevation": 1100},
 ]
 
-import datetime
-
 print(
     f"{'downhill':>8}  {'uphill':>6}  {'length_3d':>9}  {'max_elev':>8}  "
     f"{'DIN33466':>8}  {'SAC':>8}  {'Linear':>8}  {'Gradient':>8}"
@@ -152,9 +338,8 @@ for sample in samples:
 
 
 # Save To Disk
-import pickle
-
-# save the classifier
+# save the classifier; the file name is the boosting slot, after --search it may hold another
+# estimator type, recorded in metrics.json (models.gradient_boosting.model) and logged by the backend
 with open('GradientBoostingRegressor.pkl', 'wb') as fid:
     pickle.dump(gbr, fid)    
 
@@ -162,6 +347,25 @@ with open('GradientBoostingRegressor.pkl', 'wb') as fid:
 with open('LinearRegression.pkl', 'wb') as fid:
     pickle.dump(lr, fid)
 
+# state for the next incremental training
+linear_state.save(STATE_NAME)
+
+# evaluation on the fixed holdout of all tracks trained on so far, comparable between full and incremental runs
+metrics = {
+    'mode': 'incremental' if args.incremental else 'full',
+    'since': since,
+    'trained_until': trained_until,
+    'holdout': {'rule': HOLDOUT_RULE, 'rows': len(x_test)},
+    'rows': {'loaded': len(df), 'train': len(x_train), 'test': len(x_test), 'linear_total': linear_state.n},
+    'models': evaluation,
+    # per column count, mean, std, range and histogram of the curated tracks of this run
+    'data': statistics.to_json(),
+    'seconds': time.perf_counter() - started,
+}
+with open('metrics.json', 'w', encoding='utf-8') as fid:
+    json.dump(metrics, fid, indent=2)
+print(f"\n{metrics['mode'].capitalize()} training finished in {metrics['seconds']:.1f}s, metrics written to metrics.json")
+
 # load it again
 with open('GradientBoostingRegressor.pkl', 'rb') as fid:
     gbr_loaded = pickle.load(fid)
@@ -0,0 +1,152 @@
+"""Fit the per-user corrections of the global model (UserCorrections.npy/.json).
+
+Run after train_model.py, in the folder with GradientBoostingRegressor.pkl.
+Every user with at least ``--min-tracks`` curated tracks gets a ridge
+regression of log(recorded / predicted moving time) on the standardized
+downhill, uphill and length_3d, see backend/user_corrections.py. User ids
+are compared like the backend does, ignoring case and surrounding spaces.
+
+The global model was trained on every curated track outside the fixed
+holdout (``track_data.in_holdout``), so its own predictions of those tracks
+are in-sample and understate the residuals. Each of the other track_key
+folds is therefore predicted by a copy of the model fitted without it; the
+holdout fold by the global model itself, which never saw it. Before the
+final fit on all tracks, the corrections are fitted without the holdout
+fold to report how much they improve on the global model there.
+"""
+
+import argparse
+import datetime
+import os
+import pickle
+from pathlib import Path
+
+from dotenv import load_dotenv
+import numpy as np
+from pymongo import MongoClient
+from sklearn.base import clone
+
+import repo_paths  # noqa: F401
+from track_data import (
+    HOLDOUT_FOLD, HOLDOUT_FOLDS, HOLDOUT_RULE, TRAINING_COLUMNS, in_holdout, load_training_columns, load_user_tracks,
+)
+from user_corrections import (
+    CORRECTION_FEATURES, GLOBAL_MODEL_NAME, MAX_LOG_FACTOR, user_key, write_corrections,
+)
+
+FEATURES = ['downhill', 'uphill', 'length_3d', 'max_elevation']
+
+
+def fit_corrections(users, x, residual, penalty):
+    """Ridge fit per user in one batched solve; returns (user ids, track counts, parameters)."""
+    names, groups = np.unique(users, return_inverse=True)
+    design = np.column_stack([np.ones(len(x)), x])
+    width = design.shape[1]
+    gram = np.zeros((len(names), width, width))
+    np.add.at(gram, groups, design[:, :, None] * design[:, None, :])
+    moments = np.zeros((len(names), width))
+    np.add.at(moments, groups, design * residual[:, None])
+    params = np.linalg.solve(gram + penalty * np.eye(width), moments[:, :, None])[:, :, 0]
+    return names, np.bincount(groups, minlength=len(names)), params
+
+
+def out_of_fold_predictions(model, train, tracks):
+    """Predictions for ``tracks`` by models that were not trained on them, see the module docstring."""
+    folds = tracks["track_key"].to_numpy(dtype=np.uint64) % np.uint64(HOLDOUT_FOLDS)
+    train_folds = train["track_key"].to_numpy(dtype=np.uint64) % np.uint64(HOLDOUT_FOLDS)
+    prediction = np.empty(len(tracks))
+    for fold in np.unique(folds):
+        rows = folds == fold
+        if fold == HOLDOUT_FOLD:
+            prediction[rows] = model.predict(tracks.loc[rows, FEATURES])
+            continue
+        fit_rows = (train_folds != fold) & (train_folds != HOLDOUT_FOLD)
+        fold_model = clone(model).fit(train.loc[fit_rows, FEATURES], train.loc[fit_rows, "moving_time"])
+        prediction[rows] = fold_model.predict(tracks.loc[rows, FEATURES])
+    return prediction
+
+
+def predict_corrected(params_by_user, users, x, prediction):
+    params = np.array([params_by_user.get(user, np.zeros(x.shape[1] + 1)) for user in users])
+    # limited like UserCorrection.factor in the backend
+    exponent = np.clip(params[:, 0] + (params[:, 1:] * x).sum(axis=1), -MAX_LOG_FACTOR, MAX_LOG_FACTOR)
+    return prediction * np.exp(exponent)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--min-tracks", type=int, default=3, help="users with fewer tracks keep the global model")
+    parser.add_argument("--penalty", type=float, default=5.0, help="ridge penalty, in tracks, towards the global model")
+    args = parser.parse_args()
+
+    env_path = Path(__file__).resolve().parent.parent / ".env"
+    load_dotenv(env_path, override=True)
+    mongo_uri = os.getenv("MONGO_DB_CONNECTION_STRING")
+    if not mongo_uri:
+        raise SystemExit("Missing MongoDB URI. Set MONGO_DB_CONNECTION_STRING in .env or in the environment.")
+    collection = MongoClient(mongo_uri)["tracks"]["tracks"]
+    df = load_user_tracks(collection)
+    # the tracks the global model was trained on, to refit it per fold
+    train, _ = load_training_columns(collection)
+    with open(GLOBAL_MODEL_NAME, "rb") as fid:
+        model = pickle.load(fid)
+    train_corrections(df, train, model, Path("."), args.min_tracks, args.penalty)
+
+
+def train_corrections(df, train, model, model_dir, min_tracks=3, penalty=5.0):
+    df = df.dropna(subset=TRAINING_COLUMNS)
+    # one user however the id is spelled, as user_key in the backend
+    df = df.assign(user=df["user"].astype(str).str.strip().str.lower()).reset_index(drop=True)
+    df = df[(df["user"] != "").to_numpy()]
+    counts = df["user"].map(df["user"].value_counts())
+    df = df[(counts >= min_tracks).to_numpy()].reset_index(drop=True)
+    if df.empty:
+        raise SystemExit(f"No user has {min_tracks} or more curated tracks.")
+    train = train.dropna(subset=TRAINING_COLUMNS).reset_index(drop=True)
+    prediction = out_of_fold_predictions(model, train, df)
+    keep = prediction > 0
+    df, prediction = df[keep].reset_index(drop=True), prediction[keep]
+
+    values = df[CORRECTION_FEATURES].to_numpy(dtype=np.float64)
+    mean, scale = values.mean(axis=0), values.std(axis=0)
+    scale[scale == 0] = 1
+    x = (values - mean) / scale
+    users = df["user"].to_numpy()
+    actual = df["moving_time"].to_numpy(dtype=np.float64)
+    residual = np.log(actual) - np.log(prediction)
+
+    holdout = in_holdout(df["track_key"])
+    if not holdout.any() or holdout.all():
+        raise SystemExit("The user tracks do not cover both the holdout and the training folds.")
+    names, _, params = fit_corrections(users[~holdout], x[~holdout], residual[~holdout], penalty)
+    corrected = predict_corrected(dict(zip(names, params)), users[holdout], x[holdout], prediction[holdout])
+    global_mae = float(np.abs(prediction[holdout] - actual[holdout]).mean())
+    personal_mae = float(np.abs(corrected - actual[holdout]).mean())
+    print(f"\n*** Held-out tracks: {int(holdout.sum())} ***")
+    print(f"global model MAE        {global_mae / 60:8.1f} min")
+    print(f"with user corrections   {personal_mae / 60:8.1f} min ({personal_mae / global_mae - 1:+.1%})")
+
+    names, tracks, params = fit_corrections(users, x, residual, penalty)
+    header = write_corrections(
+        model_dir,
+        [user_key(name) for name in names],
+        tracks,
+        params,
+        {
+            "features": CORRECTION_FEATURES,
+            "mean": mean.tolist(),
+            "scale": scale.tolist(),
+            "penalty": penalty,
+            "min_tracks": min_tracks,
+            "holdout_rule": HOLDOUT_RULE,
+            "holdout_mae_s": {"global": global_mae, "personalized": personal_mae},
+            "built_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        },
+    )
+    size = Path(model_dir, "UserCorrections.npy").stat().st_size
+    print(f"Wrote corrections for {header['users']} users ({size / 1024:.0f} KB)")
+    return header
+
+
+if __name__ == "__main__":
+    main()
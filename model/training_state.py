@@ -0,0 +1,158 @@
+"""State that lets train_model.py update the published models with new tracks only.
+
+The linear model is refit from sufficient statistics instead of the rows:
+the count, the feature/target means and the centered scatter matrices
+(``XᵀX`` and ``Xᵀy`` around the mean). Statistics of two sets of rows merge
+exactly, so adding new tracks costs time proportional to the new tracks.
+Centering keeps the normal equations well conditioned for features in
+metres. ``trained_until`` is the largest ``ingested_at`` covered by the
+state; the next incremental run reads only documents ingested after it.
+
+The state also carries the rows of the fixed holdout (see
+``track_data.in_holdout``) seen so far, so that an incremental run is
+evaluated on the same tracks as a full training over the same data.
+"""
+
+import os
+from pathlib import Path
+
+import numpy as np
+from sklearn.linear_model import LinearRegression
+
+import repo_paths  # noqa: F401
+from model_store import latest_model_container
+
+STATE_NAME = "TrainingState.npz"
+MODEL_CONTAINER_PREFIX = "hikeplanner-model"
+
+
+class LinearStatistics:
+    """Mergeable sufficient statistics of a least-squares fit."""
+
+    def __init__(self, columns, n=0, mean_x=None, mean_y=0.0, sxx=None, sxy=None, trained_until=None,
+                 holdout_x=None, holdout_y=None):
+        self.columns = list(columns)
+        size = len(self.columns)
+        self.n = int(n)
+        self.mean_x = np.zeros(size) if mean_x is None else np.asarray(mean_x, dtype=np.float64)
+        self.mean_y = float(mean_y)
+        self.sxx = np.zeros((size, size)) if sxx is None else np.asarray(sxx, dtype=np.float64)
+        self.sxy = np.zeros(size) if sxy is None else np.asarray(sxy, dtype=np.float64)
+        self.trained_until = trained_until
+        # evaluation rows, not part of the statistics
+        self.holdout_x = np.empty((0, size)) if holdout_x is None else np.asarray(holdout_x, dtype=np.float64)
+        self.holdout_y = np.empty(0) if holdout_y is None else np.asarray(holdout_y, dtype=np.float64)
+
+    @classmethod
+    def from_rows(cls, x, y, columns):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if not len(x):
+            return cls(columns)
+        mean_x = x.mean(axis=0)
+        mean_y = float(y.mean())
+        centered_x = x - mean_x
+        return cls(columns, len(x), mean_x, mean_y, centered_x.T @ centered_x, centered_x.T @ (y - mean_y))
+
+    def merge(self, other):
+        """Statistics of the union of both row sets."""
+        if other.columns != self.columns:
+            raise ValueError(f"cannot merge statistics over {other.columns} into {self.columns}")
+        if not self.n:
+            merged = LinearStatistics(self.columns, other.n, other.mean_x, other.mean_y, other.sxx, other.sxy)
+        else:
+            n = self.n + other.n
+            weight = self.n * other.n / n
+            d_x = other.mean_x - self.mean_x
+            d_y = other.mean_y - self.mean_y
+            merged = LinearStatistics(
+                self.columns,
+                n,
+                self.mean_x + d_x * other.n / n,
+                self.mean_y + d_y * other.n / n,
+                self.sxx + other.sxx + np.outer(d_x, d_x) * weight,
+                self.sxy + other.sxy + d_x * d_y * weight,
+            )
+        merged.trained_until = max(
+            (value for value in (self.trained_until, other.trained_until) if value is not None), default=None
+        )
+        merged.holdout_x = np.concatenate([self.holdout_x, other.holdout_x])
+        merged.holdout_y = np.concatenate([self.holdout_y, other.holdout_y])
+        return merged
+
+    def linear_regression(self):
+        """A fitted ``LinearRegression`` equivalent to fitting all rows seen so far."""
+        if self.n < 2:
+            raise ValueError("not enough rows to fit a linear model")
+        coef = np.linalg.lstsq(self.sxx, self.sxy, rcond=None)[0]
+        model = LinearRegression()
+        model.coef_ = coef
+        model.intercept_ = self.mean_y - float(self.mean_x @ coef)
+        model.n_features_in_ = len(self.columns)
+        model.feature_names_in_ = np.asarray(self.columns, dtype=object)
+        model.rank_ = int(np.linalg.matrix_rank(self.sxx))
+        model.singular_ = np.linalg.svd(self.sxx, compute_uv=False)
+        return model
+
+    def save(self, path):
+        np.savez(
+            path,
+            columns=np.asarray(self.columns),
+            n=self.n,
+            mean_x=self.mean_x,
+            mean_y=self.mean_y,
+            sxx=self.sxx,
+            sxy=self.sxy,
+            trained_until=np.nan if self.trained_until is None else self.trained_until,
+            holdout_x=self.holdout_x,
+            holdout_y=self.holdout_y,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as state:
+            trained_until = float(state["trained_until"])
+            if "holdout_x" not in state:
+                raise ValueError(f"{path} has no holdout rows, it was written before the fixed holdout")
+            return cls(
+                [str(column) for column in state["columns"]],
+                int(state["n"]),
+                state["mean_x"],
+                float(state["mean_y"]),
+                state["sxx"],
+                state["sxy"],
+                None if np.isnan(trained_until) else trained_until,
+                state["holdout_x"],
+                state["holdout_y"],
+            )
+
+
+def fetch_previous(directory, files):
+    """Download ``files`` of the latest published model container into ``directory``.
+
+    Returns the container name. Only files missing locally are downloaded.
+    """
+    from azure.storage.blob import BlobServiceClient
+
+    conn_str = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
+    if not conn_str:
+        raise SystemExit("Missing AZURE_STORAGE_CONNECTION_STRING in .env or in the environment.")
+    client = BlobServiceClient.from_connection_string(conn_str)
+    try:
+        container_name = latest_model_container(client, MODEL_CONTAINER_PREFIX)
+    except ValueError:
+        raise SystemExit("No published model found, run a full training first.")
+
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    container_client = client.get_container_client(container_name)
+    for name in files:
+        target = directory / name
+        if target.exists():
+            continue
+        print(f"Downloading {name} from {container_name}...")
+        tmp_path = target.with_suffix(target.suffix + ".part")
+        with open(tmp_path, "wb") as handle:
+            container_client.download_blob(name).readinto(handle)
+        os.replace(tmp_path, target)
+    return container_name
@@ -0,0 +1,482 @@
+"""Run the ModelOps workflow locally as a DAG of cached stages.
+
+The stages are the scripts of .github/workflows/model.yml::
+
+    download -> curate -> transform -> train -----> users -> publish
+                                    \\-> similar ----------/
+
+Every stage gets a key: a hash of its code (the script and the local
+modules it imports, found by parsing the imports), its arguments, the
+fingerprints of its dependencies' outputs and the services it talks to.
+A stage whose key matches the last successful run and whose outputs are
+unchanged since is skipped; downstream stages see the same output
+fingerprints and are skipped as well. Outputs are fingerprinted by
+content, with the MD5 of each file cached by size and modification time
+in ``.pipeline/hashes.json``. ``download`` always runs,
+only the remote side knows whether the raw data changed, but it leaves
+unchanged files alone; ``curate`` runs with ``--incremental``. After a
+small data change only the affected stages run, and curate only
+re-validates the changed rows.
+
+Stages whose dependencies are done run concurrently (``--jobs``). Each
+stage runs in its own process; its output goes to the console with a
+prefix and to ``.pipeline/logs/<stage>.log``. The state is kept in
+``.pipeline/state.json``, and every run appends the wall time, peak
+memory and outcome of each stage to ``.pipeline/runs.jsonl``. The peak
+memory is the max RSS of the largest single process of the stage, the
+script or one of its worker processes, not the sum over its process tree.
+
+By default the stages use local stand-ins: MongoDB on localhost:27017 and
+Azurite for Azure Blob Storage, e.g.::
+
+    docker run -d -p 27017:27017 mongo
+    docker run -d -p 10000:10000 mcr.microsoft.com/azure-storage/azurite azurite-blob --blobHost 0.0.0.0
+    python data/upload_raw_data.py   # once, with the Azurite connection string
+
+    python pipeline.py
+    python pipeline.py --dry-run
+    python pipeline.py --force train --stage-args train="--search"
+
+Only ``--online`` uses the services of ``.env`` or the environment, which
+for the publish stage means releasing a new model version to production.
+"""
+
+from __future__ import annotations
+
+import argparse
+import ast
+import datetime
+import hashlib
+import json
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from urllib.parse import urlparse
+
+from dotenv import dotenv_values
+
+ROOT = Path(__file__).resolve().parent
+STATE_DIR = ROOT / ".pipeline"
+STATE_PATH = STATE_DIR / "state.json"
+RUNS_PATH = STATE_DIR / "runs.jsonl"
+HASHES_PATH = STATE_DIR / "hashes.json"
+LOG_DIR = STATE_DIR / "logs"
+# folders searched for the local modules a stage imports; model scripts add backend to sys.path
+MODULE_DIRS = ("data", "model", "backend")
+
+MONGO_KEY = "MONGO_DB_CONNECTION_STRING"
+AZURE_KEY = "AZURE_STORAGE_CONNECTION_STRING"
+LOCAL_MONGO = "mongodb://localhost:27017"
+# the well-known development account of Azurite, not a secret
+LOCAL_AZURE = (
+    "DefaultEndpointsProtocol=http;AccountName=devstoreaccount1;"
+    "AccountKey=Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw==;"
+    "BlobEndpoint=http://127.0.0.1:10000/devstoreaccount1;"
+)
+SERVICE_KEYS = {"mongo": MONGO_KEY, "azure": AZURE_KEY}
+
+
+class Stage:
+    """One script of the workflow with what it depends on and what it writes."""
+
+    def __init__(self, name, workdir, script, args=(), deps=(), outputs=(), services=(), always=False):
+        self.name = name
+        self.workdir = workdir
+        self.script = script
+        self.args = list(args)
+        self.deps = list(deps)
+        self.outputs = list(outputs)
+        self.services = list(services)
+        # run even if the key is unchanged: the inputs live outside the repository
+        self.always = always
+
+    @property
+    def script_path(self):
+        return ROOT / self.workdir / self.script
+
+
+STAGES = [
+    Stage(
+        "download", "data", "download_raw_data.py",
+        outputs=["data/gpx-data/hikr-raw-data"], services=["azure"], always=True,
+    ),
+    Stage(
+        "curate", "data", "collect-curate.py", args=["--incremental"], deps=["download"],
+        outputs=["data/gpx-data/gpx-collected-curated", "data/gpx-data/gpx-metadata"],
+    ),
+    Stage(
+        "transform", "data", "transform-validate.py", deps=["curate"],
+        outputs=["data/gpx-data/features"], services=["mongo"],
+    ),
+    Stage(
+        "train", "model", "train_model.py", deps=["transform"],
+        outputs=[
+            "model/GradientBoostingRegressor.pkl", "model/LinearRegression.pkl", "model/TrainingState.npz",
+            "model/metrics.json", "frontend/static/images/heatmap.png",
+        ],
+        services=["mongo", "azure"],
+    ),
+    Stage(
+        "similar", "model", "build_similar_hikes.py", deps=["transform"],
+        outputs=["model/SimilarHikes.npz"], services=["mongo"],
+    ),
+    Stage(
+        "users", "model", "train_user_corrections.py", deps=["transform", "train"],
+        outputs=["model/UserCorrections.npy", "model/UserCorrections.json"], services=["mongo"],
+    ),
+    Stage(
+        "publish", "model", "publish_model.py", deps=["train", "similar", "users"],
+        services=["azure"],
+    ),
+]
+
+
+def _local_imports(path):
+    """Top-level module names imported by a Python file."""
+    tree = ast.parse(path.read_bytes(), filename=str(path))
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module.split(".")[0])
+    return names
+
+
+def code_files(script_path):
+    """The script and, recursively, the repository modules it imports."""
+    seen = {}
+    pending = [script_path]
+    while pending:
+        path = pending.pop()
+        if path in seen:
+            continue
+        seen[path] = None
+        for name in _local_imports(path):
+            for folder in (path.parent,) + tuple(ROOT / folder for folder in MODULE_DIRS):
+                candidate = folder / f"{name}.py"
+                if candidate.exists():
+                    pending.append(candidate)
+                    break
+    return sorted(seen)
+
+
+def _file_md5(path):
+    digest = hashlib.md5()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileHashes:
+    """MD5 of files, recomputed only when their size or modification time changed."""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            self.entries = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            self.entries = {}
+        self.lock = threading.Lock()
+
+    def md5(self, file_path):
+        stat = file_path.stat()
+        name = file_path.relative_to(ROOT).as_posix()
+        with self.lock:
+            entry = self.entries.get(name)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        md5 = _file_md5(file_path)
+        with self.lock:
+            self.entries[name] = [stat.st_size, stat.st_mtime_ns, md5]
+        return md5
+
+    def save(self):
+        STATE_DIR.mkdir(exist_ok=True)
+        with self.lock:
+            tmp_path = self.path.with_suffix(".tmp")
+            tmp_path.write_text(json.dumps(self.entries), encoding="utf-8")
+            tmp_path.replace(self.path)
+
+
+def output_fingerprint(paths, hashes):
+    """Hash of the names and contents of all files below ``paths``; missing paths count as such.
+
+    By content rather than modification time: a stage that rewrites its
+    outputs unchanged, like curate without new tracks, does not invalidate
+    the stages after it.
+    """
+    digest = hashlib.sha256()
+    for relative in paths:
+        path = ROOT / relative
+        if path.is_dir():
+            files = sorted(item for item in path.rglob("*") if item.is_file())
+        else:
+            files = [path] if path.exists() else []
+        if not files:
+            digest.update(f"{relative}:missing\n".encode())
+        for item in files:
+            digest.update(f"{item.relative_to(ROOT).as_posix()}:{hashes.md5(item)}\n".encode())
+    return digest.hexdigest()
+
+
+def stage_key(stage, args, dep_outputs, environment):
+    """Hash of everything the stage's result depends on."""
+    description = {
+        "code": {path.relative_to(ROOT).as_posix(): _file_md5(path) for path in code_files(stage.script_path)},
+        "args": args,
+        "deps": {name: dep_outputs[name] for name in stage.deps},
+        # where the data goes, hashed: the connection strings carry credentials
+        "services": {
+            service: hashlib.sha256((environment.get(SERVICE_KEYS[service]) or "").encode()).hexdigest()
+            for service in stage.services
+        },
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+def _load_state():
+    try:
+        return json.loads(STATE_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_state(state):
+    STATE_DIR.mkdir(exist_ok=True)
+    tmp_path = STATE_PATH.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(state, indent=2), encoding="utf-8")
+    tmp_path.replace(STATE_PATH)
+
+
+class PipelineRunner:
+    """Schedules the stages in dependency order, skipping the cached ones."""
+
+    def __init__(self, stages, environment, stage_args=None, force=(), jobs=2, dry_run=False):
+        self.stages = {stage.name: stage for stage in stages}
+        self.environment = environment
+        self.stage_args = stage_args or {}
+        self.force = set(force)
+        self.jobs = jobs
+        self.dry_run = dry_run
+        self.state = _load_state()
+        self.outputs = {}
+        self.results = {}
+        self.print_lock = threading.Lock()
+        self.state_lock = threading.Lock()
+        self.hashes = FileHashes(HASHES_PATH)
+
+    def _args(self, stage):
+        return stage.args + self.stage_args.get(stage.name, [])
+
+    def _decide(self, stage):
+        """(key, reason to run or None to skip)."""
+        key = stage_key(stage, self._args(stage), self.outputs, self.environment)
+        previous = self.state.get(stage.name)
+        if stage.name in self.force:
+            return key, "forced"
+        if stage.always:
+            return key, "always runs"
+        if previous is None:
+            return key, "never ran"
+        if previous["key"] != key:
+            return key, "inputs changed"
+        if previous["outputs"] != output_fingerprint(stage.outputs, self.hashes):
+            return key, "outputs changed"
+        return key, None
+
+    def _log(self, name, line):
+        with self.print_lock:
+            print(f"[{name}] {line}", flush=True)
+
+    def _execute(self, stage):
+        """Run the stage's script; returns (exit code, peak RSS of its largest process in MB)."""
+        LOG_DIR.mkdir(parents=True, exist_ok=True)
+        command = [sys.executable, "-u", stage.script, *self._args(stage)]
+        with open(LOG_DIR / f"{stage.name}.log", "w", encoding="utf-8") as log:
+            process = subprocess.Popen(
+                command,
+                cwd=ROOT / stage.workdir,
+                env=self.environment,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                errors="replace",
+            )
+            for line in process.stdout:
+                log.write(line)
+                self._log(stage.name, line.rstrip())
+            # wait4 instead of wait: the resource usage of this child alone, not of all children;
+            # ru_maxrss is the peak of its largest process, concurrent pool workers are not added up
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+        return process.returncode, usage.ru_maxrss / 1024
+
+    def _run_stage(self, stage):
+        key, reason = self._decide(stage)
+        if reason is None:
+            self._log(stage.name, "unchanged, skipped")
+            return {"stage": stage.name, "status": "skipped", "outputs": self.state[stage.name]["outputs"]}
+        command = shlex.join([f"{stage.workdir}/{stage.script}", *self._args(stage)])
+        self._log(stage.name, f"{'would run' if self.dry_run else 'running'} ({reason}): {command}")
+        if self.dry_run:
+            # a download that finds nothing new leaves its outputs as they are
+            outputs = output_fingerprint(stage.outputs, self.hashes) if stage.always else f"pending-{key}"
+            return {"stage": stage.name, "status": "would run", "reason": reason, "outputs": outputs}
+
+        started = time.perf_counter()
+        code, peak_mb = self._execute(stage)
+        wall = time.perf_counter() - started
+        result = {"stage": stage.name, "reason": reason, "wall_s": round(wall, 2), "peak_rss_mb": round(peak_mb, 1)}
+        if code != 0:
+            self._log(stage.name, f"failed with exit code {code}, see {LOG_DIR / (stage.name + '.log')}")
+            return dict(result, status="failed", exit_code=code)
+        outputs = output_fingerprint(stage.outputs, self.hashes)
+        with self.state_lock:
+            self.state[stage.name] = {
+                "key": key,
+                "outputs": outputs,
+                "finished_at": datetime.datetime.now().isoformat(timespec="seconds"),
+                "wall_s": result["wall_s"],
+                "peak_rss_mb": result["peak_rss_mb"],
+            }
+            # saved after every stage, an interrupted run keeps what it finished
+            _save_state(self.state)
+        return dict(result, status="ran", outputs=outputs)
+
+    def run(self):
+        """Run all stages; returns the per-stage results in completion order."""
+        started = time.perf_counter()
+        pending = dict(self.stages)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    if any(dep not in self.results for dep in stage.deps):
+                        continue
+                    del pending[name]
+                    failed = [dep for dep in stage.deps if self.results[dep]["status"] in ("failed", "blocked")]
+                    if failed:
+                        self._log(name, f"not run, {', '.join(failed)} failed")
+                        self.results[name] = {"stage": name, "status": "blocked"}
+                        continue
+                    running[executor.submit(self._run_stage, stage)] = name
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as ex:
+                        self._log(name, f"failed: {ex}")
+                        result = {"stage": name, "status": "failed", "error": str(ex)}
+                    self.results[name] = result
+                    self.outputs[name] = result.get("outputs")
+        self.wall = time.perf_counter() - started
+        if not self.dry_run:
+            self.hashes.save()
+        return [self.results[name] for name in self.stages]
+
+    def report(self):
+        print(f"\n{'*** Stage ***':<14} {'status':<10} {'wall [s]':>9} {'peak [MB]':>10}  reason")
+        for name in self.stages:
+            result = self.results[name]
+            wall = f"{result['wall_s']:.1f}" if "wall_s" in result else "-"
+            peak = f"{result['peak_rss_mb']:.0f}" if "peak_rss_mb" in result else "-"
+            print(f"{name:<14} {result['status']:<10} {wall:>9} {peak:>10}  {result.get('reason', '')}")
+        print(f"{'total':<14} {'':<10} {self.wall:>9.1f}")
+        if self.dry_run:
+            return
+        STATE_DIR.mkdir(exist_ok=True)
+        with open(RUNS_PATH, "a", encoding="utf-8") as handle:
+            record = {
+                "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+                "wall_s": round(self.wall, 2),
+                "stages": [
+                    {key: value for key, value in self.results[name].items() if key != "outputs"}
+                    for name in self.stages
+                ],
+            }
+            handle.write(json.dumps(record) + "\n")
+
+
+def _reachable(host, port):
+    try:
+        with socket.create_connection((host, port), timeout=2):
+            return True
+    except OSError:
+        return False
+
+
+def offline_environment(mongo_uri):
+    """Environment of the stages with the local stand-ins; exits if they cannot be used."""
+    # every script loads .env with override=True, its values would replace the stand-ins
+    dotenv = dotenv_values(ROOT / ".env")
+    overridden = [key for key in (MONGO_KEY, AZURE_KEY) if dotenv.get(key)]
+    if overridden:
+        raise SystemExit(
+            f"{ROOT / '.env'} sets {', '.join(overridden)}, which the scripts prefer over the local "
+            "stand-ins. Move it aside, or run with --online."
+        )
+    mongo = urlparse(mongo_uri)
+    services = {"MongoDB": (mongo.hostname or "localhost", mongo.port or 27017), "Azurite": ("127.0.0.1", 10000)}
+    missing = [f"{name} on {host}:{port}" for name, (host, port) in services.items() if not _reachable(host, port)]
+    if missing:
+        raise SystemExit(f"Offline stand-ins not reachable: {', '.join(missing)}. See python pipeline.py --help.")
+    return dict(os.environ, **{MONGO_KEY: mongo_uri, AZURE_KEY: LOCAL_AZURE})
+
+
+def _stage_args(text):
+    name, _, args = text.partition("=")
+    return name, shlex.split(args)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0], epilog=__doc__.split("\n\n", 1)[1],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    names = [stage.name for stage in STAGES]
+    parser.add_argument(
+        "--online", action="store_true",
+        help="use the MongoDB and Azure Storage of .env instead of the local stand-ins; publish releases the model",
+    )
+    parser.add_argument("--mongo-uri", default=LOCAL_MONGO, help=f"local MongoDB stand-in (default {LOCAL_MONGO})")
+    parser.add_argument("-j", "--jobs", type=int, default=2, help="stages run at the same time")
+    parser.add_argument("--force", nargs="+", default=[], choices=names, metavar="STAGE", help="run even if cached")
+    parser.add_argument(
+        "--stage-args", type=_stage_args, action="append", default=[], metavar="STAGE=ARGS",
+        help="extra arguments of a stage's script, part of its key, e.g. train='--search'",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="show which stages would run")
+    args = parser.parse_args()
+
+    stage_args = {}
+    for name, extra in args.stage_args:
+        if name not in names:
+            parser.error(f"unknown stage {name!r} in --stage-args, choose from {', '.join(names)}")
+        stage_args.setdefault(name, []).extend(extra)
+    if args.online:
+        # what the scripts will use after loading .env, so that the keys follow a change of .env
+        dotenv = {key: value for key, value in dotenv_values(ROOT / ".env").items() if value}
+        environment = dict(os.environ, **dotenv)
+    else:
+        environment = offline_environment(args.mongo_uri)
+
+    runner = PipelineRunner(STAGES, environment, stage_args, args.force, args.jobs, args.dry_run)
+    results = runner.run()
+    runner.report()
+    if any(result["status"] in ("failed", "blocked") for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+import sys
+from pathlib import Path
+
+# the backend, model and data scripts import their neighbours as top-level modules
+ROOT = Path(__file__).resolve().parent.parent
+for directory in ("backend", "model", "data"):
+    sys.path.insert(0, str(ROOT / directory))
+# pipeline.py
+sys.path.append(str(ROOT))
@@ -0,0 +1,152 @@
+"""In-memory stand-in for the parts of ``azure.storage.blob`` the scripts use.
+
+Only the calls made by backend/model_store.py and data/raw_sync.py are
+implemented. ``fail_downloads`` / ``fail_blocks`` make the n-th and later
+calls raise, to test interrupted transfers.
+"""
+
+import hashlib
+import types
+import uuid
+
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+
+
+def _properties(name, blob):
+    return types.SimpleNamespace(
+        name=name,
+        size=len(blob.data),
+        etag=blob.etag,
+        content_settings=types.SimpleNamespace(content_md5=blob.md5),
+    )
+
+
+class StoredBlob:
+    def __init__(self, data, md5=None):
+        self.data = bytes(data)
+        self.md5 = bytearray(hashlib.md5(self.data).digest()) if md5 is None else md5
+        self.etag = f'"{uuid.uuid4().hex}"'
+
+
+class Download:
+    def __init__(self, data, chunk_size=1000):
+        self.data = data
+        self.chunk_size = chunk_size
+
+    def chunks(self):
+        for start in range(0, len(self.data), self.chunk_size):
+            yield self.data[start:start + self.chunk_size]
+
+    def readall(self):
+        return self.data
+
+    def readinto(self, stream):
+        stream.write(self.data)
+        return len(self.data)
+
+
+class BlobClient:
+    def __init__(self, container, name):
+        self.container = container
+        self.blob_name = name
+        self.url = f"fake://{container.name}/{name}"
+
+    def upload_blob(self, data, overwrite=False, content_settings=None):
+        if not overwrite and self.blob_name in self.container.blobs:
+            raise ResourceExistsError("blob exists")
+        data = data.read() if hasattr(data, "read") else data
+        self.container.blobs[self.blob_name] = StoredBlob(data, content_settings and content_settings.content_md5)
+
+    def stage_block(self, block_id, data, length=None, validate_content=False):
+        self.container.service.count("block")
+        self.container.staged.setdefault(self.blob_name, {})[block_id] = bytes(data)
+
+    def get_block_list(self, block_list_type="committed"):
+        if self.blob_name not in self.container.staged:
+            raise ResourceNotFoundError("no such blob")
+        blocks = self.container.staged[self.blob_name]
+        return [], [types.SimpleNamespace(id=block_id, size=len(data)) for block_id, data in blocks.items()]
+
+    def commit_block_list(self, blocks, content_settings=None):
+        staged = self.container.staged.pop(self.blob_name)
+        data = b"".join(staged[block.id] for block in blocks)
+        self.container.blobs[self.blob_name] = StoredBlob(data, content_settings and content_settings.content_md5)
+
+    def start_copy_from_url(self, url):
+        self.container.service.count("copy")
+        container_name, blob_name = url.split("://", 1)[1].split("/", 1)
+        source = self.container.service.containers[container_name].blobs[blob_name]
+        self.container.blobs[self.blob_name] = StoredBlob(source.data, source.md5)
+
+    def get_blob_properties(self):
+        return types.SimpleNamespace(copy=types.SimpleNamespace(status="success", status_description=None))
+
+
+class ContainerClient:
+    def __init__(self, service, name):
+        self.service = service
+        self.name = name
+        self.blobs = {}
+        self.staged = {}
+        self.metadata = {}
+
+    def create_container(self, metadata=None):
+        if self.name in self.service.containers:
+            raise ResourceExistsError("container exists")
+        self.metadata = dict(metadata or {})
+        self.service.containers[self.name] = self
+
+    def set_container_metadata(self, metadata=None):
+        self.metadata = dict(metadata or {})
+
+    def list_blobs(self):
+        return [_properties(name, blob) for name, blob in sorted(self.blobs.items())]
+
+    def get_blob_client(self, name):
+        return BlobClient(self, name)
+
+    def delete_blob(self, name):
+        del self.blobs[name]
+
+    def download_blob(self, name, offset=None, length=None, etag=None, match_condition=None):
+        self.service.count("download")
+        blob = self.blobs[getattr(name, "name", name)]
+        if etag is not None and etag != blob.etag:
+            raise ResourceNotFoundError("etag does not match")
+        start = offset or 0
+        end = len(blob.data) if length is None else start + length
+        return Download(blob.data[start:end])
+
+
+class BlobServiceClient:
+    def __init__(self):
+        self.containers = {}
+        self.calls = {"download": 0, "block": 0, "copy": 0}
+        self.fail_downloads = None
+        self.fail_blocks = None
+
+    def count(self, kind):
+        self.calls[kind] += 1
+        limit = {"download": self.fail_downloads, "block": self.fail_blocks}.get(kind)
+        if limit is not None and self.calls[kind] >= limit:
+            raise IOError(f"injected failure of {kind} {self.calls[kind]}")
+
+    def add_container(self, name, blobs, metadata=None):
+        container = ContainerClient(self, name)
+        container.create_container(metadata)
+        for blob_name, data in blobs.items():
+            container.blobs[blob_name] = StoredBlob(data)
+        return container
+
+    def get_container_client(self, name):
+        return self.containers.get(name) or ContainerClient(self, name)
+
+    def list_containers(self, name_starts_with=None, include_metadata=False):
+        return [
+            types.SimpleNamespace(name=name, metadata=container.metadata)
+            for name, container in sorted(self.containers.items())
+            if name_starts_with is None or name.startswith(name_starts_with)
+        ]
+
+    def delete_container(self, name):
+        del self.containers[name]
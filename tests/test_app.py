@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import GradientBoostingRegressor
+from sklearn.linear_model import LinearRegression
+
+import app as backend
+from user_corrections import RECORD_DTYPE, UserCorrections, user_key
+
+COLUMNS = ["downhill", "uphill", "length_3d", "max_elevation"]
+
+
+@pytest.fixture(scope="module")
+def models():
+    rng = np.random.default_rng(3)
+    data = np.column_stack([
+        rng.integers(0, 3000, 300), rng.integers(0, 3000, 300), rng.integers(500, 30000, 300), np.zeros(300),
+    ]).astype(np.float64)
+    frame = pd.DataFrame(columns=COLUMNS, data=data)
+    moving_time = data[:, 2] / 1.2 + data[:, 1] * 1.5 + data[:, 0] * 0.6
+    return backend.ModelBundle(
+        "test-1",
+        GradientBoostingRegressor(n_estimators=20, max_depth=3, random_state=0).fit(frame, moving_time),
+        LinearRegression().fit(frame, moving_time),
+        "compiled",
+    )
+
+
+@pytest.fixture
+def personal_client(models):
+    records = np.zeros(1, dtype=RECORD_DTYPE)
+    records["key"], records["tracks"], records["params"] = user_key("someone"), 5, [0.5, 0, 0, 0]
+    users = UserCorrections(records, {"mean": [0, 0, 0], "scale": [1, 1, 1]})
+    personal = backend.ModelBundle("test-2", models.gradient_model, models.linear_model, "compiled", users=users)
+    backend.prediction_cache.clear()
+    backend.user_cache.clear()
+    return backend.create_app(personal, background_tasks=False).test_client()
+
+
+@pytest.fixture
+def client(models):
+    backend.prediction_cache.clear()
+    return backend.create_app(models, background_tasks=False).test_client()
+
+
+def test_batch_rejects_non_finite_rows(client):
+    response = client.post(
+        "/api/predict/batch", data='[{"downhill": 100, "uphill": Infinity, "length": 1000}]',
+        content_type="application/json",
+    )
+    assert response.status_code == 400
+    response = client.post(
+        "/api/predict/batch", data='[{"downhill": 100, "uphill": 200, "length": 1e400}]',
+        content_type="application/json",
+    )
+    assert response.status_code == 400
+
+
+def test_batch_matches_single_predictions(client):
+    rows = [{"downhill": 300, "uphill": 700, "length": 10000}, {"downhill": 0, "uphill": 50, "length": 2000}]
+    batch = client.post("/api/predict/batch", json=rows).get_json()
+    single = [client.get("/api/predict", query_string=row).get_json() for row in rows]
+    assert [hike["time"] for hike in batch] == [hike["time"] for hike in single]
+
+
+def test_gpx_point_outside_a_segment_is_rejected(client):
+    response = client.post("/api/predict/gpx", data=b"<gpx><trk><trkpt lat='46' lon='8'/></trk></gpx>")
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("query", [
+    "downhill=nan", "uphill=inf", "length=-Infinity", "max_elevation=high", "bbox=nan,0,1,1", "bbox=0,0,1,inf",
+])
+def test_similar_rejects_invalid_numbers(client, query):
+    assert client.get(f"/api/similar?{query}").status_code == 400
+
+
+def test_similar_accepts_valid_numbers(client):
+    # the fixture has no similar hikes index: past the validation
+    assert client.get("/api/similar?downhill=10&max_elevation=2000&bbox=-1e9,-1e9,1e9,1e9").status_code == 503
+
+
+def test_unknown_users_share_the_cached_prediction(personal_client):
+    general = personal_client.get("/api/predict?downhill=300&uphill=700&length=10000").get_json()
+    for user in ("nobody", "anybody", "Someone-else"):
+        assert personal_client.get(f"/api/predict?downhill=300&uphill=700&length=10000&user={user}").get_json() == general
+    assert backend.prediction_cache.stats()["size"] == 1
+
+
+def test_user_ids_are_normalized(personal_client):
+    general = personal_client.get("/api/predict?downhill=300&uphill=700&length=10000").get_json()
+    for user in ("someone", "SomeOne", "%20someone%20"):
+        personal = personal_client.get(f"/api/predict?downhill=300&uphill=700&length=10000&user={user}").get_json()
+        assert personal["personalized"] and personal["time"] != general["time"]
+    assert backend.prediction_cache.stats()["size"] == 2
+    assert backend.user_cache.stats()["size"] == 1
@@ -0,0 +1,63 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import batching
+from batching import BatchQueueFull, BatchTimeout, MicroBatcher
+
+
+class Predictor:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.rows = []
+
+    def predict(self, rows):
+        time.sleep(self.delay)
+        self.rows.extend(np.asarray(rows).tolist())
+        return np.asarray(rows).sum(axis=1)
+
+
+def bundle(delay=0.0):
+    return SimpleNamespace(gradient_predictor=Predictor(delay), linear_predictor=Predictor())
+
+
+class BrokenMetrics:
+    def observe_value(self, *args):
+        raise RuntimeError("metrics are broken")
+
+
+def test_timeout_is_reported_as_overload(monkeypatch):
+    monkeypatch.setattr(batching, "RESULT_TIMEOUT", 0.05)
+    batcher = MicroBatcher(window=0, max_batch=8, max_queue=8)
+    with pytest.raises(BatchTimeout) as raised:
+        batcher.predict(bundle(delay=0.3), [1, 2, 3])
+    assert isinstance(raised.value, BatchQueueFull)
+
+
+def test_scheduler_survives_a_failing_batch():
+    batcher = MicroBatcher(window=0, max_batch=8, max_queue=8, metrics=BrokenMetrics())
+    models = bundle()
+    assert batcher.predict(models, [1, 2, 3]) == (6.0, 6.0)
+    thread = batcher._thread
+    assert batcher.predict(models, [1, 1, 1]) == (3.0, 3.0)
+    assert batcher._thread is thread and thread.is_alive()
+
+
+def test_cancelled_rows_are_skipped(monkeypatch):
+    monkeypatch.setattr(batching, "RESULT_TIMEOUT", 0.05)
+    batcher = MicroBatcher(window=0, max_batch=1, max_queue=8)
+    slow, fast = bundle(delay=0.3), bundle()
+    first = threading.Thread(target=pytest.raises, args=(BatchTimeout, batcher.predict, slow, [1, 1, 1]))
+    first.start()
+    time.sleep(0.01)
+    # waits behind the slow row and times out, the scheduler must not score it afterwards
+    with pytest.raises(BatchTimeout):
+        batcher.predict(fast, [2, 2, 2])
+    first.join()
+    while not slow.gradient_predictor.rows:
+        time.sleep(0.01)
+    assert batcher.predict(fast, [4, 4, 4]) == (12.0, 12.0)
+    assert fast.gradient_predictor.rows == [[4.0, 4.0, 4.0]]
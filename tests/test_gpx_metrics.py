@@ -0,0 +1,72 @@
+import datetime
+import io
+
+import gpxpy
+import numpy as np
+import pytest
+
+from gpx_metrics import read_metrics
+from track_metrics import compare_with_gpxpy
+
+
+def random_gpx(seed):
+    """A GPX document with several tracks and segments, gaps in the elevation, pauses and some long jumps."""
+    rng = np.random.default_rng(seed)
+    lines = ['<?xml version="1.0"?>', '<gpx version="1.1" creator="test" xmlns="http://www.topografix.com/GPX/1/1">']
+    lat, lon, ele = 46.5, 8.0, 1500.0
+    time = datetime.datetime(2024, 7, 1, 8, tzinfo=datetime.timezone.utc)
+    for _ in range(rng.integers(1, 3)):
+        lines.append("<trk><name>hike</name>")
+        for _ in range(rng.integers(1, 4)):
+            lines.append("<trkseg>")
+            for _ in range(rng.integers(0, 60)):
+                jump = 0.3 if rng.random() < 0.05 else 0.0003
+                lat += rng.normal(0, jump)
+                lon += rng.normal(0, jump)
+                ele += rng.normal(0, 8)
+                time += datetime.timedelta(seconds=int(rng.choice([5, 10, 600])))
+                stamp = f"<time>{time:%Y-%m-%dT%H:%M:%SZ}</time>"
+                if rng.random() < 0.1:
+                    lines.append(f'<trkpt lat="{lat:.7f}" lon="{lon:.7f}">{stamp}</trkpt>')
+                else:
+                    lines.append(f'<trkpt lat="{lat:.7f}" lon="{lon:.7f}"><ele>{ele:.1f}</ele>{stamp}</trkpt>')
+            lines.append("</trkseg>")
+        lines.append("</trk>")
+    lines.append("</gpx>")
+    return "\n".join(lines)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_read_metrics_matches_gpxpy(seed):
+    text = random_gpx(seed)
+    gpx = gpxpy.parse(text)
+    if not gpx.get_points_no():
+        pytest.skip("no points drawn")
+    metrics = read_metrics(io.BytesIO(text.encode()))
+    uphill, downhill = gpx.get_uphill_downhill()
+    min_elevation, max_elevation = gpx.get_elevation_extremes()
+    assert metrics.points == gpx.get_points_no()
+    assert metrics.uphill == pytest.approx(uphill, rel=1e-12)
+    assert metrics.downhill == pytest.approx(downhill, rel=1e-12)
+    assert metrics.length_2d == pytest.approx(gpx.length_2d(), rel=1e-12)
+    assert metrics.length_3d == pytest.approx(gpx.length_3d(), rel=1e-12)
+    assert (metrics.min_elevation, metrics.max_elevation) == (min_elevation, max_elevation)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_import_metrics_match_gpxpy(seed):
+    assert compare_with_gpxpy(gpxpy.parse(random_gpx(seed))) == {}
+
+
+@pytest.mark.parametrize("body", [
+    "<gpx><trk><trkpt lat='46' lon='8'/></trk></gpx>",
+    "<gpx><trk><trkseg><trkseg><trkpt lat='46' lon='8'/></trkseg></trkseg></trk></gpx>",
+    "<gpx><trk><trk><trkseg><trkpt lat='46' lon='8'/></trkseg></trk></trk></gpx>",
+    "<gpx><trk><trkseg><trkpt lat='nan' lon='8'/></trkseg></trk></gpx>",
+    "<gpx><trk><trkseg><trkpt lat='46' lon='8'><ele>inf</ele></trkpt></trkseg></trk></gpx>",
+    "<gpx><trk><trkseg></trkseg></trk></gpx>",
+    "<gpx><trk>",
+])
+def test_invalid_documents_raise_value_error(body):
+    with pytest.raises(ValueError):
+        read_metrics(io.BytesIO(body.encode()))
@@ -0,0 +1,102 @@
+import datetime
+import math
+
+import gpxpy.gpx
+import numpy as np
+import pytest
+
+from gpx_simplify import keep_mask, simplify_checked
+from track_metrics import ONE_DEGREE, compute_metrics
+
+
+def recursive_mask(lat, lon, ele, seconds, tolerance, elevation_tolerance):
+    """Textbook Douglas-Peucker, one chord per call, with the distances of keep_mask."""
+    count = len(lat)
+    keep = np.zeros(count, dtype=bool)
+    keep[[0, -1]] = True
+    x = lon * math.cos(math.radians(float(np.mean(lat)))) * ONE_DEGREE
+    y = lat * ONE_DEGREE
+    timed = not np.isnan(seconds).any() and (np.diff(seconds) >= 0).all()
+
+    def split(a, b):
+        if b - a < 2:
+            return
+        index = np.arange(a + 1, b)
+        dx, dy = x[b] - x[a], y[b] - y[a]
+        if timed:
+            span = seconds[b] - seconds[a]
+            fraction = (seconds[index] - seconds[a]) / span if span > 0 else np.zeros(len(index))
+        else:
+            squared = dx * dx + dy * dy
+            projection = (x[index] - x[a]) * dx + (y[index] - y[a]) * dy
+            fraction = np.clip(projection / squared, 0, 1) if squared > 0 else np.zeros(len(index))
+        horizontal = np.hypot(x[index] - x[a] - fraction * dx, y[index] - y[a] - fraction * dy) / tolerance
+        vertical = np.abs(ele[index] - ele[a] - fraction * (ele[b] - ele[a])) / elevation_tolerance
+        score = np.maximum(horizontal, np.nan_to_num(vertical))
+        worst = int(np.argmax(score))
+        if score[worst] > 1:
+            keep[index[worst]] = True
+            split(a, index[worst])
+            split(index[worst], b)
+
+    if count >= 3:
+        split(0, count - 1)
+    else:
+        keep[:] = True
+    return keep
+
+
+def random_track(rng, count, timed=True, missing_elevation=0.0):
+    steps = rng.normal(0, 2e-5, (count, 2)).cumsum(axis=0)
+    # occasional turns and stops
+    steps += np.repeat(rng.normal(0, 1e-4, (count // 50 + 1, 2)), 50, axis=0)[:count].cumsum(axis=0)
+    lat, lon = 46.5 + steps[:, 0], 8.0 + steps[:, 1]
+    ele = 1500 + rng.normal(0, 0.3, count).cumsum()
+    ele[rng.random(count) < missing_elevation] = np.nan
+    seconds = np.cumsum(rng.choice([0, 1, 1, 1, 5], count)).astype(np.float64)
+    if not timed:
+        seconds[:] = np.nan
+    return lat, lon, ele, seconds
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("timed", [True, False], ids=["timed", "untimed"])
+def test_keep_mask_matches_recursive_douglas_peucker(seed, timed):
+    rng = np.random.default_rng(seed)
+    track = random_track(rng, int(rng.integers(2, 800)), timed=timed, missing_elevation=0.05)
+    for tolerance, elevation_tolerance in [(2.0, 0.1), (5.0, 1.0), (0.5, 10.0)]:
+        expected = recursive_mask(*track, tolerance, elevation_tolerance)
+        np.testing.assert_array_equal(keep_mask(*track, tolerance, elevation_tolerance), expected)
+
+
+def gpx_of(lat, lon, ele, seconds):
+    start = datetime.datetime(2024, 7, 1, 8, tzinfo=datetime.timezone.utc)
+    segment = gpxpy.gpx.GPXTrackSegment()
+    for point in zip(lat.tolist(), lon.tolist(), ele.tolist(), seconds.tolist()):
+        segment.points.append(gpxpy.gpx.GPXTrackPoint(
+            point[0], point[1], elevation=None if math.isnan(point[2]) else point[2],
+            time=None if math.isnan(point[3]) else start + datetime.timedelta(seconds=point[3]),
+        ))
+    track = gpxpy.gpx.GPXTrack()
+    track.segments.append(segment)
+    gpx = gpxpy.gpx.GPX()
+    gpx.tracks.append(track)
+    return gpx
+
+
+def test_simplification_within_the_error_is_kept():
+    gpx = gpx_of(*random_track(np.random.default_rng(1), 2000))
+    stats = simplify_checked(gpx, 2.0, 0.1, max_error=0.05)
+    assert stats["accepted"] and stats["kept_points"] < stats["points"] == 2000
+    assert gpx.get_points_no() == stats["kept_points"]
+
+
+def test_simplification_beyond_the_error_is_undone():
+    gpx = gpx_of(*random_track(np.random.default_rng(2), 2000))
+    original = [(point.latitude, point.longitude, point.elevation, point.time) for point in gpx.walk(only_points=True)]
+    metrics = compute_metrics(gpx)
+    # a 500 m tolerance flattens the track far beyond 0.1% on its metrics
+    stats = simplify_checked(gpx, 500.0, 100.0, max_error=0.001)
+    assert not stats["accepted"] and stats["kept_points"] == stats["points"]
+    assert [(point.latitude, point.longitude, point.elevation, point.time) for point in gpx.walk(only_points=True)] == original
+    assert compute_metrics(gpx) == metrics
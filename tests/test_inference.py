@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import GradientBoostingRegressor
+from sklearn.linear_model import LinearRegression
+
+from inference import compile_model
+
+COLUMNS = ["downhill", "uphill", "length_3d", "max_elevation"]
+
+
+@pytest.fixture(scope="module")
+def training():
+    rng = np.random.default_rng(7)
+    rows = 400
+    data = np.column_stack([
+        rng.integers(0, 3000, rows),
+        rng.integers(0, 3000, rows),
+        rng.integers(500, 30000, rows),
+        np.where(rng.random(rows) < 0.5, 0, rng.integers(300, 4500, rows)),
+    ]).astype(np.float64)
+    moving_time = data[:, 2] / 1.2 + data[:, 1] * 1.5 + data[:, 0] * 0.6 + rng.normal(0, 300, rows)
+    return pd.DataFrame(columns=COLUMNS, data=data), moving_time
+
+
+@pytest.fixture(scope="module", params=["gradient", "linear"])
+def model(request, training):
+    frame, moving_time = training
+    if request.param == "gradient":
+        return GradientBoostingRegressor(n_estimators=50, max_depth=4, random_state=42).fit(frame, moving_time)
+    return LinearRegression().fit(frame, moving_time)
+
+
+def edge_rows(model, training):
+    """Random rows plus rows sitting exactly on, and one float32 step around, every split threshold."""
+    frame, _ = training
+    rng = np.random.default_rng(11)
+    rows = [frame.to_numpy()[:50], rng.uniform(0, 30000, (50, len(COLUMNS))), np.zeros((1, len(COLUMNS)))]
+    if hasattr(model, "estimators_"):
+        base = frame.to_numpy()[:1]
+        for estimator in model.estimators_[:, 0]:
+            tree = estimator.tree_
+            for feature, threshold in zip(tree.feature, tree.threshold):
+                if feature < 0:
+                    continue
+                for value in (threshold, np.nextafter(np.float32(threshold), np.float32(-np.inf)),
+                              np.nextafter(np.float32(threshold), np.float32(np.inf))):
+                    row = base.copy()
+                    row[0, feature] = value
+                    rows.append(row)
+    return np.concatenate(rows)
+
+
+def test_batch_matches_sklearn_exactly(model, training):
+    data = edge_rows(model, training)
+    expected = model.predict(pd.DataFrame(columns=COLUMNS, data=data))
+    np.testing.assert_array_equal(compile_model(model).predict(data), expected)
+
+
+def test_single_rows_match_sklearn_exactly(model, training):
+    data = edge_rows(model, training)
+    compiled = compile_model(model)
+    for row in data:
+        expected = model.predict(pd.DataFrame(columns=COLUMNS, data=[row]))[0]
+        assert compiled.predict_one(row.tolist()) == expected
+
+
+@pytest.mark.parametrize("value", [np.nan, np.inf])
+def test_non_finite_rows_are_rejected_like_sklearn(model, training, value):
+    frame, _ = training
+    data = frame.to_numpy()[:3].copy()
+    data[1, 2] = value
+    compiled = compile_model(model)
+    with pytest.raises(ValueError):
+        model.predict(pd.DataFrame(columns=COLUMNS, data=data))
+    with pytest.raises(ValueError):
+        compiled.predict(data)
+    with pytest.raises(ValueError):
+        compiled.predict_one(data[1].tolist())
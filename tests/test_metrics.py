@@ -0,0 +1,84 @@
+import shutil
+import threading
+import time
+
+from metrics import Metrics, SamplingProfiler, read_worker_snapshots, retire_worker_snapshot, write_worker_snapshot
+
+
+def _recurse(depth, stop):
+    if depth:
+        return _recurse(depth - 1, stop)
+    while not stop.is_set():
+        time.sleep(0)
+
+
+def test_collapsed_while_sampling_new_stacks():
+    stop = threading.Event()
+    # threads of many different depths keep adding new stacks while they are read
+    workers = [threading.Thread(target=_recurse, args=(depth, stop)) for depth in range(1, 40)]
+    for worker in workers:
+        worker.start()
+    profiler = SamplingProfiler(interval=0.0001)
+    profiler.start()
+    try:
+        deadline = time.monotonic() + 1.0
+        reads = 0
+        while time.monotonic() < deadline:
+            profiler.collapsed(limit=10)
+            reads += 1
+    finally:
+        profiler.stop()
+        stop.set()
+        for worker in workers:
+            worker.join()
+    lines = profiler.collapsed().splitlines()
+    assert reads and profiler.samples
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) >= profiler.samples
+    assert any("_recurse" in line for line in lines)
+
+
+def test_worker_snapshots_add_up(tmp_path):
+    first, second = Metrics(), Metrics()
+    for _ in range(3):
+        first.record_request("/api/predict", 200, 0.002)
+    second.record_request("/api/predict", 200, 0.004)
+    second.record_request("/api/predict", 500, 0.004)
+    second.observe("gradient_predict", 0.00002)
+    write_worker_snapshot(tmp_path, 1, first.snapshot(), {"cache_hits": 1})
+    # an exited worker: its counts stay in the totals, its gauges are dropped
+    write_worker_snapshot(tmp_path, 2, second.snapshot(), {"cache_hits": 7}, alive=False)
+
+    text = render(first, tmp_path)
+    assert 'hikeplanner_requests_total{endpoint="/api/predict",status="200"} 4' in text
+    assert 'hikeplanner_requests_total{endpoint="/api/predict",status="500"} 1' in text
+    assert 'hikeplanner_errors_total{endpoint="/api/predict"} 1' in text
+    assert 'hikeplanner_request_seconds_count{endpoint="/api/predict"} 5' in text
+    assert 'hikeplanner_stage_seconds_count{stage="gradient_predict"} 1' in text
+    assert 'hikeplanner_cache_hits{worker="1"} 1' in text
+    assert 'cache_hits{worker="2"}' not in text
+
+
+def test_retired_workers_stay_in_the_totals(tmp_path):
+    metrics = Metrics()
+    for worker in (1, 2, 3):
+        metrics.record_request("/api/predict", 200, 0.001)
+        write_worker_snapshot(tmp_path, worker, metrics.snapshot(), {}, alive=worker == 3)
+    expected = render(metrics, tmp_path)
+
+    assert retire_worker_snapshot(tmp_path, 1)
+    # a scrape that listed worker 2 before it was retired and read the retired totals after
+    shutil.copy(tmp_path / "worker-2.json", tmp_path / "copy")
+    assert retire_worker_snapshot(tmp_path, 2)
+    assert not retire_worker_snapshot(tmp_path, 2)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["copy", "retired.json", "worker-3.json"]
+    assert render(metrics, tmp_path) == expected
+    shutil.move(tmp_path / "copy", tmp_path / "worker-2.json")
+    assert render(metrics, tmp_path) == expected
+
+
+def render(metrics, directory):
+    workers = sorted(read_worker_snapshots(directory), key=lambda worker: str(worker["worker"]))
+    return metrics.render(
+        snapshot=Metrics.merge(worker["metrics"] for worker in workers),
+        worker_gauges={worker["worker"]: worker["gauges"] for worker in workers if worker["alive"]},
+    )
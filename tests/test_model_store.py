@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from fake_blob_storage import BlobServiceClient
+from model_store import MANIFEST_NAME, VERSIONS_DIR, latest_model_container, model_path, sync_model
+
+PREFIX = "hikeplanner-model"
+
+
+@pytest.fixture
+def service():
+    service = BlobServiceClient()
+    service.add_container(f"{PREFIX}-1", {"GradientBoostingRegressor.pkl": b"gbr-1", "LinearRegression.pkl": b"lr",
+                                          "SimilarHikes.npz": b"similar"})
+    return service
+
+
+def files(directory):
+    return {path.name: path.read_bytes() for path in directory.iterdir()}
+
+
+def test_latest_container(service):
+    service.add_container(f"{PREFIX}-10", {})
+    service.add_container(f"{PREFIX}-9", {})
+    assert latest_model_container(service, PREFIX) == f"{PREFIX}-10"
+
+
+def test_sync_then_up_to_date(service, tmp_path):
+    directory = sync_model(service, f"{PREFIX}-1", tmp_path)
+    assert directory == model_path(tmp_path)
+    assert files(directory) == {"GradientBoostingRegressor.pkl": b"gbr-1", "LinearRegression.pkl": b"lr",
+                                "SimilarHikes.npz": b"similar"}
+    downloads = service.calls["download"]
+    assert sync_model(service, f"{PREFIX}-1", tmp_path) == directory
+    assert service.calls["download"] == downloads
+
+
+def test_new_version_reuses_unchanged_and_drops_removed_blobs(service, tmp_path):
+    first = sync_model(service, f"{PREFIX}-1", tmp_path)
+    service.add_container(f"{PREFIX}-2", {"GradientBoostingRegressor.pkl": b"gbr-2", "LinearRegression.pkl": b"lr"})
+    downloads = service.calls["download"]
+    second = sync_model(service, f"{PREFIX}-2", tmp_path)
+    assert service.calls["download"] == downloads + 1
+    assert files(second) == {"GradientBoostingRegressor.pkl": b"gbr-2", "LinearRegression.pkl": b"lr"}
+    # the previous version stays for processes still serving it, older ones are pruned
+    assert first.exists()
+    service.add_container(f"{PREFIX}-3", {"GradientBoostingRegressor.pkl": b"gbr-3", "LinearRegression.pkl": b"lr"})
+    third = sync_model(service, f"{PREFIX}-3", tmp_path)
+    assert sorted(path.name for path in (tmp_path / VERSIONS_DIR).iterdir()) == sorted([second.name, third.name])
+
+
+def test_failed_download_keeps_the_active_version(service, tmp_path):
+    first = sync_model(service, f"{PREFIX}-1", tmp_path)
+    manifest = (tmp_path / MANIFEST_NAME).read_text()
+    service.add_container(f"{PREFIX}-2", {"GradientBoostingRegressor.pkl": b"gbr-2", "LinearRegression.pkl": b"lr-2",
+                                          "SimilarHikes.npz": b"similar"})
+    service.fail_downloads = service.calls["download"] + 2
+    with pytest.raises(IOError):
+        sync_model(service, f"{PREFIX}-2", tmp_path, max_workers=1)
+    assert (tmp_path / MANIFEST_NAME).read_text() == manifest
+    assert model_path(tmp_path) == first
+    assert files(first)["GradientBoostingRegressor.pkl"] == b"gbr-1"
+    assert [path.name for path in (tmp_path / VERSIONS_DIR).iterdir()] == [first.name]
+
+    service.fail_downloads = None
+    second = sync_model(service, f"{PREFIX}-2", tmp_path)
+    assert json.loads((tmp_path / MANIFEST_NAME).read_text())["container"] == f"{PREFIX}-2"
+    assert files(second)["LinearRegression.pkl"] == b"lr-2"
+
+
+def test_corrupted_cache_is_downloaded_again(service, tmp_path):
+    first = sync_model(service, f"{PREFIX}-1", tmp_path)
+    (first / "LinearRegression.pkl").write_bytes(b"garbage")
+    second = sync_model(service, f"{PREFIX}-1", tmp_path)
+    assert second != first
+    assert files(second)["LinearRegression.pkl"] == b"lr"
@@ -0,0 +1,132 @@
+import os
+
+import pytest
+
+import pipeline
+from pipeline import FileHashes, PipelineRunner, Stage, output_fingerprint, stage_key
+
+ENVIRONMENT = {pipeline.MONGO_KEY: pipeline.LOCAL_MONGO, pipeline.AZURE_KEY: pipeline.LOCAL_AZURE}
+
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    monkeypatch.setattr(pipeline, "ROOT", tmp_path)
+    state_dir = tmp_path / ".pipeline"
+    for name, path in {
+        "STATE_DIR": state_dir, "STATE_PATH": state_dir / "state.json", "RUNS_PATH": state_dir / "runs.jsonl",
+        "HASHES_PATH": state_dir / "hashes.json", "LOG_DIR": state_dir / "logs",
+    }.items():
+        monkeypatch.setattr(pipeline, name, path)
+    (tmp_path / "data").mkdir()
+    (tmp_path / "model").mkdir()
+    (tmp_path / "data" / "helper.py").write_text("VALUE = 1\n")
+    (tmp_path / "data" / "make.py").write_text(
+        "import sys\nimport helper\nopen('out.txt', 'w').write(str(helper.VALUE) + ' '.join(sys.argv[1:]))\n"
+    )
+    (tmp_path / "model" / "use.py").write_text(
+        "import os\n"
+        "open('result.txt', 'w').write(open('../data/out.txt').read() + os.environ['MONGO_DB_CONNECTION_STRING'])\n"
+    )
+    return tmp_path
+
+
+def stages():
+    return [
+        Stage("make", "data", "make.py", outputs=["data/out.txt"]),
+        Stage("use", "model", "use.py", deps=["make"], outputs=["model/result.txt"], services=["mongo"]),
+    ]
+
+
+def run(environment=ENVIRONMENT, **kwargs):
+    runner = PipelineRunner(stages(), environment, jobs=1, **kwargs)
+    return {result["stage"]: result for result in runner.run()}
+
+
+def test_output_fingerprint_follows_content_not_modification_time(root):
+    hashes = FileHashes(pipeline.HASHES_PATH)
+    missing = output_fingerprint(["data/outputs"], hashes)
+    (root / "data" / "outputs").mkdir()
+    assert output_fingerprint(["data/outputs"], hashes) == missing
+    (root / "data" / "outputs" / "a.txt").write_text("a")
+    written = output_fingerprint(["data/outputs"], hashes)
+    assert written != missing
+
+    (root / "data" / "outputs" / "a.txt").write_text("a")
+    os.utime(root / "data" / "outputs" / "a.txt", ns=(1, 1))
+    assert output_fingerprint(["data/outputs"], hashes) == written
+    (root / "data" / "outputs" / "a.txt").write_text("b")
+    assert output_fingerprint(["data/outputs"], hashes) != written
+    (root / "data" / "outputs" / "a.txt").rename(root / "data" / "outputs" / "b.txt")
+    assert output_fingerprint(["data/outputs"], hashes) != written
+
+
+def test_stage_key_covers_code_imports_args_dependencies_and_services(root):
+    make, use = stages()
+    key = stage_key(make, [], {}, ENVIRONMENT)
+    assert stage_key(make, [], {}, dict(ENVIRONMENT, UNRELATED="x")) == key
+    # make talks to no service
+    assert stage_key(make, [], {}, {}) == key
+    assert stage_key(make, ["--fast"], {}, ENVIRONMENT) != key
+    (root / "data" / "helper.py").write_text("VALUE = 2\n")
+    assert stage_key(make, [], {}, ENVIRONMENT) != key
+
+    key = stage_key(use, [], {"make": "a"}, ENVIRONMENT)
+    assert stage_key(use, [], {"make": "a", "other": "b"}, ENVIRONMENT) == key
+    assert stage_key(use, [], {"make": "b"}, ENVIRONMENT) != key
+    assert stage_key(use, [], {"make": "a"}, dict(ENVIRONMENT, **{pipeline.MONGO_KEY: "mongodb://prod"})) != key
+
+
+def test_decide(root):
+    runner = PipelineRunner(stages(), ENVIRONMENT, jobs=1)
+    make = runner.stages["make"]
+    assert runner._decide(make)[1] == "never ran"
+    run()
+
+    runner = PipelineRunner(stages(), ENVIRONMENT, jobs=1)
+    assert runner._decide(make)[1] is None
+    (root / "data" / "out.txt").write_text("changed by hand")
+    assert runner._decide(make)[1] == "outputs changed"
+    runner.stage_args = {"make": ["--fast"]}
+    assert runner._decide(make)[1] == "inputs changed"
+    runner.force = {"make"}
+    assert runner._decide(make)[1] == "forced"
+    make.always = True
+    runner.force = set()
+    assert runner._decide(make)[1] == "always runs"
+
+
+def test_unchanged_stages_are_skipped(root):
+    results = run()
+    assert [results[name]["status"] for name in ("make", "use")] == ["ran", "ran"]
+    assert (root / "model" / "result.txt").read_text() == "1" + pipeline.LOCAL_MONGO
+
+    results = run()
+    assert [results[name]["status"] for name in ("make", "use")] == ["skipped", "skipped"]
+
+    # another service invalidates only the stage that uses it
+    results = run(dict(ENVIRONMENT, **{pipeline.MONGO_KEY: "mongodb://elsewhere"}))
+    assert [results[name]["status"] for name in ("make", "use")] == ["skipped", "ran"]
+
+    # a code change that writes the same output does not invalidate the stages after it
+    (root / "data" / "make.py").write_text("import helper\nopen('out.txt', 'w').write(str(helper.VALUE))\n")
+    results = run(dict(ENVIRONMENT, **{pipeline.MONGO_KEY: "mongodb://elsewhere"}))
+    assert [results[name]["status"] for name in ("make", "use")] == ["ran", "skipped"]
+
+
+def test_failures_block_the_stages_after_them(root):
+    (root / "data" / "make.py").write_text("raise SystemExit(3)\n")
+    results = run()
+    assert (results["make"]["status"], results["make"]["exit_code"]) == ("failed", 3)
+    assert results["use"]["status"] == "blocked"
+
+
+def test_online_services_are_opt_in(root, monkeypatch):
+    calls = []
+    monkeypatch.setattr(pipeline, "offline_environment", lambda mongo_uri: calls.append(mongo_uri) or dict(ENVIRONMENT))
+    monkeypatch.setattr(pipeline, "STAGES", stages())
+    monkeypatch.setattr("sys.argv", ["pipeline.py", "--dry-run"])
+    pipeline.main()
+    assert calls == [pipeline.LOCAL_MONGO]
+    monkeypatch.setattr("sys.argv", ["pipeline.py", "--dry-run", "--online"])
+    pipeline.main()
+    assert calls == [pipeline.LOCAL_MONGO]
@@ -0,0 +1,52 @@
+import pytest
+
+from fake_blob_storage import BlobServiceClient
+from raw_sync import MANIFEST_NAME, check, download, upload
+
+PREFIX = "hikeplanner-raw-data"
+CHUNK_SIZE = 1024
+
+
+@pytest.fixture
+def service():
+    service = BlobServiceClient()
+    service.add_container(f"{PREFIX}-1", {"hikes.csv": b"hike\n" * 1000, "nested/track.gpx": b"<gpx/>"})
+    return service
+
+
+def test_round_trip(service):
+    check(service, chunk_size=CHUNK_SIZE)
+
+
+def test_download_keeps_local_files_unless_asked(service, tmp_path):
+    (tmp_path / "notes.txt").write_text("mine")
+    stats = download(service, tmp_path, PREFIX, chunk_size=CHUNK_SIZE)
+    assert (stats["downloaded"], stats["deleted"], stats["kept"]) == (2, 0, 1)
+    assert (tmp_path / "notes.txt").read_text() == "mine"
+    assert (tmp_path / "nested" / "track.gpx").read_bytes() == b"<gpx/>"
+
+    stats = download(service, tmp_path, PREFIX, chunk_size=CHUNK_SIZE, delete=True)
+    assert (stats["downloaded"], stats["deleted"], stats["kept"]) == (0, 1, 0)
+    assert sorted(path.relative_to(tmp_path).as_posix() for path in tmp_path.rglob("*") if path.is_file()) == [
+        MANIFEST_NAME, "hikes.csv", "nested/track.gpx",
+    ]
+
+
+def test_interrupted_download_resumes(service, tmp_path):
+    service.fail_downloads = 3
+    with pytest.raises(IOError):
+        download(service, tmp_path, PREFIX, workers=1, chunk_size=CHUNK_SIZE)
+    fetched = service.calls["download"]
+
+    service.fail_downloads = None
+    stats = download(service, tmp_path, PREFIX, workers=1, chunk_size=CHUNK_SIZE)
+    assert (tmp_path / "hikes.csv").read_bytes() == b"hike\n" * 1000
+    # 5 ranges of hikes.csv and 1 of the small file, the first 2 finished before the failure
+    assert service.calls["download"] - fetched == 4
+    assert stats["downloaded"] == 2
+
+
+def test_upload_of_unchanged_files_creates_no_container(service, tmp_path):
+    download(service, tmp_path, PREFIX, chunk_size=CHUNK_SIZE)
+    assert upload(service, tmp_path, PREFIX, chunk_size=CHUNK_SIZE)["container"] == f"{PREFIX}-1"
+    assert list(service.containers) == [f"{PREFIX}-1"]
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+import similar_hikes
+from similar_hikes import SimilarHikes, build_index
+
+HIKES = 3000
+REGION = (8.0, 46.0, 8.6, 46.5)
+
+
+@pytest.fixture(scope="module")
+def index(tmp_path_factory):
+    rng = np.random.default_rng(7)
+    features = np.column_stack([
+        rng.uniform(0, 2000, HIKES),
+        rng.uniform(0, 2000, HIKES),
+        rng.uniform(1000, 30000, HIKES),
+        rng.uniform(500, 4000, HIKES),
+    ])
+    low = np.column_stack([rng.uniform(6, 10, HIKES), rng.uniform(45.5, 47.5, HIKES)])
+    bounds = np.hstack([low, low + rng.uniform(0, 0.1, (HIKES, 2))])
+    bounds[::50] = np.nan
+    path = tmp_path_factory.mktemp("similar") / "SimilarHikes.npz"
+    names = [f"hike {hike}" for hike in range(HIKES)]
+    build_index(path, features, rng.uniform(3600, 30000, HIKES), bounds, names, names)
+    return SimilarHikes.load(path)
+
+
+def brute_force(index, features, k, region=None):
+    columns = len(features)
+    scaled = (index.features[:, :columns] - index.mean[:columns]) / index.scale[:columns]
+    point = (np.asarray(features) - index.mean[:columns]) / index.scale[:columns]
+    distances = np.sqrt(((scaled - point) ** 2).sum(axis=1))
+    ids = np.arange(len(index))
+    if region is not None:
+        box = index.bounds
+        inside = (box[:, 0] <= region[2]) & (box[:, 2] >= region[0]) & (box[:, 1] <= region[3]) & (box[:, 3] >= region[1])
+        ids, distances = ids[inside], distances[inside]
+    order = np.argsort(distances, kind="stable")[:k]
+    return ids[order].tolist(), distances[order]
+
+
+@pytest.mark.parametrize("features", [[800, 900, 12000, 2500], [800, 900, 12000]], ids=["4 features", "3 features"])
+@pytest.mark.parametrize("region", [None, REGION], ids=["everywhere", "bbox"])
+@pytest.mark.parametrize("direct_limit", [similar_hikes.DIRECT_RANKING_LIMIT, 0], ids=["direct", "tree"])
+def test_query_matches_brute_force(index, features, region, direct_limit, monkeypatch):
+    monkeypatch.setattr(similar_hikes, "DIRECT_RANKING_LIMIT", direct_limit)
+    expected_ids, expected_distances = brute_force(index, features, 10, region)
+    matches = index.query(features, k=10, region=region)
+    assert [hike for hike, _ in matches] == expected_ids
+    np.testing.assert_allclose([distance for _, distance in matches], expected_distances, rtol=1e-9)
+
+
+def test_missing_max_elevation_is_not_zero(index):
+    without = [hike for hike, _ in index.query([800, 900, 12000], k=10)]
+    with_zero = [hike for hike, _ in index.query([800, 900, 12000, 0], k=10)]
+    assert without != with_zero
+    with pytest.raises(ValueError):
+        index.query([800, 900], k=10)
+
+
+def test_regions_are_clipped_to_the_world(index):
+    world = [hike for hike, _ in index.query([800, 900, 12000], k=10, region=(-180, -90, 180, 90))]
+    assert [hike for hike, _ in index.query([800, 900, 12000], k=10, region=(-1e300, -1e300, 1e300, 1e300))] == world
+    assert len(index.in_region((-1e20, -1e20, 1e20, 1e20))) == len(index.in_region((-180, -90, 180, 90))) > 0
+
+
+@pytest.mark.parametrize("features, region", [
+    ([np.nan, 900, 12000], None),
+    ([800, np.inf, 12000, 2500], None),
+    ([800, 900, 12000], (np.nan, 0, 1, 1)),
+])
+def test_non_finite_queries_are_rejected(index, features, region):
+    with pytest.raises(ValueError):
+        index.query(features, k=10, region=region)
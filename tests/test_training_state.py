@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from azure.storage.blob import BlobServiceClient as AzureBlobServiceClient
+from sklearn.linear_model import LinearRegression
+
+from fake_blob_storage import BlobServiceClient
+from track_data import HOLDOUT_FOLDS, in_holdout
+from training_state import LinearStatistics, fetch_previous
+
+COLUMNS = ["downhill", "uphill", "length_3d", "max_elevation"]
+
+
+def rows(seed, count):
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(0, 3000, (count, len(COLUMNS)))
+    return x, x @ [0.5, 1.4, 0.8, 0.01] + rng.normal(0, 100, count)
+
+
+def test_merged_statistics_fit_like_all_rows(tmp_path):
+    x_old, y_old = rows(1, 300)
+    x_new, y_new = rows(2, 50)
+    previous = LinearStatistics.from_rows(x_old, y_old, COLUMNS)
+    previous.holdout_x, previous.holdout_y = x_old[:10], y_old[:10]
+    previous.save(tmp_path / "state.npz")
+    new = LinearStatistics.from_rows(x_new, y_new, COLUMNS)
+    new.holdout_x, new.holdout_y = x_new[:3], y_new[:3]
+
+    merged = LinearStatistics.load(tmp_path / "state.npz").merge(new)
+    expected = LinearRegression().fit(np.concatenate([x_old, x_new]), np.concatenate([y_old, y_new]))
+    np.testing.assert_allclose(merged.linear_regression().coef_, expected.coef_, rtol=1e-9)
+    np.testing.assert_array_equal(merged.holdout_x, np.concatenate([x_old[:10], x_new[:3]]))
+    np.testing.assert_array_equal(merged.holdout_y, np.concatenate([y_old[:10], y_new[:3]]))
+
+
+def test_state_without_holdout_is_rejected(tmp_path):
+    np.savez(tmp_path / "old.npz", columns=np.asarray(COLUMNS), n=0, mean_x=np.zeros(4), mean_y=0.0,
+             sxx=np.zeros((4, 4)), sxy=np.zeros(4), trained_until=np.nan)
+    with pytest.raises(ValueError):
+        LinearStatistics.load(tmp_path / "old.npz")
+
+
+def test_holdout_is_a_fixed_fold_of_the_keys():
+    keys = np.arange(1000, dtype=np.uint64) * np.uint64(7919)
+    mask = in_holdout(keys)
+    np.testing.assert_array_equal(mask, in_holdout(keys))
+    assert mask.sum() == 1000 // HOLDOUT_FOLDS
+
+
+def test_fetch_previous_downloads_from_the_latest_container(tmp_path, monkeypatch):
+    service = BlobServiceClient()
+    service.add_container("hikeplanner-model-2", {"TrainingState.npz": b"old"})
+    service.add_container("hikeplanner-model-10", {"TrainingState.npz": b"new", "GradientBoostingRegressor.pkl": b"gbr"})
+    monkeypatch.setenv("AZURE_STORAGE_CONNECTION_STRING", "UseDevelopmentStorage=true")
+    monkeypatch.setattr(AzureBlobServiceClient, "from_connection_string", staticmethod(lambda conn_str: service))
+    (tmp_path / "GradientBoostingRegressor.pkl").write_bytes(b"local")
+
+    assert fetch_previous(tmp_path, ["TrainingState.npz", "GradientBoostingRegressor.pkl"]) == "hikeplanner-model-10"
+    assert (tmp_path / "TrainingState.npz").read_bytes() == b"new"
+    assert (tmp_path / "GradientBoostingRegressor.pkl").read_bytes() == b"local"
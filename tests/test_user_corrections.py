@@ -0,0 +1,66 @@
+import math
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.tree import DecisionTreeRegressor
+
+from track_data import in_holdout
+from train_user_corrections import FEATURES, out_of_fold_predictions, predict_corrected, train_corrections
+from user_corrections import GLOBAL_MODEL_NAME, MAX_FACTOR, UserCorrection, UserCorrections
+
+
+def tracks(count, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "downhill": rng.uniform(0, 2000, count),
+        "uphill": rng.uniform(0, 2000, count),
+        "length_3d": rng.uniform(1000, 30000, count),
+        "max_elevation": rng.uniform(500, 4000, count),
+    })
+    df["moving_time"] = df["length_3d"] / 1.2 + df["uphill"] * 1.5 + rng.normal(0, 600, count) + 3000
+    df["track_key"] = rng.integers(0, 2**63, count, dtype=np.uint64)
+    return df
+
+
+@pytest.mark.parametrize("standardized, expected", [
+    ([1e5, 0, 0], MAX_FACTOR),
+    ([-1e5, 0, 0], 1 / MAX_FACTOR),
+    ([1e300, 1e300, 0], MAX_FACTOR),
+    ([0, 0, 0], math.exp(0.1)),
+])
+def test_factor_is_bounded(standardized, expected):
+    assert UserCorrection(0.1, [0.05] * 3, 3).factor(standardized) == pytest.approx(expected)
+
+
+def test_training_evaluation_uses_the_same_factor():
+    params = np.array([0.1, 0.05, -0.2, 0.3])
+    x = np.array([[0.5, -1.0, 2.0], [1e5, 0, 0], [0, 1e5, 0]])
+    corrected = predict_corrected({"someone": params}, ["someone"] * len(x), x, np.full(len(x), 3600.0))
+    correction = UserCorrection(params[0], params[1:].tolist(), 3)
+    np.testing.assert_allclose(corrected, [3600.0 * correction.factor(row) for row in x.tolist()])
+
+
+def test_tracks_are_predicted_by_models_that_did_not_see_them():
+    train = tracks(400)
+    holdout = in_holdout(train["track_key"])
+    # an unlimited tree reproduces its training rows exactly
+    model = DecisionTreeRegressor(random_state=0).fit(train.loc[~holdout, FEATURES], train.loc[~holdout, "moving_time"])
+    prediction = out_of_fold_predictions(model, train, train)
+    np.testing.assert_array_equal(prediction[holdout], model.predict(train.loc[holdout, FEATURES]))
+    assert not np.isclose(prediction[~holdout], train.loc[~holdout, "moving_time"]).any()
+
+
+def test_user_ids_are_merged_like_the_backend_looks_them_up(tmp_path):
+    train = tracks(400)
+    model = DecisionTreeRegressor(max_depth=4, random_state=0).fit(train[FEATURES], train["moving_time"])
+    with open(tmp_path / GLOBAL_MODEL_NAME, "wb") as fid:
+        pickle.dump(model, fid)
+    users = train.sample(60, random_state=1).reset_index(drop=True)
+    users["user"] = ["Someone", " someone", "SOMEONE ", "other"] * 15
+    header = train_corrections(users, train, model, tmp_path, min_tracks=3)
+    assert header["users"] == 2
+    corrections = UserCorrections.load(tmp_path)
+    assert corrections.get("someone").tracks == 45
+    assert corrections.get("Other").tracks == 15